@@ -0,0 +1,30 @@
+"""
+Gunicorn settings: gunicorn -c config/gunicorn.py config.wsgi
+
+Rolling deploys (see config.health):
+1. python manage.py drain: readiness fails in every worker, while requests are still served
+2. wait for the load balancer to stop routing requests to the node (e.g. its deregistration delay)
+3. stop gunicorn (SIGTERM): workers finish their requests in progress and flush queued work before exiting
+"""
+import os
+
+
+bind = '0.0.0.0:8000'
+workers = int(os.environ.get('GUNICORN_WORKERS', 3))
+# seconds workers are given to finish their requests on shutdown, at least HEALTH_DRAIN_TIMEOUT
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 35))
+
+
+def on_starting(server):
+    # a drain file left by a previous deploy would keep the new workers from being ready
+    from config.health import get_drain_file
+    try:
+        os.remove(get_drain_file())
+    except FileNotFoundError:
+        pass
+
+
+def worker_exit(server, worker):
+    from config.health import drain
+    if not drain():
+        server.log.warning('Worker %s exited with requests in progress', worker.pid)
@@ -0,0 +1,241 @@
+"""
+Liveness and readiness of the web process, and graceful drain for rolling deploys.
+
+- liveness (/health/live/, and /health/): the process serves requests, nothing is checked
+- readiness (/health/ready/): the databases (catalog and shards), the cache and the migrations are available,
+  and the process isn't draining. Checks run in a background thread every HEALTH_CHECK_INTERVAL seconds
+  (started on first use in each process), and probes only read their last results. Results older than
+  HEALTH_CHECK_MAX_AGE (e.g. a check hung on an unreachable database) are failing.
+
+Drain: while the HEALTH_DRAIN_FILE exists (see the drain management command), readiness fails in every worker,
+so that the load balancer stops routing requests to the node while they are still served. When the worker
+then exits (see config/gunicorn.py), drain() waits for the requests in progress (counted by InFlightMiddleware)
+and flushes queued work (the logging queue, see config.logging) within HEALTH_DRAIN_TIMEOUT seconds.
+"""
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.db.migrations.executor import MigrationExecutor
+
+from .logging import QueueHandler
+
+
+log = logging.getLogger(__name__)
+
+CACHE_CHECK_KEY = 'config:health'
+
+
+def check_database(alias):
+    """
+    :param alias: str, database alias
+    :return: str, detail; raises an exception if the database is unavailable
+    """
+    connection = connections[alias]
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+            cursor.fetchone()
+    finally:
+        # checks run in their own thread, whose connection would otherwise stay open
+        connection.close()
+    return 'ok'
+
+
+def check_cache():
+    """
+    :return: str, detail; raises an exception if the cache is unavailable
+    """
+    value = str(time.time())
+    cache.set(CACHE_CHECK_KEY, value, 60)
+    if cache.get(CACHE_CHECK_KEY) != value:
+        raise RuntimeError('cache value not stored')
+    return 'ok'
+
+
+def check_migrations(alias):
+    """
+    :param alias: str, database alias
+    :return: str, detail; raises an exception if migrations are not applied
+    """
+    connection = connections[alias]
+    try:
+        executor = MigrationExecutor(connection)
+        plan = executor.migration_plan(executor.loader.graph.leaf_nodes())
+    finally:
+        connection.close()
+    if plan:
+        raise RuntimeError('{} unapplied migrations, e.g. {}'.format(len(plan), plan[0][0]))
+    return 'ok'
+
+
+def get_checks():
+    """
+    :return: list of (name, function, recheck) tuples; checks that pass with a false recheck are not run again
+    """
+    checks = [
+        ('database:{}'.format(alias), lambda alias=alias: check_database(alias), True) for alias in connections
+    ]
+    checks.append(('cache', check_cache, True))
+    # migrations are only applied by a deploy, which starts new processes
+    checks.extend(
+        ('migrations:{}'.format(alias), lambda alias=alias: check_migrations(alias), False) for alias in connections
+    )
+    return checks
+
+
+class HealthChecker(threading.Thread):
+    """
+    Runs the readiness checks every interval seconds, keeping their last results
+    """
+
+    def __init__(self, checks, interval=10):
+        super().__init__(daemon=True, name='health-checker')
+        self.checks = checks
+        self.interval = interval
+        # {name: (passed, detail, time)}, replaced as a whole so that readers don't need a lock
+        self.results = {}
+        self._stopped = threading.Event()
+
+    def run_checks(self):
+        results = dict(self.results)
+        for name, function, recheck in self.checks:
+            if not recheck and results.get(name, (False,))[0]:
+                results[name] = (True, results[name][1], time.time())
+                continue
+            try:
+                results[name] = (True, function(), time.time())
+            except Exception as err:
+                if results.get(name, (True,))[0]:
+                    log.warning('Readiness check %s failed: %s', name, err)
+                results[name] = (False, str(err) or err.__class__.__name__, time.time())
+            self.results = dict(results)
+
+    def run(self):
+        while True:
+            self.run_checks()
+            if self._stopped.wait(self.interval):
+                return
+
+    def stop(self):
+        self._stopped.set()
+
+
+_checker = None
+_checker_pid = None
+_checker_lock = threading.Lock()
+
+_in_flight = 0
+_in_flight_lock = threading.Condition()
+_draining = threading.Event()
+
+
+def get_checker():
+    """
+    :return: HealthChecker of this process, started on first use (e.g. in each worker after a fork)
+    """
+    global _checker, _checker_pid
+    with _checker_lock:
+        if _checker_pid != os.getpid():
+            _checker = HealthChecker(get_checks(), getattr(settings, 'HEALTH_CHECK_INTERVAL', 10))
+            _checker.start()
+            _checker_pid = os.getpid()
+    return _checker
+
+
+def get_drain_file():
+    """
+    :return: str, path of the file whose existence puts the workers in drain mode
+    """
+    return getattr(settings, 'HEALTH_DRAIN_FILE', None) or os.path.join(tempfile.gettempdir(), 'poll-drain')
+
+
+def is_draining():
+    """
+    :return: bool, True if the process is draining
+    """
+    return _draining.is_set() or os.path.exists(get_drain_file())
+
+
+def get_readiness():
+    """
+    Last results of the readiness checks, without running them
+    :return: (bool, dict) tuple: ready, and details: status, and per check: ok, detail, age (seconds)
+    """
+    checker = get_checker()
+    max_age = getattr(settings, 'HEALTH_CHECK_MAX_AGE', 3 * checker.interval)
+    now = time.time()
+    checks = {}
+    for name, (passed, detail, checked) in checker.results.items():
+        age = now - checked
+        if passed and age > max_age:
+            passed, detail = False, 'stale result'
+        checks[name] = {'ok': passed, 'detail': detail, 'age': round(age, 1)}
+    if is_draining():
+        status = 'draining'
+    elif not all(check['ok'] for check in checks.values()):
+        status = 'not ready'
+    elif len(checks) < len(checker.checks):
+        # checks that haven't run yet, e.g. waiting to connect to a database
+        status = 'starting'
+    else:
+        status = 'ready'
+    ready = status == 'ready'
+    return ready, {'status': status, 'checks': checks}
+
+
+def get_in_flight():
+    """
+    :return: int, number of requests in progress in this process
+    """
+    return _in_flight
+
+
+class InFlightMiddleware:
+    """
+    Counts the requests in progress, so that a draining worker can wait for them (see drain).
+    Must be the first middleware
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        global _in_flight
+        with _in_flight_lock:
+            _in_flight += 1
+        try:
+            return self.get_response(request)
+        finally:
+            with _in_flight_lock:
+                _in_flight -= 1
+                _in_flight_lock.notify_all()
+
+
+def drain(timeout=None):
+    """
+    Fail readiness, wait for the requests in progress, and flush queued work (logging queues), before exiting
+    :param timeout: float, seconds (default: HEALTH_DRAIN_TIMEOUT)
+    :return: bool, True if all requests finished within the timeout
+    """
+    if timeout is None:
+        timeout = getattr(settings, 'HEALTH_DRAIN_TIMEOUT', 30)
+    _draining.set()
+    with _in_flight_lock:
+        finished = _in_flight_lock.wait_for(lambda: _in_flight == 0, timeout)
+    if not finished:
+        log.warning('Drain timed out with %s requests in progress', _in_flight)
+    # queue handlers write their queued records when stopped
+    loggers = [logging.getLogger()] + list(logging.Logger.manager.loggerDict.values())
+    handlers = {handler for logger in loggers for handler in getattr(logger, 'handlers', [])}
+    for handler in handlers:
+        if isinstance(handler, QueueHandler):
+            handler.stop()
+    if _checker is not None and _checker_pid == os.getpid():
+        _checker.stop()
+    return finished
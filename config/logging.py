@@ -0,0 +1,297 @@
+"""
+Logging pipeline that keeps log I/O off the request thread.
+
+- QueueHandler: records are put on a bounded in-memory queue by the request thread (without formatting them),
+  and formatted and written by a QueueListener thread. When the queue is full records are dropped, not waited for.
+- JsonFormatter: one json object per record, including the "extra" fields of the record
+- RedactingFilter: masks secrets (e.g. consumer secrets, oauth signatures, session keys) in messages and extra fields
+- SamplingFilter: keeps a fraction of the debug records of high-volume loggers
+
+Log calls must pass their arguments lazily (log.debug('key: %s', value)), so that nothing is formatted for records
+that are disabled or sampled out. Arguments are formatted in the listener thread, so they must not be mutated after
+the log call.
+
+Example LOGGING setting (see config/settings/local.py):
+    'filters': {
+        'sample': {'()': 'config.logging.SamplingFilter', 'rates': {'ltiprovider.validator': 0.1}},
+    },
+    'handlers': {
+        'queue': {'()': 'config.logging.QueueHandler', 'stream': 'ext://sys.stderr', 'filters': ['sample']},
+    },
+"""
+from datetime import datetime, timezone
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import threading
+import time
+
+
+# attributes of every log record, the other attributes are "extra" fields
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', logging.INFO, '', 0, '', (), None))) | {'message', 'asctime'}
+
+# names (or parts of names) of values that are masked, e.g. "consumer_secret=...", "?session=..."
+DEFAULT_REDACTED_NAMES = ('secret', 'password', 'token', 'signature', 'session')
+
+REDACTED = '[redacted]'
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats records as json objects: time (UTC, ISO 8601), level, logger, message, extra fields and exception
+    """
+
+    def format(self, record):
+        data = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in RECORD_ATTRIBUTES and not key.startswith('_'):
+                data[key] = value
+        if record.exc_info:
+            data['exception'] = self.formatException(record.exc_info)
+        if record.stack_info:
+            data['stack'] = self.formatStack(record.stack_info)
+        return json.dumps(data, default=str)
+
+
+class RedactingFilter(logging.Filter):
+    """
+    Masks the values of secrets in the message of records ("<name>=<value>", "<name>: <value>")
+    and the extra fields of records whose names contain one of the redacted names
+    """
+
+    def __init__(self, names=DEFAULT_REDACTED_NAMES):
+        super().__init__()
+        self.names = tuple(name.lower() for name in names)
+        self.pattern = re.compile(
+            r'(\b[\w-]*(?:{})[\w-]*\s*[=:]\s*)([^\s,&;]+)'.format('|'.join(re.escape(name) for name in names)),
+            re.IGNORECASE
+        )
+
+    def filter(self, record):
+        message = record.getMessage()
+        redacted = self.pattern.sub(r'\1' + REDACTED, message)
+        if redacted != message or record.args:
+            record.msg, record.args = redacted, ()
+        for key in list(record.__dict__):
+            if key not in RECORD_ATTRIBUTES and any(name in key.lower() for name in self.names):
+                setattr(record, key, REDACTED)
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps a fraction of the records of loggers at or below a level, e.g. the debug records of high-volume loggers.
+    Rates apply to a logger and its children; the rate of the most specific logger is used.
+    """
+
+    def __init__(self, rates=None, level='DEBUG'):
+        """
+        :param rates: dict, {logger name: fraction of records kept, between 0 and 1}
+        :param level: str or int, records above this level are always kept
+        """
+        super().__init__()
+        self.rates = dict(rates or {})
+        self.level = level if isinstance(level, int) else logging.getLevelName(level)
+        self._logger_rates = {}
+
+    def get_rate(self, name):
+        """
+        :return: float, fraction of the records of a logger that are kept
+        """
+        if name not in self._logger_rates:
+            rate = 1.0
+            prefix = name
+            while prefix:
+                if prefix in self.rates:
+                    rate = self.rates[prefix]
+                    break
+                prefix = prefix.rpartition('.')[0]
+            self._logger_rates[name] = rate
+        return self._logger_rates[name]
+
+    def filter(self, record):
+        if record.levelno > self.level:
+            return True
+        rate = self.get_rate(record.name)
+        return rate >= 1 or random.random() < rate
+
+
+class QueueListener(logging.handlers.QueueListener):
+    """
+    Listener that polls the queue, writing the records queued since the last poll every interval seconds.
+    A listener blocked on the queue is woken up by every record, taking the GIL from the request thread.
+    """
+
+    def __init__(self, queue, *handlers, respect_handler_level=False, interval=0.05):
+        super().__init__(queue, *handlers, respect_handler_level=respect_handler_level)
+        self.interval = interval
+
+    def dequeue(self, block):
+        while True:
+            try:
+                return self.queue.get_nowait()
+            except queue.Empty:
+                if not block:
+                    raise
+                time.sleep(self.interval)
+
+    def enqueue_sentinel(self):
+        # wait for room on a full queue, so that the records already queued are written before stopping
+        self.queue.put(self._sentinel)
+
+
+class QueueHandler(logging.handlers.QueueHandler):
+    """
+    Puts records on a bounded queue, from which a listener thread formats them as json and writes them to a stream.
+    The listener is started on first use in each process (e.g. in each worker after a fork),
+    and stopped, after writing the queued records, when logging is shut down.
+    """
+
+    def __init__(self, stream=None, maxsize=10000, redact=True):
+        """
+        :param stream: file object written by the listener thread (default: sys.stderr)
+        :param maxsize: int, number of queued records from which records are dropped
+        :param redact: bool, mask secrets in the written records (see RedactingFilter)
+        """
+        super().__init__(queue.Queue(maxsize))
+        self.target = logging.StreamHandler(stream)
+        self.target.setFormatter(JsonFormatter())
+        if redact:
+            self.target.addFilter(RedactingFilter())
+        self.listener = None
+        self.dropped = 0
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        with self._start_lock:
+            if self._pid != os.getpid():
+                # a listener inherited through a fork has no thread in this process
+                self.queue = queue.Queue(self.queue.maxsize)
+                self.listener = QueueListener(self.queue, self.target, respect_handler_level=True)
+                self.listener.start()
+                self._pid = os.getpid()
+
+    def stop(self):
+        if self.listener is not None and self._pid == os.getpid():
+            self.listener.stop()
+        self.listener = None
+        self._pid = None
+
+    def prepare(self, record):
+        # records are formatted by the listener thread, not on the request thread
+        return record
+
+    def enqueue(self, record):
+        if self._pid != os.getpid():
+            self.start()
+        try:
+            if self.dropped:
+                self.queue.put_nowait(logging.makeLogRecord({
+                    'name': __name__,
+                    'levelno': logging.WARNING,
+                    'levelname': 'WARNING',
+                    'msg': 'Dropped %s log records (logging queue full)',
+                    'args': (self.dropped,),
+                }))
+                self.dropped = 0
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        self.stop()
+        self.target.close()
+        super().close()
+
+
+# records of one lti request through the lti launch and vote views, as (logger, level, message, arguments)
+REQUEST_RECORDS = [
+    ('ltiprovider.mixins', logging.DEBUG, 'Referring url: %s', ('https://lms.example.edu/courses/course-v1/poll',)),
+    ('ltiprovider.mixins', logging.DEBUG, 'Getting session key from url', ()),
+    ('ltiprovider.mixins', logging.DEBUG, 'Setting session, session_key=%s', ('0123456789abcdefghijklmnopqrstuv',)),
+    ('ltiprovider.validator', logging.DEBUG, 'Timestamp validating is started.', ()),
+    ('ltiprovider.validator', logging.DEBUG, 'Timestamp is valid.', ()),
+    ('ltiprovider.validator', logging.DEBUG, 'Nonce validating is started.', ()),
+    ('ltiprovider.validator', logging.DEBUG, 'Nonce is valid.', ()),
+    ('ltiprovider.validator', logging.DEBUG, 'Getting client secret', ()),
+    ('ltiprovider.outcomes', logging.DEBUG,
+     'Updating LMS grade, with parameters: score=%s, lis_outcome_service_url=%s, lis_result_sourcedid=%s, '
+     'consumer_key=%s', (1.0, 'https://lms.example.edu/outcomes', 'course:block:user', 'consumer')),
+    ('ltiprovider.outcomes', logging.INFO,
+     'Successfully sent updated grade to LMS. score=%s, lis_outcome_service_url=%s, lis_result_sourcedid=%s, '
+     'consumer_key=%s', (1.0, 'https://lms.example.edu/outcomes', 'course:block:user', 'consumer')),
+]
+
+
+def time_requests(loggers, records, requests, io_wait):
+    """
+    :return: float, seconds spent in the log calls of the requests, excluding their simulated waits
+    """
+    elapsed = 0
+    for _ in range(requests):
+        start = time.perf_counter()
+        for name, level, message, args in records:
+            loggers[name].log(level, message, *args)
+        elapsed += time.perf_counter() - start
+        time.sleep(io_wait)
+    return elapsed
+
+
+def benchmark(requests=2000, stream=None, rates=None, level=logging.DEBUG, io_wait=0.002):
+    """
+    Time the logging of the records of a request (REQUEST_RECORDS) on the request thread, with:
+    - before: messages formatted eagerly by the caller (whether or not they are logged),
+      written by a synchronous StreamHandler
+    - after: lazy arguments, sampled, queued for a QueueHandler listener thread that writes json
+    Each request waits io_wait seconds after its log calls, as requests wait for the database and the lms,
+    releasing the GIL for the listener thread. Only the log calls are timed.
+    Loggers are created outside of the logging configuration, so that configured handlers are not affected.
+    :param requests: int, number of requests timed
+    :param stream: file object written to (default: os.devnull)
+    :param rates: dict, SamplingFilter rates of the "after" pipeline (default: keep 10% of validator debug records)
+    :param level: int, level of the loggers (e.g. logging.INFO to time disabled debug records)
+    :param io_wait: float, seconds each request waits for I/O
+    :return: dict, {'before'/'after': microseconds of logging per request on the request thread}
+    """
+    devnull = None
+    if stream is None:
+        stream = devnull = open(os.devnull, 'w')
+    if rates is None:
+        rates = {'ltiprovider.validator': 0.1}
+    results = {}
+
+    # before: log.debug("Setting session with key: {}".format(session_key)), formatted for every call
+    class EagerLogger(logging.Logger):
+        def log(self, level, message, *args):
+            super().log(level, message.format(*args))
+
+    eager_records = [(name, level, message.replace('%s', '{}'), args) for name, level, message, args in REQUEST_RECORDS]
+    handler = logging.StreamHandler(stream)
+    loggers = {name: EagerLogger(name, level) for name, _, _, _ in REQUEST_RECORDS}
+    for logger in loggers.values():
+        logger.addHandler(handler)
+    results['before'] = time_requests(loggers, eager_records, requests, io_wait) / requests * 1e6
+    handler.flush()
+
+    handler = QueueHandler(stream)
+    handler.addFilter(SamplingFilter(rates))
+    handler.start()
+    loggers = {name: logging.Logger(name, level) for name, _, _, _ in REQUEST_RECORDS}
+    for logger in loggers.values():
+        logger.addHandler(handler)
+    results['after'] = time_requests(loggers, REQUEST_RECORDS, requests, io_wait) / requests * 1e6
+    handler.close()
+
+    if devnull is not None:
+        devnull.close()
+    return results
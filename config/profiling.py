@@ -0,0 +1,199 @@
+"""
+On-demand sampling profiler for live requests.
+
+Selected requests are profiled by a background thread that samples the request thread's stack at a fixed interval,
+and by timing their SQL statements. Each profile is written to PROFILING_DIR as:
+- <id>.collapsed: collapsed stacks ("module:function;module:function <samples>"),
+  the input format of flamegraph.pl and speedscope
+- <id>.json: request details and SQL statement timings
+Only the newest PROFILING_MAX_PROFILES profiles are kept.
+
+A request is profiled if any of:
+- its X-Profile-Token header matches the PROFILING_TOKEN setting
+- it is made by a staff user (admin login) with the "profile" url query/GET parameter, if PROFILING_ALLOW_STAFF
+- it is randomly sampled, with probability PROFILING_SAMPLE_RATE
+- its lti consumer key (launch parameter, or lti session of the session cookie) is in PROFILING_CONSUMER_KEYS
+Unprofiled requests only pay for these checks.
+"""
+from collections import Counter
+from contextlib import ExitStack
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.db import connections
+
+
+PROFILE_HEADER = 'HTTP_X_PROFILE_TOKEN'
+PROFILE_PARAM = 'profile'
+
+
+class SamplingProfiler(threading.Thread):
+    """
+    Samples the stack of a thread every interval seconds, counting collapsed stacks
+    """
+
+    def __init__(self, thread_id, interval=0.005):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[collapse_stack(frame)] += 1
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+
+def collapse_stack(frame):
+    """
+    :return: str, frames of a stack from the outermost, as "module:function" separated by semicolons
+    """
+    frames = []
+    while frame is not None:
+        frames.append('{}:{}'.format(frame.f_globals.get('__name__', '?'), frame.f_code.co_name))
+        frame = frame.f_back
+    return ';'.join(reversed(frames))
+
+
+class SqlTimer:
+    """
+    Times the SQL statements executed on a database connection, see connection.execute_wrapper
+    """
+
+    def __init__(self, alias, queries):
+        self.alias = alias
+        self.queries = queries
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({
+                'database': self.alias,
+                'sql': sql,
+                'ms': round((time.perf_counter() - start) * 1000, 3),
+            })
+
+
+def get_consumer_key(request):
+    """
+    Lti consumer key of a request: from the launch params, or from the lti session of the session cookie.
+    The session is the one loaded by SessionMiddleware, which the view reuses (see ltiprovider.mixins.set_session),
+    so that no query is added;
+    sessions passed in the url are only loaded by the view, so their requests aren't selected by consumer key
+    :return: str, or None
+    """
+    if 'oauth_consumer_key' in request.POST:
+        return request.POST['oauth_consumer_key']
+    session = getattr(request, 'session', None)
+    if session is not None and session.session_key:
+        return session.get('oauth_consumer_key')
+    return None
+
+
+def get_profile_reason(request):
+    """
+    :return: str, reason the request is selected for profiling, or None if it isn't
+    """
+    token = getattr(settings, 'PROFILING_TOKEN', None)
+    if token and request.META.get(PROFILE_HEADER) == token:
+        return 'token'
+    if PROFILE_PARAM in request.GET and getattr(settings, 'PROFILING_ALLOW_STAFF', True):
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_staff:
+            return 'staff'
+    sample_rate = getattr(settings, 'PROFILING_SAMPLE_RATE', 0)
+    if sample_rate and random.random() < sample_rate:
+        return 'sample'
+    consumer_keys = getattr(settings, 'PROFILING_CONSUMER_KEYS', ())
+    if consumer_keys and get_consumer_key(request) in consumer_keys:
+        return 'consumer'
+    return None
+
+
+def get_profile_dir():
+    return getattr(settings, 'PROFILING_DIR', None) or os.path.join(tempfile.gettempdir(), 'poll-profiles')
+
+
+def write_profile(profile_id, stacks, details):
+    """
+    Write a profile to the profile directory, deleting the oldest profiles beyond PROFILING_MAX_PROFILES
+    """
+    profile_dir = get_profile_dir()
+    os.makedirs(profile_dir, exist_ok=True)
+    with open(os.path.join(profile_dir, profile_id + '.collapsed'), 'w') as f:
+        for stack, count in stacks.most_common():
+            f.write('{} {}\n'.format(stack, count))
+    with open(os.path.join(profile_dir, profile_id + '.json'), 'w') as f:
+        json.dump(details, f, indent=2)
+
+    # profile ids start with a timestamp, so that names sort by age
+    max_profiles = max(getattr(settings, 'PROFILING_MAX_PROFILES', 100), 0)
+    profile_ids = sorted({os.path.splitext(name)[0] for name in os.listdir(profile_dir)})
+    # not profile_ids[:-max_profiles], which is empty for 0
+    for old_id in profile_ids[:len(profile_ids) - max_profiles]:
+        for extension in ('.collapsed', '.json'):
+            try:
+                os.remove(os.path.join(profile_dir, old_id + extension))
+            except FileNotFoundError:
+                pass
+
+
+class ProfilingMiddleware:
+    """
+    Profiles selected requests (see module docstring); the id of the profile is returned in the X-Profile-Id header
+    Add after AuthenticationMiddleware, so that staff users can be identified
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        reason = get_profile_reason(request)
+        if reason is None:
+            return self.get_response(request)
+        return self.profile(request, reason)
+
+    def profile(self, request, reason):
+        profile_id = '{}-{}'.format(time.strftime('%Y%m%d-%H%M%S'), uuid.uuid4().hex[:8])
+        queries = []
+        profiler = SamplingProfiler(threading.get_ident(), getattr(settings, 'PROFILING_INTERVAL', 0.005))
+        start = time.perf_counter()
+        with ExitStack() as wrappers:
+            for connection in connections.all():
+                wrappers.enter_context(connection.execute_wrapper(SqlTimer(connection.alias, queries)))
+            profiler.start()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.stop()
+        duration = time.perf_counter() - start
+
+        write_profile(profile_id, profiler.stacks, {
+            'id': profile_id,
+            'reason': reason,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'ms': round(duration * 1000, 3),
+            'samples': sum(profiler.stacks.values()),
+            'interval_ms': profiler.interval * 1000,
+            'sql_ms': round(sum(query['ms'] for query in queries), 3),
+            'queries': queries,
+        })
+        response['X-Profile-Id'] = profile_id
+        return response
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/2.0/ref/settings/
 """
 
+import importlib.util
 import os
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
@@ -43,14 +44,17 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'config.health.InFlightMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'config.profiling.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'ltiprovider.middleware.ShardMiddleware',
 ]
 
 ROOT_URLCONF = 'config.urls'
@@ -77,6 +81,23 @@ WSGI_APPLICATION = 'config.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/2.0/ref/settings/#databases
 
+# learner and response data is stored on the shard database of each lti consumer, see ltiprovider/routers.py
+DATABASE_ROUTERS = ['ltiprovider.routers.ShardRouter']
+LTI_SHARD_DATABASES = ['default']
+
+
+# Cache
+# https://docs.djangoproject.com/en/2.0/topics/cache/
+
+# shared by the worker processes, e.g. LTI 1.3 login states, platform key sets and access tokens (see
+# ltiprovider/lti13.py), in a table of the catalog database created with: python manage.py createcachetable
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'poll_cache',
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.0/ref/settings/#auth-password-validators
@@ -116,3 +137,68 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 STATIC_ROOT = '/www/static/'
+
+# content-hashed file names with precompressed copies, served by nginx (see nginx/sites-enabled/web.conf)
+STATICFILES_STORAGE = 'config.storage.CompressedManifestStaticFilesStorage'
+
+# plotly.js is served as a static file instead of being inlined in every results page
+STATICFILES_DIRS = [
+    ('plotly', os.path.join(os.path.dirname(importlib.util.find_spec('plotly').origin), 'package_data')),
+]
+
+
+# On-demand request profiling (see config/profiling.py)
+# requests with this X-Profile-Token header value are profiled (None disables)
+PROFILING_TOKEN = None
+# fraction of requests profiled at random
+PROFILING_SAMPLE_RATE = 0
+# lti consumer keys whose requests are profiled
+PROFILING_CONSUMER_KEYS = []
+# directory of the profiles (None: <temp dir>/poll-profiles)
+PROFILING_DIR = None
+# number of newest profiles kept (0: none)
+PROFILING_MAX_PROFILES = 100
+
+
+# Course dashboard (poll.views.DashboardView)
+# lti roles allowed to see course results, matched by short name (see ltiprovider.mixins.has_instructor_role)
+LTI_INSTRUCTOR_ROLES = ['Instructor', 'TeachingAssistant', 'ContentDeveloper', 'Administrator']
+POLL_DASHBOARD_PAGE_SIZE = 25
+# seconds between refreshes of the dashboard results (0 disables)
+POLL_DASHBOARD_REFRESH = 10
+
+
+# Anonymous questions (see poll/voters.py)
+# false positive rate of the Bloom filters of questions with expected voters (learners wrongly seen as having voted)
+POLL_VOTER_FILTER_ERROR_RATE = 0.001
+# shard database of the voter records and counters of anonymous questions, whatever the consumer's shard
+# (None: the first of LTI_SHARD_DATABASES); must not change once anonymous questions have answers
+POLL_VOTER_SHARD = None
+
+
+# Retention of response data (see poll/archive.py)
+# directory of the archive files of the responses of closed questions
+POLL_ARCHIVE_DIR = os.environ.get('POLL_ARCHIVE_DIR', os.path.join(BASE_DIR, 'archive'))
+# days after which the responses of closed questions are archived
+POLL_ARCHIVE_AFTER_DAYS = 90
+
+
+# Liveness, readiness and drain (see config/health.py)
+# seconds between readiness checks, run in the background
+HEALTH_CHECK_INTERVAL = 10
+# seconds after which readiness check results are stale (failing)
+HEALTH_CHECK_MAX_AGE = 30
+# workers are draining while this file exists (None: <temp dir>/poll-drain)
+HEALTH_DRAIN_FILE = os.environ.get('HEALTH_DRAIN_FILE')
+# seconds a draining worker waits for the requests in progress
+HEALTH_DRAIN_TIMEOUT = 30
+
+
+# LTI 1.3 launches and grade passback (see ltiprovider/lti13.py)
+# PEM RSA private key of the tool; its public key is served at /lti/lti13/jwks/
+LTI_TOOL_PRIVATE_KEY = os.environ.get('LTI_TOOL_PRIVATE_KEY')
+LTI_TOOL_KEY_ID = 'poll'
+# seconds after which cached platform key sets are refreshed in the background
+LTI_JWKS_TTL = 3600
+# minimum seconds between refreshes of a platform key set for unknown key ids
+LTI_JWKS_MIN_REFRESH = 60
@@ -19,6 +19,11 @@ DATABASES = {
     }
 }
 
+# To shard learner and response data by lti consumer (see ltiprovider/routers.py), add shard databases
+# and list them in LTI_SHARD_DATABASES; "default" remains the catalog database (consumers, questions), e.g.
+# DATABASES['shard1'] = dict(DATABASES['default'], NAME='poll_shard1')
+# LTI_SHARD_DATABASES = ['default', 'shard1']
+
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = True
 
@@ -34,13 +39,26 @@ INSTALLED_APPS += [
 CORS_ORIGIN_ALLOW_ALL = True
 
 # Logging settings
+# poll and ltiprovider records are written as json by a listener thread (see config/logging.py),
+# keeping 10% of the high-volume oauth validation debug records
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
+    'filters': {
+        'sample': {
+            '()': 'config.logging.SamplingFilter',
+            'rates': {'ltiprovider.validator': 0.1},
+        },
+    },
     'handlers': {
         'console': {
             'class': 'logging.StreamHandler',
         },
+        'queue': {
+            '()': 'config.logging.QueueHandler',
+            'stream': 'ext://sys.stderr',
+            'filters': ['sample'],
+        },
     },
     'loggers': {
         'django': {
@@ -48,11 +66,11 @@ LOGGING = {
             'level': 'INFO',
         },
         'poll': {
-            'handlers': ['console'],
+            'handlers': ['queue'],
             'level': 'DEBUG',
         },
         'ltiprovider': {
-            'handlers': ['console'],
+            'handlers': ['queue'],
             'level': 'DEBUG',
         },
         'oauthlib': {
@@ -0,0 +1,30 @@
+"""
+Settings for running the tests, with SQLite catalog and shard databases:
+python manage.py test --settings=config.settings.test
+"""
+
+from config.settings.base import *
+
+
+SECRET_KEY = 'test'
+
+# catalog database, and two shards for the learner and response data (see ltiprovider/routers.py)
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'test.sqlite3'),
+    },
+    'shard1': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'test_shard1.sqlite3'),
+    },
+    'shard2': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'test_shard2.sqlite3'),
+    },
+}
+LTI_SHARD_DATABASES = ['shard1', 'shard2']
+
+LTI_SSL = False
+
+STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.StaticFilesStorage'
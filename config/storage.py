@@ -0,0 +1,57 @@
+import gzip
+import io
+import os
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """
+    Manifest static files storage (content-hashed file names) that also writes precompressed
+    .gz (and .br, if the brotli package is installed) copies of the hashed files at collectstatic time,
+    so they can be served directly by nginx (gzip_static) without compressing on each request
+    """
+    compress_extensions = ('.css', '.js', '.json', '.svg', '.txt', '.html', '.xml', '.map')
+
+    # files smaller than this are not worth compressing
+    compress_min_size = 256
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        # compress the final hashed files only, after the manifest has been saved
+        for hashed_name in set(self.hashed_files.values()):
+            if os.path.splitext(hashed_name)[1] in self.compress_extensions:
+                self.compress(hashed_name)
+
+    def compress(self, name):
+        """
+        Write precompressed copies of a stored file next to it, if they are smaller than the original
+        :param name: str, stored file name
+        """
+        path = self.path(name)
+        with open(path, 'rb') as f:
+            content = f.read()
+        if len(content) < self.compress_min_size:
+            return
+
+        # mtime=0 so that the output only depends on the file content
+        buffer = io.BytesIO()
+        with gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=9, mtime=0) as gz:
+            gz.write(content)
+        self._write_if_smaller(path + '.gz', buffer.getvalue(), content)
+
+        if brotli is not None:
+            self._write_if_smaller(path + '.br', brotli.compress(content), content)
+
+    @staticmethod
+    def _write_if_smaller(path, compressed, content):
+        if len(compressed) < len(content):
+            with open(path, 'wb') as f:
+                f.write(compressed)
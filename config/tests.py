@@ -0,0 +1,209 @@
+from collections import Counter
+import io
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.sessions.backends.db import SessionStore
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.db import connections
+from django.test import RequestFactory, SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from ltiprovider.models import LtiConsumer
+from ltiprovider.routers import use_shard
+from poll.models import Question
+from poll.queryplans import create_session
+
+from . import health
+from .health import HealthChecker, check_database, get_readiness
+from .logging import REDACTED, QueueHandler, SamplingFilter
+from .profiling import get_consumer_key, write_profile
+
+
+class ProfilingTest(TestCase):
+    multi_db = True
+
+    def setUp(self):
+        self.profile_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.profile_dir)
+
+    def write_profiles(self, count):
+        for number in range(count):
+            write_profile('20260101-00000{}'.format(number), Counter({'poll.views:get': 1}), {})
+        return sorted(os.listdir(self.profile_dir))
+
+    def test_max_profiles(self):
+        with self.settings(PROFILING_DIR=self.profile_dir, PROFILING_MAX_PROFILES=2):
+            self.assertEqual(self.write_profiles(3), [
+                '20260101-000001.collapsed', '20260101-000001.json',
+                '20260101-000002.collapsed', '20260101-000002.json',
+            ])
+
+    def test_no_profiles_kept(self):
+        with self.settings(PROFILING_DIR=self.profile_dir, PROFILING_MAX_PROFILES=0):
+            self.assertEqual(self.write_profiles(2), [])
+
+    def create_session(self):
+        session = SessionStore()
+        session['oauth_consumer_key'] = 'consumer-key'
+        session.create()
+        return session.session_key
+
+    def test_consumer_key_of_session_cookie(self):
+        request = RequestFactory().get('/')
+        request.COOKIES[settings.SESSION_COOKIE_NAME] = self.create_session()
+        SessionMiddleware().process_request(request)
+        with self.assertNumQueries(1):
+            self.assertEqual(get_consumer_key(request), 'consumer-key')
+        # the view reuses the loaded session
+        with self.assertNumQueries(0):
+            self.assertEqual(request.session['oauth_consumer_key'], 'consumer-key')
+
+    def test_consumer_keys_add_no_query(self):
+        consumer = LtiConsumer.objects.create(consumer_name='consumer', shard='shard1')
+        question = Question.objects.create(question_text='Question?')
+        with use_shard('shard1'):
+            self.client.cookies[settings.SESSION_COOKIE_NAME] = create_session(consumer)
+        url = reverse('poll:question', args=[question.pk])
+        with CaptureQueriesContext(connections['default']) as unfiltered:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        with self.settings(PROFILING_CONSUMER_KEYS=['other']):
+            with CaptureQueriesContext(connections['default']) as filtered:
+                self.assertEqual(self.client.get(url).status_code, 200)
+        # the session loaded by SessionMiddleware for the consumer key is the one of the view
+        self.assertEqual(len(filtered), len(unfiltered))
+        session_loads = [query for query in filtered.captured_queries if 'FROM "django_session"' in query['sql']]
+        self.assertEqual(len(session_loads), 1)
+
+    def test_consumer_key_of_session_in_url(self):
+        request = RequestFactory().get('/', {'session': self.create_session()})
+        SessionMiddleware().process_request(request)
+        with self.assertNumQueries(0):
+            self.assertIsNone(get_consumer_key(request))
+
+    def test_consumer_key_of_launch(self):
+        request = RequestFactory().post('/', {'oauth_consumer_key': 'consumer-key'})
+        SessionMiddleware().process_request(request)
+        self.assertEqual(get_consumer_key(request), 'consumer-key')
+
+
+class HealthTest(SimpleTestCase):
+    """
+    Readiness of the process from the results of the background checks (see config.health)
+    """
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.drain_file = os.path.join(self.temp_dir, 'drain')
+        settings_override = self.settings(HEALTH_DRAIN_FILE=self.drain_file, HEALTH_CHECK_MAX_AGE=30)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def use_checker(self, checks):
+        """
+        Replace the checker of this process, without starting its thread
+        """
+        checker = HealthChecker(checks)
+        patcher = mock.patch.multiple(health, _checker=checker, _checker_pid=os.getpid())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return checker
+
+    def test_unavailable_database(self):
+        # a database whose file can't be opened
+        database = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': os.path.join(self.temp_dir, 'missing', 'db')}
+        with mock.patch.dict(connections.databases, {'unavailable': database}):
+            checker = self.use_checker([
+                ('cache', lambda: 'ok', True),
+                ('database:unavailable', lambda: check_database('unavailable'), True),
+            ])
+            checker.run_checks()
+
+        self.assertEqual(checker.results['cache'][:2], (True, 'ok'))
+        self.assertFalse(checker.results['database:unavailable'][0])
+        response = self.client.get('/health/ready/')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()['status'], 'not ready')
+        self.assertFalse(response.json()['checks']['database:unavailable']['ok'])
+
+    def test_ready(self):
+        self.use_checker([('cache', lambda: 'ok', True)]).run_checks()
+        self.assertEqual(self.client.get('/health/ready/').status_code, 200)
+
+    def test_starting(self):
+        self.use_checker([('cache', lambda: 'ok', True)])
+        self.assertEqual(get_readiness(), (False, {'status': 'starting', 'checks': {}}))
+
+    def test_stale_result(self):
+        checker = self.use_checker([('cache', lambda: 'ok', True)])
+        # e.g. the next check hangs on an unreachable database
+        checker.results = {'cache': (True, 'ok', time.time() - 31)}
+        ready, details = get_readiness()
+        self.assertFalse(ready)
+        self.assertEqual(details['status'], 'not ready')
+        self.assertEqual(details['checks']['cache']['detail'], 'stale result')
+
+    def test_drain_file(self):
+        self.use_checker([('cache', lambda: 'ok', True)]).run_checks()
+        open(self.drain_file, 'w').close()
+        response = self.client.get('/health/ready/')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()['status'], 'draining')
+        self.assertEqual(self.client.get('/health/live/').status_code, 200)
+        os.remove(self.drain_file)
+        self.assertEqual(self.client.get('/health/ready/').status_code, 200)
+
+
+class LoggingTest(SimpleTestCase):
+    """
+    Records written as json by the listener thread of the logging queue (see config.logging)
+    """
+
+    def setUp(self):
+        self.stream = io.StringIO()
+        self.handler = QueueHandler(self.stream)
+        self.addCleanup(self.handler.close)
+        self.log = logging.Logger('config.tests', logging.DEBUG)
+        self.log.addHandler(self.handler)
+
+    def get_records(self):
+        self.handler.stop()
+        return [json.loads(line) for line in self.stream.getvalue().splitlines()]
+
+    def test_redacted(self):
+        self.log.info('Launch params: consumer_secret=%s, session_key=%s, user_id=%s', 'abc', 'def', 'learner')
+        self.log.warning('Invalid request oauth_signature=xyz&oauth_nonce=123 Password: hunter2')
+        self.log.info('Launch', extra={'oauth_token': 'token', 'oauth_consumer_key': 'consumer'})
+        records = self.get_records()
+        self.assertEqual([record['message'] for record in records], [
+            'Launch params: consumer_secret={0}, session_key={0}, user_id=learner'.format(REDACTED),
+            'Invalid request oauth_signature={}&oauth_nonce=123 Password: {}'.format(REDACTED, REDACTED),
+            'Launch',
+        ])
+        self.assertEqual(records[2]['oauth_token'], REDACTED)
+        self.assertEqual(records[2]['oauth_consumer_key'], 'consumer')
+        self.assertEqual((records[0]['level'], records[0]['logger']), ('INFO', 'config.tests'))
+
+    def test_records_written_on_stop(self):
+        for number in range(1000):
+            self.log.debug('Record %s', number)
+        # the listener is stopped before it polls the queue again: the queued records are written on stop
+        self.assertEqual([record['message'] for record in self.get_records()],
+                         ['Record {}'.format(number) for number in range(1000)])
+        # the listener is started again by the next record
+        self.log.info('Restarted')
+        self.assertEqual(self.get_records()[-1]['message'], 'Restarted')
+
+    def test_sampling(self):
+        self.handler.addFilter(SamplingFilter({'config': 0}))
+        self.log.debug('Sampled out')
+        self.log.info('Kept')
+        self.assertEqual([record['message'] for record in self.get_records()], ['Kept'])
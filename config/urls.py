@@ -20,5 +20,8 @@ from . import views
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('poll/', include('poll.urls')),
+    path('lti/', include('ltiprovider.urls')),
     path('health/', views.health),
+    path('health/live/', views.health, name='liveness'),
+    path('health/ready/', views.readiness, name='readiness'),
 ]
@@ -1,5 +1,18 @@
-from django.http import HttpResponse
+from django.http import HttpResponse, JsonResponse
+
+from .health import get_readiness
 
 
 def health(request):
+    """
+    Liveness: the process serves requests
+    """
     return HttpResponse()
+
+
+def readiness(request):
+    """
+    Readiness: last results of the dependency checks (see config.health), 503 if not ready or draining
+    """
+    ready, details = get_readiness()
+    return JsonResponse(details, status=200 if ready else 503)
@@ -2,8 +2,139 @@
 from __future__ import unicode_literals
 
 from django.contrib import admin
-from .models import LtiConsumer, LtiUser
+from django.contrib.admin.views.main import ChangeList, ORDER_VAR, PAGE_VAR
 
+from .models import LtiConsumer, LtiPlatform, LtiUser
+from .paginators import EstimatedCountPaginator
 
-admin.site.register(LtiConsumer)
-admin.site.register(LtiUser)
+
+# url query parameters of the keyset pagination cursors: results after (next pages) or before (previous pages) a pk
+KEYSET_VAR = 'after'
+KEYSET_BEFORE_VAR = 'before'
+
+
+class KeysetChangeList(ChangeList):
+    """
+    Change list that pages through results by primary key (WHERE pk < cursor) instead of by OFFSET,
+    so that later pages of a large table are as fast as the first one.
+    Keyset pagination is used with the default descending primary key ordering only,
+    with links to the first, previous and next pages.
+    """
+    def __init__(self, request, *args, **kwargs):
+        self.keyset_after = get_cursor(request, KEYSET_VAR)
+        # the before cursor is ignored if both are given
+        self.keyset_before = get_cursor(request, KEYSET_BEFORE_VAR) if self.keyset_after is None else None
+        self.keyset_first = None
+        self.keyset_previous = None
+        self.keyset_next = None
+        super().__init__(request, *args, **kwargs)
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(KEYSET_VAR, None)
+        lookup_params.pop(KEYSET_BEFORE_VAR, None)
+        return lookup_params
+
+    def get_query_string(self, new_params=None, remove=None):
+        # links that change ordering or filters start again from the first page
+        new_params = new_params or {}
+        remove = list(remove or []) + [var for var in (KEYSET_VAR, KEYSET_BEFORE_VAR) if var not in new_params]
+        return super().get_query_string(new_params, remove)
+
+    def is_keyset_paginated(self, request):
+        return ORDER_VAR not in self.params and self.get_ordering(request, self.root_queryset) == ['-pk']
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        # results before the cursor is applied, which are counted on every page
+        self.keyset_queryset = queryset
+        if self.keyset_after is not None and self.is_keyset_paginated(request):
+            queryset = queryset.filter(pk__lt=self.keyset_after)
+        elif self.keyset_before is not None and self.is_keyset_paginated(request):
+            queryset = queryset.filter(pk__gt=self.keyset_before)
+        return queryset
+
+    def get_results(self, request):
+        if not self.is_keyset_paginated(request) or self.show_all:
+            return super().get_results(request)
+        paginator = self.model_admin.get_paginator(request, self.keyset_queryset, self.list_per_page)
+        result_count = paginator.count
+        if self.model_admin.show_full_result_count:
+            full_result_count = self.root_queryset.count()
+        else:
+            full_result_count = None
+        # fetch one extra row to find out if there is a page after this one, in the direction of the cursor
+        if self.keyset_before is not None:
+            # a previous page: the rows closest to the cursor, in ascending order
+            results = list(self.queryset.order_by('pk')[:self.list_per_page + 1])
+            self.result_list = results[:self.list_per_page][::-1]
+            has_previous, has_next = len(results) > self.list_per_page, True
+        else:
+            results = list(self.queryset[:self.list_per_page + 1])
+            self.result_list = results[:self.list_per_page]
+            has_previous, has_next = self.keyset_after is not None, len(results) > self.list_per_page
+        if has_previous:
+            self.keyset_first = self.get_query_string(remove=[PAGE_VAR])
+            if self.result_list:
+                self.keyset_previous = self.get_query_string({KEYSET_BEFORE_VAR: self.result_list[0].pk}, [PAGE_VAR])
+        if has_next and self.result_list:
+            self.keyset_next = self.get_query_string({KEYSET_VAR: self.result_list[-1].pk}, [PAGE_VAR])
+
+        self.result_count = result_count
+        self.show_full_result_count = self.model_admin.show_full_result_count
+        self.show_admin_actions = not self.show_full_result_count or bool(full_result_count)
+        self.full_result_count = full_result_count
+        self.can_show_all = False
+        self.multi_page = bool(self.keyset_first or self.keyset_next)
+        self.paginator = paginator
+
+
+def get_cursor(request, name):
+    """
+    :return: int, keyset pagination cursor of a url query parameter, or None if missing or invalid
+    """
+    try:
+        return int(request.GET.get(name))
+    except (TypeError, ValueError):
+        return None
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """
+    Model admin for tables with millions of rows:
+    - estimated instead of exact counts (see EstimatedCountPaginator)
+    - no second count of the unfiltered table
+    - keyset pagination (see KeysetChangeList)
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    change_list_template = 'admin/keyset_change_list.html'
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
+
+
+@admin.register(LtiConsumer)
+class LtiConsumerAdmin(admin.ModelAdmin):
+    list_display = ('consumer_name', 'consumer_key', 'expiration_date', 'shard')
+    search_fields = ('consumer_name', '=consumer_key')
+
+
+@admin.register(LtiPlatform)
+class LtiPlatformAdmin(admin.ModelAdmin):
+    list_display = ('name', 'issuer', 'client_id', 'deployment_id', 'lti_consumer')
+    list_select_related = ('lti_consumer',)
+    search_fields = ('name', '=issuer', '=client_id')
+
+
+@admin.register(LtiUser)
+class LtiUserAdmin(LargeTableAdmin):
+    list_display = ('user_id', 'lti_consumer', 'tool_consumer_instance_guid')
+    # consumers are on the catalog database, so they are prefetched instead of joined (see ltiprovider.routers)
+    list_select_related = ()
+    list_filter = ('lti_consumer',)
+    # exact match, backed by the (user_id, lti_consumer, tool_consumer_instance_guid) unique index
+    search_fields = ('=user_id',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related('lti_consumer')
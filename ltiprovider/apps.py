@@ -2,7 +2,12 @@
 from __future__ import unicode_literals
 
 from django.apps import AppConfig
+from django.db.models.signals import pre_delete
 
 
 class LtiproviderConfig(AppConfig):
     name = 'ltiprovider'
+
+    def ready(self):
+        from .signals import delete_consumer_users
+        pre_delete.connect(delete_consumer_users, sender=self.get_model('LtiConsumer'))
@@ -0,0 +1,427 @@
+"""
+LTI 1.3 (LTI Advantage) launches and grade passback, alongside the LTI 1.1 launches of LtiMixin.
+
+Launch flow (OIDC third party initiated login):
+1. the platform sends a login request to LoginView, which redirects to the platform's OIDC authentication url
+   with a one-time state and nonce (stored in the django cache, since the tool's cookies may be blocked in the iframe)
+2. the platform posts a signed id token (JWT) and the state to the target link uri, a view with LtiMixin
+3. the id token is validated with the platform's public key, and its claims are stored in the session
+   as the LTI 1.1 launch params used by the views (user_id, context_id, roles, ...)
+
+Platform key sets (JWKS) are cached per url: parsed public keys in each process, and the key set json in the django
+cache, shared by the processes (see CACHES). Key sets older than LTI_JWKS_TTL seconds are refreshed in the
+background, and login requests warm the key set of the platform before its launch. Only a key id missing from a
+cached key set (key rotation) refreshes it during the launch, at most once per LTI_JWKS_MIN_REFRESH seconds.
+
+Scores are published to the assignment and grade services (AGS) line item of the launch,
+with OAuth2 access tokens cached until they expire.
+
+Settings:
+    LTI_TOOL_PRIVATE_KEY: PEM RSA private key of the tool, signing access token requests
+    LTI_TOOL_KEY_ID: key id of the tool's public key, published by JwksView (default: 'poll')
+    LTI_JWKS_TTL: seconds after which cached platform key sets are refreshed (default: 3600)
+    LTI_JWKS_MIN_REFRESH: minimum seconds between refreshes of a key set for unknown key ids (default: 60)
+"""
+from datetime import datetime, timezone
+import functools
+import hashlib
+import json
+import logging
+import secrets
+import threading
+import time
+from urllib.parse import urlencode, urlsplit, urlunsplit
+import uuid
+
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import serialization
+from django.conf import settings
+from django.core.cache import cache
+import jwt
+from jwt.algorithms import RSAAlgorithm
+from jwt.exceptions import InvalidKeyError
+import requests
+
+from .models import LtiPlatform
+
+
+log = logging.getLogger(__name__)
+
+LTI_VERSION = '1.3.0'
+RESOURCE_LINK_MESSAGE = 'LtiResourceLinkRequest'
+
+CLAIM = 'https://purl.imsglobal.org/spec/lti/claim/'
+MESSAGE_TYPE_CLAIM = CLAIM + 'message_type'
+VERSION_CLAIM = CLAIM + 'version'
+DEPLOYMENT_CLAIM = CLAIM + 'deployment_id'
+ROLES_CLAIM = CLAIM + 'roles'
+CONTEXT_CLAIM = CLAIM + 'context'
+RESOURCE_LINK_CLAIM = CLAIM + 'resource_link'
+TOOL_PLATFORM_CLAIM = CLAIM + 'tool_platform'
+AGS_CLAIM = 'https://purl.imsglobal.org/spec/lti-ags/claim/endpoint'
+
+SCORE_SCOPE = 'https://purl.imsglobal.org/spec/lti-ags/scope/score'
+SCORE_CONTENT_TYPE = 'application/vnd.ims.lis.v1.score+json'
+
+# seconds a login state is valid for, until the launch
+LOGIN_TIMEOUT = 600
+# seconds of clock difference with platforms accepted when validating id tokens
+LEEWAY = 60
+# seconds before their expiry that access tokens are renewed
+TOKEN_EXPIRY_MARGIN = 60
+# seconds before requests to platforms time out
+REQUEST_TIMEOUT = 10
+
+# connections to platforms are reused across requests
+http = requests.Session()
+
+
+class LaunchError(Exception):
+    """
+    Invalid LTI 1.3 login or launch request
+    """
+
+
+class KeySet:
+    """
+    Parsed public keys of a platform key set
+    """
+
+    def __init__(self, jwks, fetched_at):
+        """
+        :param jwks: dict, json web key set
+        :param fetched_at: float, time the key set was fetched from the platform
+        """
+        self.fetched_at = fetched_at
+        self.keys = {}
+        for jwk in jwks.get('keys', []):
+            if jwk.get('kty') == 'RSA' and jwk.get('use', 'sig') == 'sig':
+                self.keys[jwk.get('kid')] = RSAAlgorithm.from_jwk(json.dumps(jwk))
+
+    def age(self):
+        return time.time() - self.fetched_at
+
+
+# {key set url: KeySet}
+_key_sets = {}
+# key set urls being refreshed in the background
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+
+
+def get_key_set_cache_key(jwks_url):
+    return 'ltiprovider:jwks:{}'.format(hashlib.sha1(jwks_url.encode('utf-8')).hexdigest())
+
+
+def fetch_key_set(jwks_url):
+    """
+    Fetch a key set from its platform, updating the process and django caches
+    :return: KeySet
+    """
+    response = http.get(jwks_url, timeout=REQUEST_TIMEOUT)
+    response.raise_for_status()
+    jwks = response.json()
+    if not isinstance(jwks, dict):
+        raise ValueError('Key set is not a json object')
+    key_set = KeySet(jwks, time.time())
+    cache.set(get_key_set_cache_key(jwks_url), {'jwks': jwks, 'fetched_at': key_set.fetched_at}, None)
+    _key_sets[jwks_url] = key_set
+    log.info('Fetched key set %s: %s keys', jwks_url, len(key_set.keys))
+    return key_set
+
+
+def get_cached_key_set(jwks_url):
+    """
+    :return: KeySet from the process cache, or from the django cache if fetched by another process; or None
+    """
+    key_set = _key_sets.get(jwks_url)
+    cached = cache.get(get_key_set_cache_key(jwks_url))
+    if cached is not None and (key_set is None or cached['fetched_at'] > key_set.fetched_at):
+        key_set = _key_sets[jwks_url] = KeySet(cached['jwks'], cached['fetched_at'])
+    return key_set
+
+
+def refresh_key_set(jwks_url):
+    try:
+        fetch_key_set(jwks_url)
+    except (requests.RequestException, ValueError, InvalidKeyError) as err:
+        log.error('Error occurred refreshing key set %s: %s', jwks_url, err)
+    finally:
+        with _refreshing_lock:
+            _refreshing.discard(jwks_url)
+
+
+def refresh_key_set_in_background(jwks_url):
+    with _refreshing_lock:
+        if jwks_url in _refreshing:
+            return
+        _refreshing.add(jwks_url)
+    threading.Thread(target=refresh_key_set, args=(jwks_url,), daemon=True).start()
+
+
+def warm_key_set(jwks_url):
+    """
+    Fetch a key set in the background if it isn't cached or is stale, e.g. on login before a launch
+    """
+    key_set = _key_sets.get(jwks_url) or get_cached_key_set(jwks_url)
+    if key_set is None or key_set.age() >= getattr(settings, 'LTI_JWKS_TTL', 3600):
+        refresh_key_set_in_background(jwks_url)
+
+
+def get_platform_key(platform, kid):
+    """
+    Public key of a platform, from its cached key set
+    :param platform: LtiPlatform model instance
+    :param kid: str, key id of the id token header
+    :return: RSA public key
+    """
+    ttl = getattr(settings, 'LTI_JWKS_TTL', 3600)
+    key_set = _key_sets.get(platform.jwks_url)
+    if key_set is None or kid not in key_set.keys:
+        # another process may have fetched the key set (or a rotated one) already
+        key_set = get_cached_key_set(platform.jwks_url)
+    if key_set is None:
+        key_set = fetch_key_set(platform.jwks_url)
+    elif kid not in key_set.keys and key_set.age() >= getattr(settings, 'LTI_JWKS_MIN_REFRESH', 60):
+        log.info('Key id %s not found in key set %s, refreshing', kid, platform.jwks_url)
+        key_set = fetch_key_set(platform.jwks_url)
+    elif key_set.age() >= ttl:
+        refresh_key_set_in_background(platform.jwks_url)
+
+    if kid not in key_set.keys:
+        raise LaunchError('Key id {} not found in the key set of {}'.format(kid, platform))
+    return key_set.keys[kid]
+
+
+def get_login_state_cache_key(state):
+    return 'ltiprovider:lti13:state:{}'.format(state)
+
+
+def get_login_url(params):
+    """
+    Handle an OIDC third party initiated login request
+    :param params: dict, login request params (iss, login_hint, target_link_uri, [client_id, lti_message_hint])
+    :return: str, url of the platform's OIDC authentication request
+    """
+    for param in ('iss', 'login_hint', 'target_link_uri'):
+        if not params.get(param):
+            raise LaunchError('Login request has no {} parameter'.format(param))
+    platforms = LtiPlatform.objects.filter(issuer=params['iss'])
+    if params.get('client_id'):
+        platforms = platforms.filter(client_id=params['client_id'])
+    platforms = list(platforms[:2])
+    if len(platforms) != 1:
+        raise LaunchError('No single platform registered for issuer {}'.format(params['iss']))
+    platform = platforms[0]
+    warm_key_set(platform.jwks_url)
+
+    state = secrets.token_urlsafe(32)
+    nonce = secrets.token_urlsafe(32)
+    cache.set(get_login_state_cache_key(state), {'platform': platform.pk, 'nonce': nonce}, LOGIN_TIMEOUT)
+    query = {
+        'scope': 'openid',
+        'response_type': 'id_token',
+        'response_mode': 'form_post',
+        'prompt': 'none',
+        'client_id': platform.client_id,
+        'redirect_uri': params['target_link_uri'],
+        'login_hint': params['login_hint'],
+        'state': state,
+        'nonce': nonce,
+    }
+    if params.get('lti_message_hint'):
+        query['lti_message_hint'] = params['lti_message_hint']
+    separator = '&' if '?' in platform.auth_login_url else '?'
+    return '{}{}{}'.format(platform.auth_login_url, separator, urlencode(query))
+
+
+def validate_launch(id_token, state):
+    """
+    Validate an LTI 1.3 resource link launch
+    :param id_token: str, id token (JWT) posted by the platform
+    :param state: str, state of the login request
+    :return: (LtiPlatform model instance, dict of id token claims) tuple
+    """
+    login = cache.get(get_login_state_cache_key(state)) if state else None
+    if login is None:
+        raise LaunchError('Unknown or expired login state')
+    # the state is used once
+    cache.delete(get_login_state_cache_key(state))
+    platform = LtiPlatform.objects.select_related('lti_consumer').filter(pk=login['platform']).first()
+    if platform is None:
+        raise LaunchError('Platform of the login no longer exists')
+
+    try:
+        header = jwt.get_unverified_header(id_token)
+        if header.get('alg') != 'RS256':
+            raise LaunchError('Unsupported id token algorithm: {}'.format(header.get('alg')))
+        claims = jwt.decode(
+            id_token,
+            get_platform_key(platform, header.get('kid')),
+            algorithms=['RS256'],
+            audience=platform.client_id,
+            issuer=platform.issuer,
+            leeway=LEEWAY,
+        )
+    except jwt.InvalidTokenError as err:
+        raise LaunchError('Invalid id token: {}'.format(err))
+    except requests.RequestException as err:
+        raise LaunchError('Key set of {} could not be fetched: {}'.format(platform, err))
+    except (ValueError, InvalidKeyError) as err:
+        # response that isn't json, or keys that can't be parsed
+        raise LaunchError('Key set of {} is not valid: {}'.format(platform, err))
+
+    if claims.get('nonce') != login['nonce']:
+        raise LaunchError('Invalid id token nonce')
+    if isinstance(claims.get('aud'), list) and len(claims['aud']) > 1 and claims.get('azp') != platform.client_id:
+        raise LaunchError('Invalid id token authorized party')
+    if claims.get(VERSION_CLAIM) != LTI_VERSION:
+        raise LaunchError('Unsupported LTI version: {}'.format(claims.get(VERSION_CLAIM)))
+    if claims.get(MESSAGE_TYPE_CLAIM) != RESOURCE_LINK_MESSAGE:
+        raise LaunchError('Unsupported message type: {}'.format(claims.get(MESSAGE_TYPE_CLAIM)))
+    if platform.deployment_id and claims.get(DEPLOYMENT_CLAIM) != platform.deployment_id:
+        raise LaunchError('Unknown deployment: {}'.format(claims.get(DEPLOYMENT_CLAIM)))
+    if not claims.get('sub'):
+        raise LaunchError('Id token has no subject')
+    return platform, claims
+
+
+def get_launch_params(platform, claims):
+    """
+    LTI 1.1 launch params equivalent to the claims of an LTI 1.3 launch, stored in the session
+    :return: dict
+    """
+    params = {
+        # marks the session as an lti session (see check_if_lti_session)
+        'lti_message_type': 'basic-lti-launch-request',
+        'lti_version': claims[VERSION_CLAIM],
+        # consumer of the platform, which the users, shard and grade passback of the session are looked up with
+        'oauth_consumer_key': platform.lti_consumer.consumer_key,
+        'lti13_platform': platform.pk,
+        'deployment_id': claims.get(DEPLOYMENT_CLAIM, ''),
+        'user_id': claims['sub'],
+        'roles': ','.join(claims.get(ROLES_CLAIM, [])),
+        'context_id': claims.get(CONTEXT_CLAIM, {}).get('id', ''),
+        'context_title': claims.get(CONTEXT_CLAIM, {}).get('title', ''),
+        'resource_link_id': claims.get(RESOURCE_LINK_CLAIM, {}).get('id', ''),
+        'tool_consumer_instance_guid': claims.get(TOOL_PLATFORM_CLAIM, {}).get('guid', ''),
+    }
+    if claims.get('email'):
+        params['lis_person_contact_email_primary'] = claims['email']
+    endpoint = claims.get(AGS_CLAIM, {})
+    if endpoint.get('lineitem') and SCORE_SCOPE in endpoint.get('scope', []):
+        params['lti13_lineitem'] = endpoint['lineitem']
+    return params
+
+
+@functools.lru_cache()
+def load_tool_private_key(pem):
+    return serialization.load_pem_private_key(pem.encode('utf-8'), password=None, backend=default_backend())
+
+
+def get_tool_private_key():
+    pem = getattr(settings, 'LTI_TOOL_PRIVATE_KEY', None)
+    if not pem:
+        raise ValueError('LTI_TOOL_PRIVATE_KEY setting is required for LTI 1.3 services')
+    return load_tool_private_key(pem)
+
+
+def get_tool_key_id():
+    return getattr(settings, 'LTI_TOOL_KEY_ID', 'poll')
+
+
+def get_tool_jwks():
+    """
+    :return: dict, json web key set of the tool's public key
+    """
+    jwk = json.loads(RSAAlgorithm.to_jwk(get_tool_private_key().public_key()))
+    jwk.update({'kid': get_tool_key_id(), 'alg': 'RS256', 'use': 'sig'})
+    return {'keys': [jwk]}
+
+
+def get_access_token_cache_key(platform, scope):
+    return 'ltiprovider:lti13:token:{}:{}'.format(platform.pk, hashlib.sha1(scope.encode('utf-8')).hexdigest())
+
+
+def get_access_token(platform, scopes):
+    """
+    OAuth2 access token of the tool for platform services, requested with a signed client assertion (client
+    credentials grant) and cached until shortly before it expires
+    :param platform: LtiPlatform model instance
+    :param scopes: list of str, scopes of the token
+    :return: str, access token
+    """
+    scope = ' '.join(sorted(scopes))
+    cache_key = get_access_token_cache_key(platform, scope)
+    token = cache.get(cache_key)
+    if token is not None:
+        return token
+
+    now = int(time.time())
+    assertion = jwt.encode(
+        {
+            'iss': platform.client_id,
+            'sub': platform.client_id,
+            'aud': platform.auth_token_url,
+            'iat': now,
+            'exp': now + 300,
+            'jti': uuid.uuid4().hex,
+        },
+        get_tool_private_key(),
+        algorithm='RS256',
+        headers={'kid': get_tool_key_id()},
+    )
+    response = http.post(platform.auth_token_url, data={
+        'grant_type': 'client_credentials',
+        'client_assertion_type': 'urn:ietf:params:oauth:client-assertion-type:jwt-bearer',
+        'client_assertion': assertion.decode('utf-8') if isinstance(assertion, bytes) else assertion,
+        'scope': scope,
+    }, timeout=REQUEST_TIMEOUT)
+    response.raise_for_status()
+    data = response.json()
+    token = data['access_token']
+    cache.set(cache_key, token, max(int(data.get('expires_in', 3600)) - TOKEN_EXPIRY_MARGIN, 1))
+    return token
+
+
+def get_scores_url(lineitem_url):
+    """
+    :return: str, url of the scores endpoint of a line item (which may have query parameters)
+    """
+    parts = urlsplit(lineitem_url)
+    return urlunsplit(parts._replace(path=parts.path.rstrip('/') + '/scores'))
+
+
+def publish_score(platform, lineitem_url, user_id, score):
+    """
+    Publish a learner's score to a line item, with the assignment and grade services
+    :param platform: LtiPlatform model instance
+    :param lineitem_url: str, line item of the launch (AGS endpoint claim)
+    :param user_id: str, platform user id (sub claim)
+    :param score: float, score between 0.0 and 1.0
+    :return: requests.Response
+    """
+    body = {
+        'userId': user_id,
+        'scoreGiven': score,
+        'scoreMaximum': 1.0,
+        'activityProgress': 'Completed',
+        'gradingProgress': 'FullyGraded',
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+    }
+    for attempt in range(2):
+        token = get_access_token(platform, [SCORE_SCOPE])
+        response = http.post(
+            get_scores_url(lineitem_url),
+            data=json.dumps(body),
+            headers={'Authorization': 'Bearer {}'.format(token), 'Content-Type': SCORE_CONTENT_TYPE},
+            timeout=REQUEST_TIMEOUT,
+        )
+        if response.status_code == 401 and attempt == 0:
+            # token revoked before its expiry: request a new one
+            cache.delete(get_access_token_cache_key(platform, SCORE_SCOPE))
+            continue
+        break
+    response.raise_for_status()
+    log.info('Published score to LMS. score=%s, lineitem=%s, user_id=%s', score, lineitem_url, user_id)
+    return response
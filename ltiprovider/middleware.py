@@ -0,0 +1,18 @@
+from .routers import set_shard
+
+
+class ShardMiddleware:
+    """
+    Resets the shard database of the request (see ltiprovider.routers) once the response is rendered,
+    so that the shard of an lti request doesn't leak into later requests served by the same thread
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        set_shard(None)
+        try:
+            return self.get_response(request)
+        finally:
+            set_shard(None)
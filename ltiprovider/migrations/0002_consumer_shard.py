@@ -0,0 +1,24 @@
+# Generated by Django 2.0.5 on 2026-10-19 19:27
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ltiprovider', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lticonsumer',
+            name='shard',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AlterField(
+            model_name='ltiuser',
+            name='lti_consumer',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, to='ltiprovider.LtiConsumer'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 2.0.5 on 2026-10-19 19:42
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ltiprovider', '0002_consumer_shard'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LtiPlatform',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('issuer', models.CharField(max_length=255)),
+                ('client_id', models.CharField(max_length=255)),
+                ('deployment_id', models.CharField(blank=True, max_length=255)),
+                ('auth_login_url', models.URLField(max_length=1024, verbose_name='OIDC authentication url')),
+                ('auth_token_url', models.URLField(max_length=1024, verbose_name='OAuth2 access token url')),
+                ('jwks_url', models.URLField(max_length=1024, verbose_name='Platform key set (JWKS) url')),
+                ('lti_consumer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='ltiprovider.LtiConsumer')),
+            ],
+            options={
+                'verbose_name': 'LTI 1.3 Platform',
+                'verbose_name_plural': 'LTI 1.3 Platforms',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='ltiplatform',
+            unique_together={('issuer', 'client_id')},
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 2.0.5 on 2026-10-19 19:53
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ltiprovider', '0003_lti_platform'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ltiuser',
+            name='last_launch',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
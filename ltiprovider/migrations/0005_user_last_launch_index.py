@@ -0,0 +1,19 @@
+# Generated by Django 2.0.5 on 2026-10-19 20:21
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ltiprovider', '0004_user_last_launch'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='ltiuser',
+            name='last_launch',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now),
+        ),
+    ]
@@ -1,3 +1,4 @@
+from datetime import timedelta
 from importlib import import_module
 import logging
 from urllib.parse import urlencode, urlparse, parse_qs
@@ -8,46 +9,71 @@ from django.http import Http404
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.clickjacking import xframe_options_exempt
 from django.shortcuts import redirect
+from django.utils import timezone
 from lti import InvalidLTIRequestError
 from lti.contrib.django import DjangoToolProvider
 from oauthlib.oauth1 import OAuth1Error
 
+from .lti13 import LaunchError, get_launch_params, validate_launch
 from .models import LtiUser, LtiConsumer
 from .outcomes import update_grade
+from .routers import set_shard
 from .validator import SignatureValidator
 
 
 log = logging.getLogger(__name__)
 SessionStore = import_module(settings.SESSION_ENGINE).SessionStore
 
+# LtiUser.last_launch is only updated when older than this, so that launches don't write the user row
+LAST_LAUNCH_RESOLUTION = timedelta(days=1)
+
 
 class LtiMixin:
     """
     Mixin for LTI launch views
     Workflow:
     - LTI authentication
-        - look up secret using consumer key
-        - request verification
+        - LTI 1.1: look up secret using consumer key, request verification
+        - LTI 1.3: id token verification (see ltiprovider.lti13)
     - Get or create user based on (user_id, tool consumer instance id)
+    - Route learner and response data to the consumer's shard database (see ltiprovider.routers)
     Also supports environments where cookies are not able to be set, by putting session key in url
+
+    By default the launch POST is answered with a redirect to the same view as a GET request.
+    Set render_on_launch (or the LTI_RENDER_ON_LAUNCH setting) to render the view directly in the launch response,
+    saving a round trip through the LMS iframe.
     """
+    # None means use the LTI_RENDER_ON_LAUNCH setting
+    render_on_launch = None
+
+    # url of the view as a GET request, set when the view is rendered directly in the launch response
+    lti_launch_url = None
+
     @csrf_exempt
     @xframe_options_exempt
     def dispatch(self, request, *args, **kwargs):
         # flow for initial LTI launch
-        if request.method == 'POST' and request.POST.get('lti_message_type') == 'basic-lti-launch-request':
+        if request.method == 'POST' and is_launch_request(request):
             # path to redirect to as GET request
             redirect_path = request.path
+            session_in_url = False
             if not request.session.session_key:
                 request.session.create()
                 log.debug("LTI Launch: Session key storage in cookie failed; created new session")
                 # append session id to end of redirect path
                 redirect_path = "{}?{}".format(redirect_path, urlencode({'session': request.session.session_key}))
+                session_in_url = True
 
             # store lti launch params in session before redirecting
-            tool_provider = DjangoToolProvider.from_django_request(request=request)
-            validate_lti_request(tool_provider)
-            initialize_lti_session(request, tool_provider)
+            if 'id_token' in request.POST:
+                initialize_lti13_session(request)
+            else:
+                tool_provider = DjangoToolProvider.from_django_request(request=request)
+                validate_lti_request(tool_provider)
+                initialize_lti_session(request, tool_provider)
+
+            if self.is_render_on_launch():
+                return self.render_launch(request, redirect_path, session_in_url, *args, **kwargs)
 
             # redirect to same view as get instead of post
             return redirect(redirect_path)
@@ -60,9 +86,43 @@ class LtiMixin:
             if not is_lti_session:
                 log.error('LTI session is not found, Request cannot be processed')
                 raise PermissionDenied("Content is available only through LTI protocol.")
+            set_consumer_shard(request)
 
             return super(LtiMixin, self).dispatch(request, *args, **kwargs)
 
+    def is_render_on_launch(self):
+        """
+        Indicates whether the launch request should be answered by rendering the view instead of redirecting to it
+        :return: bool
+        """
+        if self.render_on_launch is not None:
+            return self.render_on_launch
+        return getattr(settings, 'LTI_RENDER_ON_LAUNCH', False)
+
+    def render_launch(self, request, launch_url, session_in_url, *args, **kwargs):
+        """
+        Render the view in the response to the launch request, as if it was the GET request following the redirect.
+        If the session key could not be stored in a cookie it is added as the "session" query parameter of the request,
+        so that urls built from the request (e.g. session_redirect, form actions) carry it.
+        The launch url is made available to the template as lti_launch_url (see ltiprovider/launch.html),
+        so the page can replace the POST history entry and a refresh does not resubmit the launch.
+        :param request: django request object
+        :param launch_url: url of the view as a GET request
+        :param session_in_url: bool, True if the session key is passed in the url
+        :return: HttpResponse
+        """
+        request.method = 'GET'
+        if session_in_url:
+            request.GET = request.GET.copy()
+            request.GET['session'] = request.session.session_key
+        self.lti_launch_url = launch_url
+        return super(LtiMixin, self).dispatch(request, *args, **kwargs)
+
+    def get_context_data(self, **kwargs):
+        context = super(LtiMixin, self).get_context_data(**kwargs)
+        context['lti_launch_url'] = self.lti_launch_url
+        return context
+
     def get_lti_user(self):
         """
         Useful for getting the lti user object in a view
@@ -73,9 +133,17 @@ class LtiMixin:
     def is_graded(self):
         """
         Indicates whether the lti component is graded or ungraded, based on presence of lis_result_sourcedid param
+        (or of an LTI 1.3 line item)
         :return: bool, True if graded, False if not graded
         """
-        return 'lis_result_sourcedid' in self.request.session
+        return 'lis_result_sourcedid' in self.request.session or 'lti13_lineitem' in self.request.session
+
+    def is_instructor(self):
+        """
+        Indicates whether the launch user has an instructor role in the course (see has_instructor_role)
+        :return: bool
+        """
+        return has_instructor_role(self.request.session.get('roles', ''))
 
     def update_grade(self, score):
         """
@@ -88,6 +156,28 @@ class LtiMixin:
         return update_grade(self.request.session, score)
 
 
+def has_instructor_role(roles):
+    """
+    Checks lti launch roles for an instructor role (LTI_INSTRUCTOR_ROLES setting).
+    Roles are matched by their short name, so that "Instructor" also matches "urn:lti:role:ims/lis/Instructor"
+    and sub-roles such as "urn:lti:role:ims/lis/TeachingAssistant/TeachingAssistantSection"
+    :param roles: str, comma-separated roles launch param (or list of roles)
+    :return: bool
+    """
+    if isinstance(roles, str):
+        roles = roles.split(',')
+    instructor_roles = settings.LTI_INSTRUCTOR_ROLES
+    for role in roles:
+        # urn:lti:role:ims/lis/<role>[/<sub-role>] (or <role>[/<sub-role>] for short names)
+        # or http://purl.imsglobal.org/vocab/lis/v2/membership[/<role>]#<role>
+        names = role.strip().rsplit('#', 1)[-1].rsplit(':', 1)[-1].split('/')
+        if 'lis' in names:
+            names = names[names.index('lis') + 1:]
+        if names and names[0] in instructor_roles:
+            return True
+    return False
+
+
 def get_session_key(request):
     """
     Get the session key of the relevant current django session.
@@ -97,8 +187,6 @@ def get_session_key(request):
     :param request: django request object
     :return: str, session key
     """
-    log.debug("Referring url: {}".format(request.META.get('HTTP_REFERER')))
-    referring_url_params = parse_qs(urlparse(request.META.get('HTTP_REFERER')).query)
     if request.session.session_key:
         return request.session.session_key
     elif 'session' in request.GET:
@@ -106,7 +194,9 @@ def get_session_key(request):
         log.debug('Getting session key from url')
         return request.GET['session']
     # check if session is a query param in referring url
-    elif 'session' in referring_url_params:
+    log.debug("Referring url: %s", request.META.get('HTTP_REFERER'))
+    referring_url_params = parse_qs(urlparse(request.META.get('HTTP_REFERER')).query)
+    if 'session' in referring_url_params:
         log.debug("Getting session key from referring url")
         return referring_url_params['session'][0]
     else:
@@ -120,10 +210,35 @@ def set_session(request):
     :return: None
     """
     session_key = get_session_key(request)
-    log.debug("Setting session with key: {}".format(session_key))
+    if session_key == request.session.session_key:
+        # the session of the session cookie, already loaded by SessionMiddleware (e.g. see config.profiling)
+        return
+    log.debug("Setting session, session_key=%s", session_key)
     request.session = SessionStore(session_key)
 
 
+def is_launch_request(request):
+    """
+    :return: bool, True for LTI 1.1 launch requests and LTI 1.3 launch requests (id token posted after the OIDC login)
+    """
+    if request.POST.get('lti_message_type') == 'basic-lti-launch-request':
+        return True
+    return 'id_token' in request.POST and 'state' in request.POST
+
+
+def clear_launch_params(session):
+    """
+    Remove the params of an earlier launch from the session, so that a launch doesn't inherit the grade passback
+    (lis_result_sourcedid, lis_outcome_service_url, lti13_lineitem), context or roles of an earlier launch
+    in the same browser session. Django's own session keys start with an underscore and are kept
+    :param session: django session
+    :return: None
+    """
+    for key in list(session.keys()):
+        if not key.startswith('_'):
+            del session[key]
+
+
 def initialize_lti_session(request, tool_provider):
     """
     Store all LTI params in session and create LTI user object if necessary
@@ -131,13 +246,47 @@ def initialize_lti_session(request, tool_provider):
     :param tool_provider: lti.ToolProvider object
     :return: None
     """
-    # store all LTI params in session
+    # store all LTI params in session, replacing those of an earlier launch
+    clear_launch_params(request.session)
     for prop, value in tool_provider.to_params().items():
         request.session[prop] = value
 
+    set_consumer_shard(request)
     get_or_create_lti_user(tool_provider)
 
 
+def initialize_lti13_session(request):
+    """
+    Validate an LTI 1.3 launch, store its claims in session as LTI 1.1 params and create LTI user object if necessary
+    Raises Http404 if the launch is not valid
+    :param request: django request object
+    :return: None
+    """
+    try:
+        platform, claims = validate_launch(request.POST['id_token'], request.POST['state'])
+    except LaunchError as err:
+        log.error('Error occurred during LTI 1.3 launch verification: %s', err)
+        raise Http404('LTI request is not valid')
+    launch_params = get_launch_params(platform, claims)
+    clear_launch_params(request.session)
+    request.session.update(launch_params)
+
+    set_consumer_shard(request)
+    get_or_create_launch_user(launch_params)
+
+
+def set_consumer_shard(request):
+    """
+    Route sharded models to the shard database of the lti session's consumer, for the rest of the request
+    (reset by ShardMiddleware)
+    :param request: django request object
+    :return: None
+    """
+    consumer_key = request.session.get('oauth_consumer_key')
+    shard = LtiConsumer.objects.filter(consumer_key=consumer_key).values_list('shard', flat=True).first()
+    set_shard(shard or None)
+
+
 def check_if_lti_session(request):
     """
     Checks if request is part of a lti user session,
@@ -168,7 +317,7 @@ def validate_lti_request(tool_provider):
         is_valid_lti_request = tool_provider.is_valid_request(validator)
     except (OAuth1Error, InvalidLTIRequestError, ValueError) as err:
         is_valid_lti_request = False
-        log.error('Error occurred during LTI request verification: {}'.format(err.__str__()))
+        log.error('Error occurred during LTI request verification: %s', err)
     if not is_valid_lti_request:
         raise Http404('LTI request is not valid')
 
@@ -182,13 +331,22 @@ def get_or_create_lti_user(tool_provider):
     Handle some cases where these request parameters are not found or invalid
     :return: (LtiUser model instance, bool)
     """
-    user_id = tool_provider.launch_params.get('user_id')
+    return get_or_create_launch_user(tool_provider.launch_params)
+
+
+def get_or_create_launch_user(launch_params):
+    """
+    Get or create lti user based on lti launch params (see get_or_create_lti_user)
+    :param launch_params: dict-like of lti launch params
+    :return: (LtiUser model instance, bool)
+    """
+    user_id = launch_params.get('user_id')
 
     # get lti consumer model instance
-    lti_consumer = LtiConsumer.objects.get(consumer_key=tool_provider.launch_params.get('oauth_consumer_key'))
+    lti_consumer = LtiConsumer.objects.get(consumer_key=launch_params.get('oauth_consumer_key'))
 
     # tool consumer instance guid - set using default for lti consuumer if missing
-    tool_consumer_instance_guid = tool_provider.launch_params.get('tool_consumer_instance_guid')
+    tool_consumer_instance_guid = launch_params.get('tool_consumer_instance_guid')
     if not tool_consumer_instance_guid:
         tool_consumer_instance_guid = lti_consumer.default_tool_consumer_instance_guid
         # TODO possibly infer a tool_consumer_instance_guid value based on request origin
@@ -199,4 +357,8 @@ def get_or_create_lti_user(tool_provider):
         lti_consumer=lti_consumer,
         tool_consumer_instance_guid=tool_consumer_instance_guid
     )
+    now = timezone.now()
+    if not created and lti_user.last_launch < now - LAST_LAUNCH_RESOLUTION:
+        LtiUser.objects.filter(pk=lti_user.pk).update(last_launch=now)
+        lti_user.last_launch = now
     return lti_user, created
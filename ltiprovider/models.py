@@ -3,10 +3,14 @@ from __future__ import unicode_literals
 
 import hashlib
 from django.conf import settings
+from django.core.exceptions import ValidationError
 from django.db import models
 from django.db.models import fields
+from django.utils import timezone
 import shortuuid
 
+from .routers import get_default_shard, get_shard_databases
+
 
 def short_token():
     """Generate a 20-character random token"""
@@ -28,6 +32,8 @@ class LtiConsumer(models.Model):
     consumer_secret = models.CharField(max_length=32, unique=True, default=short_token)
     expiration_date = models.DateField(verbose_name='Consumer key expiration date', null=True, blank=True)
     default_tool_consumer_instance_guid = fields.CharField(max_length=255, blank=True)
+    # database alias of the consumer's learner and response data (see ltiprovider.routers), blank for the default shard
+    shard = models.CharField(max_length=64, blank=True, default='')
 
     class Meta:
         verbose_name = "LTI Consumer"
@@ -36,16 +42,62 @@ class LtiConsumer(models.Model):
     def __str__(self):
         return '<LtiConsumer: {}>'.format(self.consumer_name)
 
+    def clean(self):
+        if self.shard and self.shard not in get_shard_databases():
+            raise ValidationError({'shard': 'Unknown shard database: {}'.format(self.shard)})
+
+    def get_shard(self):
+        """
+        :return: str, shard database alias of the consumer's data
+        """
+        return self.shard or get_default_shard()
+
+
+class LtiPlatform(models.Model):
+    """
+    Model to manage LTI 1.3 platforms (see ltiprovider.lti13).
+
+    A platform registration is identified by its issuer and the client id it assigned to the tool.
+    Its launches are made on behalf of an lti consumer, whose users, shard and consumer key (in the session)
+    are shared with LTI 1.1 launches.
+    """
+
+    name = models.CharField(max_length=255)
+    issuer = models.CharField(max_length=255)
+    client_id = models.CharField(max_length=255)
+    # blank to accept launches from any deployment of the tool on the platform
+    deployment_id = models.CharField(max_length=255, blank=True)
+    auth_login_url = models.URLField(verbose_name='OIDC authentication url', max_length=1024)
+    auth_token_url = models.URLField(verbose_name='OAuth2 access token url', max_length=1024)
+    jwks_url = models.URLField(verbose_name='Platform key set (JWKS) url', max_length=1024)
+    lti_consumer = models.ForeignKey('LtiConsumer', on_delete=models.CASCADE)
+
+    class Meta:
+        verbose_name = "LTI 1.3 Platform"
+        verbose_name_plural = "LTI 1.3 Platforms"
+        unique_together = (
+            ('issuer', 'client_id'),
+        )
+
+    def __str__(self):
+        return '<LtiPlatform: {}>'.format(self.name)
+
 
 class LtiUser(models.Model):
     """
     Model to manage LTI users.
+
+    Stored on the shard database of the consumer (see ltiprovider.routers);
+    users are deleted with their consumer by a signal handler, since the consumer is on the catalog database.
     """
+    sharded = True
 
     user_id = fields.CharField(max_length=255)
     email = fields.CharField(max_length=255, blank=True, null=True)
-    lti_consumer = models.ForeignKey('LtiConsumer', on_delete=models.CASCADE)
+    lti_consumer = models.ForeignKey('LtiConsumer', on_delete=models.DO_NOTHING, db_constraint=False)
     tool_consumer_instance_guid = fields.CharField(max_length=255, default='')
+    # updated at most daily (see get_or_create_launch_user), users without responses are pruned after a while
+    last_launch = models.DateTimeField(default=timezone.now, db_index=True)
 
     class Meta(object):
         verbose_name = "LTI User"
@@ -1,6 +1,7 @@
 import logging
 from lti import OutcomeRequest
-from .models import LtiConsumer
+from .lti13 import publish_score
+from .models import LtiConsumer, LtiPlatform
 
 
 log = logging.getLogger(__name__)
@@ -10,9 +11,13 @@ def update_grade(params, score):
     """
     Update the lti consumer grade
     :param params: Usually a request.session; Should have keys oauth_consumer_key, lis_outcome_service_url, lis_result_sourcedid
+        (or lti13_platform, lti13_lineitem and user_id for LTI 1.3 launches)
     :param score: Score between 0.0 and 1.0
     :return: lms response
     """
+    if 'lti13_lineitem' in params:
+        platform = LtiPlatform.objects.get(pk=params['lti13_platform'])
+        return publish_score(platform, params['lti13_lineitem'], params['user_id'], score)
     # check if component is graded, since this is a common lms configuration error
     if 'oauth_consumer_key' in params and 'lis_outcome_service_url' not in params:
         raise KeyError('lis_outcome_service_url not found in LTI params. Is the lti consumer component graded?')
@@ -43,12 +48,11 @@ def send_grade_update(consumer_key, consumer_secret, lis_outcome_service_url, li
     outcome_request.lis_outcome_service_url = lis_outcome_service_url
     outcome_request.lis_result_sourcedid = lis_result_sourcedid
 
-    # construct info string for logging
-    args = "score={}, lis_outcome_service_url={} lis_result_sourcedid={}, consumer_key={}, consumer_secret={}, ".format(
-        score, lis_outcome_service_url, lis_result_sourcedid, consumer_key, consumer_secret
-    )
+    # parameters for logging, formatted only if the record is emitted (the consumer secret is never logged)
+    params = 'score=%s, lis_outcome_service_url=%s, lis_result_sourcedid=%s, consumer_key=%s'
+    args = (score, lis_outcome_service_url, lis_result_sourcedid, consumer_key)
 
-    log.debug("Updating LMS grade, with parameters: {}".format(args))
+    log.debug("Updating LMS grade, with parameters: " + params, *args)
 
     # send request to update score
     outcome_request.post_replace_result(score)
@@ -58,12 +62,12 @@ def send_grade_update(consumer_key, consumer_secret, lis_outcome_service_url, li
 
     # logging
     if lms_response.is_success():
-        log.info("Successfully sent updated grade to LMS. {}".format(args))
+        log.info("Successfully sent updated grade to LMS. " + params, *args)
     elif lms_response.is_processing():
-        log.info("Grade update is being processed by LMS. {}, comment: {}".format(args, 'processing'))
+        log.info("Grade update is being processed by LMS. " + params + ", comment: %s", *args, 'processing')
     elif lms_response.has_warning():
-        log.warning("Grade update response has warnings. {}, comment={}".format(args, 'processing'))
+        log.warning("Grade update response has warnings. " + params + ", comment=%s", *args, 'processing')
     else:
-        log.error("Grade update request failed. {}, comment={}".format(args, lms_response.code_major))
+        log.error("Grade update request failed. " + params + ", comment=%s", *args, lms_response.code_major)
 
     return lms_response
\ No newline at end of file
@@ -0,0 +1,43 @@
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+
+def get_estimated_count(queryset):
+    """
+    Row count estimate of the table of a queryset model, from the database planner statistics
+    Only supported on postgresql
+    :param queryset: django queryset
+    :return: int, estimated number of rows, or None if not available
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT reltuples::bigint FROM pg_class WHERE relname = %s",
+            [queryset.model._meta.db_table]
+        )
+        row = cursor.fetchone()
+    return row[0] if row else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that uses the planner row estimate instead of an exact COUNT(*) for unfiltered querysets of large tables
+    Exact counts are used for filtered querysets and for tables smaller than estimate_threshold rows
+    """
+    estimate_threshold = 100000
+
+    # True if count is an estimate
+    is_estimated = False
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if hasattr(queryset, 'query') and not queryset.query.where:
+            estimate = get_estimated_count(queryset)
+            if estimate is not None and estimate >= self.estimate_threshold:
+                self.is_estimated = True
+                return estimate
+        return super().count
@@ -0,0 +1,109 @@
+"""
+Database sharding by LTI consumer.
+
+Models with a true "sharded" class attribute (learner and response data, e.g. LtiUser) are stored on the shard database
+of the consumer (LtiConsumer.shard), so that one consumer's load doesn't degrade the others.
+All other models (e.g. LtiConsumer, questions) are stored on the shared catalog database, "default".
+Relations from sharded models to catalog models must not have database constraints (db_constraint=False),
+and queries must not join across them.
+
+The shard of a request is resolved once, from the oauth_consumer_key of the lti session (see LtiMixin),
+and is reset after the response by ShardMiddleware. Outside of lti requests (e.g. admin, management commands)
+the default shard is used, unless selected with use_shard().
+
+Settings:
+    LTI_SHARD_DATABASES: list of shard database aliases (default: ['default'])
+    LTI_DEFAULT_SHARD: shard of consumers without one, and outside of lti requests (default: first shard)
+
+Add 'ltiprovider.routers.ShardRouter' to DATABASE_ROUTERS and
+'ltiprovider.middleware.ShardMiddleware' to MIDDLEWARE.
+"""
+from contextlib import contextmanager
+import threading
+
+from django.apps import apps
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+
+CATALOG_DATABASE = DEFAULT_DB_ALIAS
+
+_state = threading.local()
+
+
+def get_shard_databases():
+    """
+    :return: list of str, shard database aliases
+    """
+    return list(getattr(settings, 'LTI_SHARD_DATABASES', [DEFAULT_DB_ALIAS]))
+
+
+def get_default_shard():
+    """
+    :return: str, shard database alias of consumers without a shard
+    """
+    return getattr(settings, 'LTI_DEFAULT_SHARD', None) or get_shard_databases()[0]
+
+
+def get_shard():
+    """
+    :return: str, shard database alias of the current request (or use_shard block)
+    """
+    return getattr(_state, 'shard', None) or get_default_shard()
+
+
+def set_shard(shard):
+    """
+    Set the shard of the current thread, until reset with set_shard(None)
+    :param shard: str, shard database alias, or None for the default shard
+    """
+    if shard is not None and shard not in get_shard_databases():
+        raise ValueError('Unknown shard database: {}'.format(shard))
+    _state.shard = shard
+
+
+@contextmanager
+def use_shard(shard):
+    """
+    Route sharded models to a shard within a block, e.g. to run maintenance tasks on each shard
+    """
+    previous = getattr(_state, 'shard', None)
+    set_shard(shard)
+    try:
+        yield shard
+    finally:
+        _state.shard = previous
+
+
+def is_sharded(model):
+    return getattr(model, 'sharded', False)
+
+
+class ShardRouter:
+    """
+    Routes sharded models to the current shard, and all other models to the catalog database
+    """
+
+    def db_for_read(self, model, **hints):
+        return get_shard() if is_sharded(model) else CATALOG_DATABASE
+
+    def db_for_write(self, model, **hints):
+        return get_shard() if is_sharded(model) else CATALOG_DATABASE
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # relations between sharded and catalog models are resolved by the router, without database constraints
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if model_name is None:
+            return None
+        try:
+            model = apps.get_model(app_label, model_name)
+        except LookupError:
+            # historical model that no longer exists
+            return None
+        if is_sharded(model):
+            return db in get_shard_databases()
+        # catalog tables are also created (and left empty) on shard databases,
+        # so that foreign keys of earlier migrations resolve
+        return None
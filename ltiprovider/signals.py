@@ -0,0 +1,11 @@
+from .models import LtiUser
+from .routers import get_shard_databases
+
+
+def delete_consumer_users(sender, instance, **kwargs):
+    """
+    Delete the users (and their data) of a deleted consumer from the shard databases
+    Every shard is checked, in case the consumer was being moved between shards
+    """
+    for shard in get_shard_databases():
+        LtiUser.objects.using(shard).filter(lti_consumer_id=instance.pk).delete()
@@ -1,6 +1,518 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
-from django.test import TestCase
+import json
+import time
+from types import SimpleNamespace
+from unittest import mock
+from urllib.parse import parse_qs, urlsplit
 
-# Create your tests here.
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from django.conf import settings
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.cache import cache
+from django.core.cache.backends.db import DatabaseCache
+from django.db import router
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+import jwt
+from jwt.algorithms import RSAAlgorithm
+from lti import ToolConsumer
+import requests
+
+from poll.models import Choice, Question
+
+from . import lti13
+from .middleware import ShardMiddleware
+from .mixins import has_instructor_role, initialize_lti13_session, initialize_lti_session, set_consumer_shard
+from .models import LtiConsumer, LtiPlatform, LtiUser
+from .routers import get_shard, set_shard, use_shard
+
+
+class ShardRouterTest(TestCase):
+    """
+    Routing of sharded models, with the shard1 and shard2 databases of the test settings
+    """
+    multi_db = True
+
+    def setUp(self):
+        self.consumer = LtiConsumer.objects.create(consumer_name='consumer', shard='shard2')
+
+    def tearDown(self):
+        set_shard(None)
+
+    def test_default_shard(self):
+        self.assertEqual(get_shard(), 'shard1')
+        user = LtiUser.objects.create(user_id='learner', lti_consumer=self.consumer)
+        self.assertEqual(user._state.db, 'shard1')
+        self.assertTrue(LtiUser.objects.using('shard1').filter(pk=user.pk).exists())
+        self.assertFalse(LtiUser.objects.using('shard2').exists())
+
+    def test_catalog_models(self):
+        with use_shard('shard2'):
+            self.assertEqual(router.db_for_read(LtiUser), 'shard2')
+            self.assertEqual(router.db_for_write(LtiUser), 'shard2')
+            self.assertEqual(router.db_for_read(LtiConsumer), 'default')
+            self.assertEqual(router.db_for_write(LtiConsumer), 'default')
+        self.assertEqual(LtiConsumer.objects.using('shard1').count(), 0)
+
+    def test_use_shard(self):
+        with use_shard('shard2'):
+            self.assertEqual(get_shard(), 'shard2')
+            user = LtiUser.objects.create(user_id='learner', lti_consumer=self.consumer)
+            with use_shard('shard1'):
+                self.assertFalse(LtiUser.objects.filter(pk=user.pk).exists())
+            self.assertEqual(get_shard(), 'shard2')
+            self.assertEqual(LtiUser.objects.get(pk=user.pk).lti_consumer, self.consumer)
+        self.assertEqual(get_shard(), 'shard1')
+        self.assertFalse(LtiUser.objects.filter(user_id='learner').exists())
+        self.assertTrue(LtiUser.objects.using('shard2').filter(user_id='learner').exists())
+
+    def test_use_shard_restores_shard_on_error(self):
+        set_shard('shard2')
+        with self.assertRaises(RuntimeError):
+            with use_shard('shard1'):
+                raise RuntimeError
+        self.assertEqual(get_shard(), 'shard2')
+
+    def test_unknown_shard(self):
+        with self.assertRaises(ValueError):
+            set_shard('unknown')
+        with self.assertRaises(ValueError):
+            with use_shard('unknown'):
+                pass
+        self.assertEqual(get_shard(), 'shard1')
+
+    def test_consumer_shard_of_request(self):
+        request = RequestFactory().get('/')
+        request.session = {'oauth_consumer_key': self.consumer.consumer_key}
+
+        def view(request):
+            set_consumer_shard(request)
+            self.assertEqual(get_shard(), 'shard2')
+            return None
+
+        ShardMiddleware(view)(request)
+        # the shard doesn't leak into the next request of the thread
+        self.assertEqual(get_shard(), 'shard1')
+
+    def test_consumer_without_shard(self):
+        consumer = LtiConsumer.objects.create(consumer_name='unsharded')
+        request = RequestFactory().get('/')
+        request.session = {'oauth_consumer_key': consumer.consumer_key}
+        set_shard('shard2')
+        set_consumer_shard(request)
+        self.assertEqual(get_shard(), 'shard1')
+
+
+class InstructorRoleTest(TestCase):
+
+    def test_roles(self):
+        self.assertTrue(has_instructor_role('Learner,urn:lti:role:ims/lis/Instructor'))
+        self.assertTrue(has_instructor_role(['urn:lti:role:ims/lis/TeachingAssistant/TeachingAssistantSection']))
+        self.assertTrue(has_instructor_role('http://purl.imsglobal.org/vocab/lis/v2/membership#Instructor'))
+        self.assertFalse(has_instructor_role('Learner'))
+
+    def test_roles_setting(self):
+        with self.settings(LTI_INSTRUCTOR_ROLES=['Mentor']):
+            self.assertFalse(has_instructor_role('Instructor'))
+            self.assertTrue(has_instructor_role('urn:lti:role:ims/lis/Mentor'))
+
+
+class LaunchSessionTest(TestCase):
+    """
+    Launch params stored in the session by successive launches in the same browser session
+    """
+    multi_db = True
+
+    def setUp(self):
+        self.consumer = LtiConsumer.objects.create(consumer_name='consumer')
+        self.platform = LtiPlatform.objects.create(
+            name='platform', issuer='https://platform.example.com', client_id='client',
+            auth_login_url='https://platform.example.com/auth', auth_token_url='https://platform.example.com/token',
+            jwks_url='https://platform.example.com/jwks', lti_consumer=self.consumer
+        )
+        self.request = RequestFactory().post('/')
+        self.request.session = SessionStore()
+        self.request.session['_auth_user_id'] = '1'
+
+    def launch(self, **params):
+        params = dict(
+            {'lti_message_type': 'basic-lti-launch-request', 'user_id': 'learner',
+             'oauth_consumer_key': self.consumer.consumer_key},
+            **params
+        )
+        initialize_lti_session(self.request, SimpleNamespace(to_params=lambda: params, launch_params=params))
+
+    def launch_lti13(self, **claims):
+        claims = dict({
+            'sub': 'learner',
+            lti13.VERSION_CLAIM: lti13.LTI_VERSION,
+            lti13.MESSAGE_TYPE_CLAIM: lti13.RESOURCE_LINK_MESSAGE,
+        }, **claims)
+        self.request.POST = {'id_token': 'token', 'state': 'state'}
+        with mock.patch('ltiprovider.mixins.validate_launch', return_value=(self.platform, claims)):
+            initialize_lti13_session(self.request)
+
+    def test_lti11_launch_after_graded_lti13_launch(self):
+        self.launch_lti13(**{lti13.AGS_CLAIM: {
+            'lineitem': 'https://platform.example.com/lineitems/1', 'scope': [lti13.SCORE_SCOPE]
+        }})
+        self.assertIn('lti13_lineitem', self.request.session)
+        self.launch(lis_result_sourcedid='result', lis_outcome_service_url='https://lms.example.com/outcomes')
+        self.assertNotIn('lti13_lineitem', self.request.session)
+        self.assertNotIn('lti13_platform', self.request.session)
+        self.assertEqual(self.request.session['lis_result_sourcedid'], 'result')
+        self.assertEqual(self.request.session['_auth_user_id'], '1')
+
+    def test_ungraded_launches_after_graded_launch(self):
+        self.launch(lis_result_sourcedid='result', lis_outcome_service_url='https://lms.example.com/outcomes')
+        self.launch_lti13()
+        self.assertNotIn('lis_result_sourcedid', self.request.session)
+        self.assertNotIn('lis_outcome_service_url', self.request.session)
+        self.assertNotIn('lti13_lineitem', self.request.session)
+        self.launch_lti13(**{lti13.AGS_CLAIM: {
+            'lineitem': 'https://platform.example.com/lineitems/1', 'scope': [lti13.SCORE_SCOPE]
+        }})
+        self.launch()
+        self.assertNotIn('lti13_lineitem', self.request.session)
+        self.assertEqual(self.request.session['user_id'], 'learner')
+
+
+class LaunchTest(TestCase):
+    """
+    Signed LTI 1.1 launches of a question, redirected to the question page or rendering it (LTI_RENDER_ON_LAUNCH)
+    """
+    multi_db = True
+
+    def setUp(self):
+        self.consumer = LtiConsumer.objects.create(consumer_name='consumer', shard='shard1')
+        self.question = Question.objects.create(question_text='Question?')
+        Choice.objects.create(question=self.question, choice_text='A')
+        self.url = reverse('poll:question', args=[self.question.pk])
+
+    def launch(self):
+        tool_consumer = ToolConsumer(
+            self.consumer.consumer_key, self.consumer.consumer_secret, launch_url='http://testserver' + self.url,
+            params={
+                'lti_message_type': 'basic-lti-launch-request', 'lti_version': 'LTI-1p0',
+                'resource_link_id': 'link', 'user_id': 'learner', 'context_id': 'course',
+            }
+        )
+        return self.client.post(self.url, tool_consumer.generate_launch_data())
+
+    def assert_launched(self):
+        self.assertEqual(self.client.session['user_id'], 'learner')
+        with use_shard('shard1'):
+            self.assertTrue(LtiUser.objects.filter(user_id='learner', lti_consumer=self.consumer).exists())
+
+    @override_settings(LTI_RENDER_ON_LAUNCH=False)
+    def test_redirect(self):
+        response = self.launch()
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(urlsplit(response['Location']).path, self.url)
+        self.assert_launched()
+
+    @override_settings(LTI_RENDER_ON_LAUNCH=True)
+    def test_render_on_launch(self):
+        response = self.launch()
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'poll/question.html')
+        self.assertContains(response, 'Question?')
+        self.assertContains(response, 'history.replaceState')
+        # the session key is kept in the launch and form urls, in case the session cookie isn't stored
+        session_key = self.client.session.session_key
+        launch_url = response.context['lti_launch_url']
+        self.assertEqual(urlsplit(launch_url).path, self.url)
+        self.assertEqual(parse_qs(urlsplit(launch_url).query), {'session': [session_key]})
+        self.assertContains(response, '?session={}'.format(session_key))
+        self.assert_launched()
+
+        # following requests are not launches
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.context['lti_launch_url'])
+        self.assertNotContains(response, 'history.replaceState')
+
+    def test_render_on_launch_view_attribute(self):
+        with mock.patch('poll.views.QuestionView.render_on_launch', True):
+            self.assertEqual(self.launch().status_code, 200)
+        with mock.patch('poll.views.QuestionView.render_on_launch', False), \
+                override_settings(LTI_RENDER_ON_LAUNCH=True):
+            self.assertEqual(self.launch().status_code, 302)
+
+
+def generate_key():
+    return rsa.generate_private_key(public_exponent=65537, key_size=2048, backend=default_backend())
+
+
+def fake_response(data=None, status_code=200):
+    """
+    :return: stand-in for a requests.Response of a platform
+    """
+    response = mock.Mock(status_code=status_code)
+    response.json.return_value = data
+    if status_code >= 400:
+        response.raise_for_status.side_effect = requests.HTTPError(response=response)
+    return response
+
+
+class Lti13Test(TestCase):
+    """
+    LTI 1.3 logins, launches and score publishing with a fake platform: its key set and services are served
+    by a mock of the tool's http session (lti13.http)
+    """
+    multi_db = True
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.platform_keys = {'key1': generate_key(), 'key2': generate_key()}
+        cls.tool_private_key = generate_key().private_bytes(
+            serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+        ).decode('utf-8')
+
+    def setUp(self):
+        cache.clear()
+        lti13._key_sets.clear()
+        self.consumer = LtiConsumer.objects.create(consumer_name='consumer')
+        self.platform = LtiPlatform.objects.create(
+            name='platform', issuer='https://platform.example.com', client_id='client',
+            auth_login_url='https://platform.example.com/auth', auth_token_url='https://platform.example.com/token',
+            jwks_url='https://platform.example.com/jwks', lti_consumer=self.consumer
+        )
+        self.question = Question.objects.create(question_text='Question?')
+        Choice.objects.create(question=self.question, choice_text='A')
+        self.target_link_uri = 'http://testserver' + reverse('poll:question', args=[self.question.pk])
+
+        patcher = mock.patch.object(lti13, 'http')
+        self.http = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.serve_key_set('key1')
+        # key sets of logins are fetched in the background, by the launch in these tests
+        patcher = mock.patch.object(lti13, 'refresh_key_set_in_background')
+        self.refresh_in_background = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def serve_key_set(self, *kids):
+        keys = []
+        for kid in kids:
+            jwk = json.loads(RSAAlgorithm.to_jwk(self.platform_keys[kid].public_key()))
+            jwk.update({'kid': kid, 'alg': 'RS256', 'use': 'sig'})
+            keys.append(jwk)
+        self.http.get.return_value = fake_response({'keys': keys})
+
+    def login(self):
+        """
+        :return: (state, nonce) tuple of the platform's authentication request
+        """
+        response = self.client.get(reverse('ltiprovider:lti13-login'), {
+            'iss': self.platform.issuer, 'login_hint': 'hint', 'target_link_uri': self.target_link_uri,
+        })
+        self.assertEqual(response.status_code, 302)
+        query = parse_qs(urlsplit(response['Location']).query)
+        return query['state'][0], query['nonce'][0]
+
+    def get_id_token(self, nonce, kid='key1', **claims):
+        now = int(time.time())
+        claims = dict({
+            'iss': self.platform.issuer,
+            'aud': self.platform.client_id,
+            'sub': 'learner',
+            'nonce': nonce,
+            'iat': now,
+            'exp': now + 300,
+            lti13.VERSION_CLAIM: lti13.LTI_VERSION,
+            lti13.MESSAGE_TYPE_CLAIM: lti13.RESOURCE_LINK_MESSAGE,
+            lti13.CONTEXT_CLAIM: {'id': 'course'},
+            lti13.RESOURCE_LINK_CLAIM: {'id': 'link'},
+        }, **claims)
+        token = jwt.encode(claims, self.platform_keys[kid], algorithm='RS256', headers={'kid': kid})
+        return token.decode('utf-8') if isinstance(token, bytes) else token
+
+    def test_login(self):
+        response = self.client.post(reverse('ltiprovider:lti13-login'), {
+            'iss': self.platform.issuer, 'login_hint': 'hint', 'target_link_uri': self.target_link_uri,
+            'lti_message_hint': 'message',
+        })
+        self.assertEqual(response.status_code, 302)
+        url = urlsplit(response['Location'])
+        self.assertEqual(url._replace(query='').geturl(), self.platform.auth_login_url)
+        query = {name: values[0] for name, values in parse_qs(url.query).items()}
+        self.assertEqual(query['client_id'], self.platform.client_id)
+        self.assertEqual(query['redirect_uri'], self.target_link_uri)
+        self.assertEqual(query['login_hint'], 'hint')
+        self.assertEqual(query['lti_message_hint'], 'message')
+        login = cache.get(lti13.get_login_state_cache_key(query['state']))
+        self.assertEqual(login, {'platform': self.platform.pk, 'nonce': query['nonce']})
+        self.refresh_in_background.assert_called_once_with(self.platform.jwks_url)
+
+    def test_login_of_unknown_platform(self):
+        response = self.client.get(reverse('ltiprovider:lti13-login'), {
+            'iss': 'https://unknown.example.com', 'login_hint': 'hint', 'target_link_uri': self.target_link_uri,
+        })
+        self.assertEqual(response.status_code, 404)
+
+    def test_launch(self):
+        state, nonce = self.login()
+        response = self.client.post(self.target_link_uri, {'id_token': self.get_id_token(nonce), 'state': state})
+        self.assertEqual(response.status_code, 302)
+        session = self.client.session
+        self.assertEqual(session['user_id'], 'learner')
+        self.assertEqual(session['oauth_consumer_key'], self.consumer.consumer_key)
+        self.assertEqual(session['context_id'], 'course')
+        self.assertNotIn('lti13_lineitem', session)
+        self.assertTrue(LtiUser.objects.filter(user_id='learner', lti_consumer=self.consumer).exists())
+        self.http.get.assert_called_once_with(self.platform.jwks_url, timeout=lti13.REQUEST_TIMEOUT)
+
+    def test_replayed_state(self):
+        state, nonce = self.login()
+        id_token = self.get_id_token(nonce)
+        lti13.validate_launch(id_token, state)
+        with self.assertRaisesRegex(lti13.LaunchError, 'login state'):
+            lti13.validate_launch(id_token, state)
+        response = self.client.post(self.target_link_uri, {'id_token': id_token, 'state': state})
+        self.assertEqual(response.status_code, 404)
+
+    def test_wrong_nonce(self):
+        state, nonce = self.login()
+        with self.assertRaisesRegex(lti13.LaunchError, 'nonce'):
+            lti13.validate_launch(self.get_id_token('other'), state)
+
+    def test_wrong_audience(self):
+        state, nonce = self.login()
+        with self.assertRaisesRegex(lti13.LaunchError, 'audience'):
+            lti13.validate_launch(self.get_id_token(nonce, aud='other-client'), state)
+
+    def test_wrong_key(self):
+        state, nonce = self.login()
+        id_token = self.get_id_token(nonce, kid='key2')
+        # signed with key2, under the key id of key1
+        header, payload, signature = id_token.split('.')
+        other_header = jwt.utils.base64url_encode(json.dumps({'alg': 'RS256', 'kid': 'key1'}).encode('utf-8'))
+        with self.assertRaisesRegex(lti13.LaunchError, 'Signature'):
+            lti13.validate_launch('.'.join([other_header.decode('utf-8'), payload, signature]), state)
+
+    def test_key_rotation(self):
+        state, nonce = self.login()
+        lti13.validate_launch(self.get_id_token(nonce), state)
+        self.assertEqual(self.http.get.call_count, 1)
+
+        # the platform rotates its key: key ids missing from the cached key set refresh it,
+        # at most once per LTI_JWKS_MIN_REFRESH seconds
+        self.serve_key_set('key2')
+        with self.settings(LTI_JWKS_MIN_REFRESH=60):
+            state, nonce = self.login()
+            with self.assertRaisesRegex(lti13.LaunchError, 'Key id key2 not found'):
+                lti13.validate_launch(self.get_id_token(nonce, kid='key2'), state)
+            self.assertEqual(self.http.get.call_count, 1)
+
+            later = time.time() + 61
+            with mock.patch.object(lti13, 'time', mock.Mock(time=lambda: later)):
+                state, nonce = self.login()
+                platform, claims = lti13.validate_launch(self.get_id_token(nonce, kid='key2'), state)
+            self.assertEqual(claims['sub'], 'learner')
+            self.assertEqual(self.http.get.call_count, 2)
+
+            # the refreshed key set is used until the next rotation
+            state, nonce = self.login()
+            lti13.validate_launch(self.get_id_token(nonce, kid='key2'), state)
+            self.assertEqual(self.http.get.call_count, 2)
+
+    def other_process(self):
+        """
+        Process state of another worker: its own cache instance, and no parsed key sets
+        """
+        lti13._key_sets.clear()
+        return mock.patch.object(lti13, 'cache', DatabaseCache(settings.CACHES['default']['LOCATION'], {}))
+
+    def test_launch_on_other_process(self):
+        state, nonce = self.login()
+        with self.other_process():
+            platform, claims = lti13.validate_launch(self.get_id_token(nonce), state)
+        self.assertEqual(claims['sub'], 'learner')
+
+    def test_key_set_shared_by_processes(self):
+        state, nonce = self.login()
+        lti13.validate_launch(self.get_id_token(nonce), state)
+        # the key set is read from the django cache
+        with self.other_process():
+            state, nonce = self.login()
+            lti13.validate_launch(self.get_id_token(nonce), state)
+        self.assertEqual(self.http.get.call_count, 1)
+
+    def test_invalid_key_set(self):
+        state, nonce = self.login()
+        response = fake_response()
+        response.json.side_effect = ValueError('Expecting value')
+        self.http.get.return_value = response
+        with self.assertRaisesRegex(lti13.LaunchError, 'not valid'):
+            lti13.validate_launch(self.get_id_token(nonce), state)
+
+        state, nonce = self.login()
+        self.http.get.return_value = fake_response({'keys': [{'kty': 'RSA', 'kid': 'key1', 'e': 'AQAB'}]})
+        with self.assertRaisesRegex(lti13.LaunchError, 'not valid'):
+            lti13.validate_launch(self.get_id_token(nonce), state)
+
+        state, nonce = self.login()
+        self.http.get.return_value = fake_response(status_code=503)
+        with self.assertRaisesRegex(lti13.LaunchError, 'could not be fetched'):
+            lti13.validate_launch(self.get_id_token(nonce), state)
+
+    def publish_score(self, score=0.5):
+        with self.settings(LTI_TOOL_PRIVATE_KEY=self.tool_private_key):
+            return lti13.publish_score(self.platform, 'https://platform.example.com/lineitems/1', 'learner', score)
+
+    def get_posted_urls(self):
+        return [call[0][0] for call in self.http.post.call_args_list]
+
+    def test_token_caching(self):
+        self.http.post.side_effect = [
+            fake_response({'access_token': 'token1', 'expires_in': 3600}),
+            fake_response(),
+            fake_response(),
+        ]
+        self.publish_score()
+        self.publish_score(1.0)
+        self.assertEqual(self.get_posted_urls(), [
+            self.platform.auth_token_url,
+            'https://platform.example.com/lineitems/1/scores',
+            'https://platform.example.com/lineitems/1/scores',
+        ])
+        token_request = self.http.post.call_args_list[0][1]['data']
+        self.assertEqual(token_request['scope'], lti13.SCORE_SCOPE)
+        assertion = jwt.decode(token_request['client_assertion'], verify=False)
+        self.assertEqual(assertion['aud'], self.platform.auth_token_url)
+        score = json.loads(self.http.post.call_args_list[2][1]['data'])
+        self.assertEqual((score['userId'], score['scoreGiven']), ('learner', 1.0))
+        self.assertEqual(self.http.post.call_args_list[2][1]['headers']['Authorization'], 'Bearer token1')
+
+    def test_score_retried_with_new_token(self):
+        self.http.post.side_effect = [
+            fake_response({'access_token': 'revoked', 'expires_in': 3600}),
+            fake_response(status_code=401),
+            fake_response({'access_token': 'token2', 'expires_in': 3600}),
+            fake_response(),
+        ]
+        response = self.publish_score()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get_posted_urls(), [
+            self.platform.auth_token_url,
+            'https://platform.example.com/lineitems/1/scores',
+            self.platform.auth_token_url,
+            'https://platform.example.com/lineitems/1/scores',
+        ])
+        self.assertEqual(self.http.post.call_args_list[3][1]['headers']['Authorization'], 'Bearer token2')
+
+    def test_score_not_retried_twice(self):
+        self.http.post.side_effect = [
+            fake_response({'access_token': 'token1', 'expires_in': 3600}),
+            fake_response(status_code=401),
+            fake_response({'access_token': 'token2', 'expires_in': 3600}),
+            fake_response(status_code=401),
+        ]
+        with self.assertRaises(requests.HTTPError):
+            self.publish_score()
+        self.assertEqual(self.http.post.call_count, 4)
@@ -0,0 +1,10 @@
+from django.urls import path
+
+from . import views
+
+app_name = 'ltiprovider'
+
+urlpatterns = [
+    path('lti13/login/', views.LoginView.as_view(), name='lti13-login'),
+    path('lti13/jwks/', views.JwksView.as_view(), name='lti13-jwks'),
+]
@@ -56,14 +56,14 @@ class SignatureValidator(RequestValidator):
         :return: True if the OAuth nonce and timestamp are valid, False if they
         are not.
         """
-        msg = "LTI request's {} is not valid."
+        msg = "LTI request's %s is not valid."
 
         log.debug('Timestamp validating is started.')
         ts = int(timestamp)
         ts_key = '{}_ts'.format(client_key)
         cache_ts = self.cache.get(ts_key, ts)
         if cache_ts > ts:
-            log.debug(msg.format('timestamp'))
+            log.debug(msg, 'timestamp')
             return False
         # NOTE(idegtiarov) cache data with timestamp and nonce lives for 10 seconds
         self.cache.set(ts_key, ts, 10)
@@ -71,7 +71,7 @@ class SignatureValidator(RequestValidator):
 
         log.debug('Nonce validating is started.')
         if self.cache.get(nonce):
-            log.debug(msg.format('nonce'))
+            log.debug(msg, 'nonce')
             return False
         self.cache.set(nonce, 1, 10)
         log.debug('Nonce is valid.')
@@ -86,7 +86,7 @@ class SignatureValidator(RequestValidator):
         try:
             self.lti_consumer = LtiConsumer.objects.get(consumer_key=client_key)
         except LtiConsumer.DoesNotExist:
-            log.exception('Consumer with the key {} is not found.'.format(client_key))
+            log.exception('Consumer with the key %s is not found.', client_key)
             return False
         return True
 
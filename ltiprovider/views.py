@@ -0,0 +1,43 @@
+import logging
+
+from django.http import Http404, JsonResponse
+from django.shortcuts import redirect
+from django.utils.decorators import method_decorator
+from django.views.decorators.clickjacking import xframe_options_exempt
+from django.views.decorators.csrf import csrf_exempt
+from django.views.generic.base import View
+
+from .lti13 import LaunchError, get_login_url, get_tool_jwks
+
+
+log = logging.getLogger(__name__)
+
+
+@method_decorator([csrf_exempt, xframe_options_exempt], name='dispatch')
+class LoginView(View):
+    """
+    LTI 1.3 OIDC third party initiated login, sent by the platform as a GET or POST request
+    Redirects to the platform's authentication url, which posts the launch to the target link uri
+    """
+
+    def get(self, request, *args, **kwargs):
+        return self.login(request.GET)
+
+    def post(self, request, *args, **kwargs):
+        return self.login(request.POST)
+
+    def login(self, params):
+        try:
+            return redirect(get_login_url(params))
+        except LaunchError as err:
+            log.error('Error occurred during LTI 1.3 login: %s', err)
+            raise Http404('LTI login request is not valid')
+
+
+class JwksView(View):
+    """
+    Public key set of the tool, which platforms verify access token requests with
+    """
+
+    def get(self, request, *args, **kwargs):
+        return JsonResponse(get_tool_jwks())
@@ -1,7 +1,101 @@
 from django.contrib import admin
+from django.http import Http404
+from django.template.response import TemplateResponse
+from django.urls import path, reverse
+from django.utils.http import urlencode
+from django.utils.html import format_html
 
-from .models import Question, Choice, Response
+from ltiprovider.admin import LargeTableAdmin
 
-admin.site.register(Question)
-admin.site.register(Choice)
-admin.site.register(Response)
+from .models import Question, Choice, Response, PollSet, PollSetQuestion, Tally
+
+
+class PollSetQuestionInline(admin.TabularInline):
+    model = PollSetQuestion
+    raw_id_fields = ('question',)
+    extra = 1
+
+
+@admin.register(PollSet)
+class PollSetAdmin(admin.ModelAdmin):
+    inlines = (PollSetQuestionInline,)
+
+
+@admin.register(Question)
+class QuestionAdmin(admin.ModelAdmin):
+    list_display = ('question_text', 'closed_at', 'archived_at', 'tallies_link', 'responses_link')
+    search_fields = ('question_text',)
+
+    def get_urls(self):
+        urls = [
+            path(
+                '<int:object_id>/tallies/',
+                self.admin_site.admin_view(self.tallies_view),
+                name='poll_question_tallies'
+            ),
+        ]
+        return urls + super().get_urls()
+
+    def tallies_link(self, obj):
+        return format_html('<a href="{}">Tallies</a>', reverse('admin:poll_question_tallies', args=[obj.pk]))
+    tallies_link.short_description = 'Tallies'
+
+    def responses_link(self, obj):
+        # responses are filtered by question from here, instead of with a list filter of every question
+        return format_html(
+            '<a href="{}?{}">Responses</a>',
+            reverse('admin:poll_response_changelist'), urlencode({'question__id__exact': obj.pk})
+        )
+    responses_link.short_description = 'Responses'
+
+    def tallies_view(self, request, object_id):
+        """
+        Read-only summary of the vote tallies of a question in each scope, read from the precomputed tallies
+        """
+        question = self.get_object(request, object_id)
+        if question is None or not self.has_change_permission(request, question):
+            raise Http404('Question not found')
+
+        choices = list(question.choice_set.all())
+        scope_labels = dict(Tally.SCOPE_CHOICES)
+        votes = {}
+        for scope, scope_id, choice_id, count in (
+            Tally.objects.filter(question=question).values_list('scope', 'scope_id', 'choice', 'votes')
+        ):
+            votes.setdefault((scope, scope_id), {})[choice_id] = count
+        rows = []
+        for (scope, scope_id), choice_votes in sorted(votes.items()):
+            counts = [choice_votes.get(choice.pk, 0) for choice in choices]
+            rows.append((scope_labels.get(scope, scope), scope_id, counts, sum(counts)))
+
+        context = dict(
+            self.admin_site.each_context(request),
+            opts=self.model._meta,
+            title='Tallies: {}'.format(question),
+            question=question,
+            choices=choices,
+            rows=rows,
+        )
+        return TemplateResponse(request, 'admin/poll/question/tallies.html', context)
+
+
+@admin.register(Choice)
+class ChoiceAdmin(admin.ModelAdmin):
+    list_display = ('choice_text', 'question')
+    list_select_related = ('question',)
+    autocomplete_fields = ('question',)
+    search_fields = ('choice_text',)
+
+
+@admin.register(Response)
+class ResponseAdmin(LargeTableAdmin):
+    list_display = ('id', 'question', 'choice', 'lti_user', 'context_id', 'resource_link_id')
+    # questions and answer choices are on the catalog database, so they are prefetched instead of joined
+    list_select_related = ('lti_user',)
+    raw_id_fields = ('lti_user', 'choice')
+    autocomplete_fields = ('question',)
+    # exact matches, backed by indexes
+    search_fields = ('=context_id', '=resource_link_id', '=lti_user__user_id')
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related('question', 'choice')
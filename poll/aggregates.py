@@ -0,0 +1,190 @@
+"""
+Histogram and quantile aggregates of the answer values of numeric and scale questions.
+
+Each answer value is counted as it is made into ValueBucket counter rows: its fixed-width histogram bin and its
+quantile sketch bucket, in each tally scope. Results are read from those rows in O(buckets),
+regardless of the number of responses.
+"""
+from collections import Counter
+from itertools import islice
+import math
+
+import numpy as np
+from django.db import router, transaction
+
+from .counters import get_scope_databases, get_scopes, increment, lock_counters
+from .models import Response, Tally, ValueBucket
+from .sketches import MIN_POSITIVE_VALUE, QuantileSketch
+
+
+def get_bin_index(bins, value):
+    """
+    :param bins: (lower edge, bin width, number of bins) tuple, see Question.get_bins
+    :param value: float
+    :return: int, index of the histogram bin of the value (out of range values are counted in the end bins)
+    """
+    lower, width, count = bins
+    return min(max(int(math.floor((value - lower) / width)), 0), count - 1)
+
+
+def get_value_buckets(question, value, sketch=None):
+    """
+    :return: list of (kind, index) tuples of the value buckets an answer value is counted in
+    """
+    sketch = sketch or QuantileSketch()
+    buckets = []
+    bins = question.get_bins()
+    if bins:
+        buckets.append((ValueBucket.HISTOGRAM, get_bin_index(bins, value)))
+    if value > MIN_POSITIVE_VALUE:
+        buckets.append((ValueBucket.POSITIVE, sketch.key(value)))
+    elif value < -MIN_POSITIVE_VALUE:
+        buckets.append((ValueBucket.NEGATIVE, sketch.key(-value)))
+    else:
+        buckets.append((ValueBucket.ZERO, 0))
+    return buckets
+
+
+def record_value(question, value, context_id='', resource_link_id=''):
+    """
+    Count an answer value in the value buckets of each scope
+    Must be called in a transaction
+    """
+    buckets = get_value_buckets(question, value)
+    for scope, scope_id in get_scopes(context_id, resource_link_id):
+        for kind, index in buckets:
+            increment(
+                ValueBucket, 'count',
+                question_id=question.pk, scope=scope, scope_id=scope_id, kind=kind, index=index
+            )
+
+
+def get_value_summary(question, scope=Tally.GLOBAL, scope_id=''):
+    """
+    Histogram and quantiles of the answer values of a question within a scope, read from the value buckets
+    :return: dict with keys:
+        count: int, number of answers
+        histogram: list of int bin counts, or None if the question has no histogram
+        bin_edges: list of float, edges of the histogram bins
+        median, q1, q3: float quantile estimates, or None if there are no answers
+    """
+    bins = question.get_bins()
+    histogram = [0] * bins[2] if bins else None
+    sketch = QuantileSketch()
+    stores = {ValueBucket.POSITIVE: sketch.positive, ValueBucket.NEGATIVE: sketch.negative}
+
+    for database in get_scope_databases(scope, [question]):
+        buckets = ValueBucket.objects.using(database).filter(question=question, scope=scope, scope_id=scope_id)
+        for kind, index, count in buckets.values_list('kind', 'index', 'count'):
+            if kind == ValueBucket.HISTOGRAM:
+                if histogram is not None and 0 <= index < len(histogram):
+                    histogram[index] += count
+            elif kind == ValueBucket.ZERO:
+                sketch.zero_count += count
+            else:
+                stores[kind][index] += count
+
+    return {
+        'count': sketch.count,
+        'histogram': histogram,
+        'bin_edges': [bins[0] + i * bins[1] for i in range(bins[2] + 1)] if bins else [],
+        'median': sketch.quantile(0.5),
+        'q1': sketch.quantile(0.25),
+        'q3': sketch.quantile(0.75),
+    }
+
+
+def count_pairs(groups, indexes):
+    """
+    Vectorized count of (group, index) pairs
+    :param groups: numpy int array
+    :param indexes: numpy int array of the same length
+    :return: iterator of (group, index, count) tuples
+    """
+    if not len(indexes):
+        return iter(())
+    pairs, counts = np.unique(np.stack([groups, indexes], axis=1), axis=0, return_counts=True)
+    return zip(pairs[:, 0].tolist(), pairs[:, 1].tolist(), counts.tolist())
+
+
+def count_value_buckets(question, values, context_ids, resource_link_ids, sketch=None):
+    """
+    Vectorized count of a batch of answer values into value buckets of each scope
+    :param values: numpy float array
+    :param context_ids: numpy str array, context id of each value
+    :param resource_link_ids: numpy str array, resource link id of each value
+    :return: Counter, {(scope, scope_id, kind, index): count}
+    """
+    sketch = sketch or QuantileSketch()
+    counts = Counter()
+
+    # bucket (kind, index) of each value, as (kind, row mask, index array) triples
+    buckets = []
+    bins = question.get_bins()
+    if bins:
+        lower, width, bin_count = bins
+        indexes = np.clip(np.floor((values - lower) / width), 0, bin_count - 1).astype(np.int64)
+        buckets.append((ValueBucket.HISTOGRAM, np.ones(len(values), dtype=bool), indexes))
+    positive = values > MIN_POSITIVE_VALUE
+    negative = values < -MIN_POSITIVE_VALUE
+    zero = ~(positive | negative)
+    buckets.append((ValueBucket.POSITIVE, positive, sketch.keys(values[positive])))
+    buckets.append((ValueBucket.NEGATIVE, negative, sketch.keys(-values[negative])))
+    buckets.append((ValueBucket.ZERO, zero, np.zeros(int(zero.sum()), dtype=np.int64)))
+
+    # scope of each value, as (scope, scope id labels, label index array) triples
+    scopes = [(Tally.GLOBAL, np.array(['']), np.zeros(len(values), dtype=np.int64))]
+    for scope, ids in ((Tally.CONTEXT, context_ids), (Tally.RESOURCE_LINK, resource_link_ids)):
+        labels, groups = np.unique(ids, return_inverse=True)
+        scopes.append((scope, labels, groups))
+
+    for kind, mask, indexes in buckets:
+        for scope, labels, groups in scopes:
+            for group, index, count in count_pairs(groups[mask], indexes):
+                scope_id = str(labels[group])
+                if scope != Tally.GLOBAL and not scope_id:
+                    continue
+                counts[(scope, scope_id, kind, index)] += count
+    return counts
+
+
+def rebuild_value_buckets(question, chunk_size=10000):
+    """
+    Recompute the value buckets of a question from its responses.
+    Values are streamed from a server-side cursor and counted in vectorized batches of chunk_size.
+    The value buckets are locked while the responses are counted, so that concurrent answers aren't lost
+    :param question: Question model instance
+    :return: int, number of value buckets created
+    """
+    if not question.can_rebuild_counters():
+        return 0
+    with transaction.atomic(using=router.db_for_write(ValueBucket)):
+        lock_counters(ValueBucket, question=question)
+        rows = (
+            Response.objects
+            .filter(question=question, value__isnull=False)
+            .values_list('value', 'context_id', 'resource_link_id')
+            .iterator(chunk_size=chunk_size)
+        )
+        sketch = QuantileSketch()
+        counts = Counter()
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+            values, context_ids, resource_link_ids = zip(*chunk)
+            counts.update(count_value_buckets(
+                question,
+                np.array(values, dtype=np.float64),
+                np.array(context_ids, dtype=str),
+                np.array(resource_link_ids, dtype=str),
+                sketch,
+            ))
+
+        buckets = [
+            ValueBucket(question=question, scope=scope, scope_id=scope_id, kind=kind, index=index, count=count)
+            for (scope, scope_id, kind, index), count in counts.items()
+        ]
+        ValueBucket.objects.filter(question=question).delete()
+        ValueBucket.objects.bulk_create(buckets, batch_size=500)
+    return len(buckets)
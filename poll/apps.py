@@ -1,5 +1,12 @@
 from django.apps import AppConfig
+from django.db.models.signals import pre_delete
 
 
 class PollConfig(AppConfig):
     name = 'poll'
+
+    def ready(self):
+        from . import checks  # noqa: F401 (registers system checks)
+        from .signals import delete_choice_data, delete_question_data
+        pre_delete.connect(delete_question_data, sender=self.get_model('Question'))
+        pre_delete.connect(delete_choice_data, sender=self.get_model('Choice'))
@@ -0,0 +1,366 @@
+"""
+Retention of response data: archival of the responses of closed questions, and pruning of expired sessions
+and inactive learners.
+
+Responses of questions closed for a while are written, per shard, to a compressed column-oriented archive file
+(numpy .npz, one array per column, see ARCHIVE_COLUMNS) and deleted from the database in small batches,
+each in its own short transaction. Counters (tallies, value buckets, term counts, timeline) are kept, so results
+are unchanged; the question is marked as archived, so that its counters are no longer rebuilt from responses.
+Archived responses can be restored to the database with rehydrate_question.
+
+Strings and ballots are stored as concatenated utf-8 (or ballot) bytes and an offsets column, without pickling,
+and the learner of a response by its identity, so that it can be restored after the learner was pruned.
+Ranked choice questions are not archived: their results are computed from the stored ballots.
+
+Settings:
+    POLL_ARCHIVE_DIR: directory of the archive files, one subdirectory per shard
+"""
+from datetime import datetime, timedelta, timezone
+from importlib import import_module
+import os
+import time
+
+import numpy as np
+from django.conf import settings
+from django.db import router, transaction
+from django.utils import timezone as django_timezone
+
+from ltiprovider.mixins import LAST_LAUNCH_RESOLUTION
+from ltiprovider.models import LtiUser
+from ltiprovider.routers import get_shard, use_shard
+
+from .models import Question, Response
+
+
+ARCHIVE_VERSION = 1
+
+# (column, response field, kind), kind is one of: int, float, str, bytes, time
+ARCHIVE_COLUMNS = (
+    ('id', 'pk', 'int'),
+    ('lti_consumer_id', 'lti_user__lti_consumer_id', 'int'),
+    ('tool_consumer_instance_guid', 'lti_user__tool_consumer_instance_guid', 'str'),
+    ('user_id', 'lti_user__user_id', 'str'),
+    ('choice_id', 'choice_id', 'int'),
+    ('value', 'value', 'float'),
+    ('text', 'text', 'str'),
+    ('ballot', 'ballot', 'bytes'),
+    ('context_id', 'context_id', 'str'),
+    ('resource_link_id', 'resource_link_id', 'str'),
+    ('created_at', 'created_at', 'time'),
+)
+
+# stored for null integers and times
+NULL_INT = -1
+NULL_TIME = np.iinfo(np.int64).min
+
+
+def get_archive_path(question, shard=None):
+    """
+    :param shard: str, shard database alias (default: current shard)
+    :return: str, path of the archive file of the responses of a question on a shard
+    """
+    directory = getattr(settings, 'POLL_ARCHIVE_DIR', os.path.join(settings.BASE_DIR, 'archive'))
+    return os.path.join(directory, shard or get_shard(), 'question-{}.npz'.format(question.pk))
+
+
+def get_archivable_questions(closed_before):
+    """
+    :param closed_before: datetime
+    :return: queryset of the questions closed before a time whose responses can be archived
+    """
+    return (
+        Question.objects
+        .filter(closed_at__lt=closed_before, archived_at__isnull=True, anonymous=False)
+        .exclude(question_type=Question.RANKED)
+    )
+
+
+def encode_column(values, kind):
+    """
+    :param values: list of response field values
+    :param kind: str, see ARCHIVE_COLUMNS
+    :return: dict, {array suffix: numpy array}: the values, and their offsets for strings and bytes
+    """
+    if kind == 'int':
+        return {'': np.array([NULL_INT if value is None else value for value in values], dtype=np.int64)}
+    if kind == 'float':
+        return {'': np.array([np.nan if value is None else value for value in values], dtype=np.float64)}
+    if kind == 'time':
+        return {'': np.array(
+            [NULL_TIME if value is None else int(value.timestamp() * 1e6) for value in values], dtype=np.int64
+        )}
+    if kind == 'str':
+        chunks = [value.encode('utf-8') for value in values]
+        nulls = None
+    else:
+        chunks = [bytes(value) if value is not None else b'' for value in values]
+        nulls = np.array([value is None for value in values], dtype=bool)
+    offsets = np.zeros(len(chunks) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(chunk) for chunk in chunks])
+    arrays = {'': np.frombuffer(b''.join(chunks), dtype=np.uint8), '_offsets': offsets}
+    if nulls is not None:
+        arrays['_null'] = nulls
+    return arrays
+
+
+def decode_column(archive, column, kind):
+    """
+    :param archive: mapping of numpy arrays, see encode_column
+    :return: list of response field values
+    """
+    values = archive[column]
+    if kind == 'int':
+        return [None if value == NULL_INT else value for value in values.tolist()]
+    if kind == 'float':
+        return [None if np.isnan(value) else value for value in values.tolist()]
+    if kind == 'time':
+        return [
+            None if value == NULL_TIME else datetime(1970, 1, 1, tzinfo=timezone.utc) + timedelta(microseconds=value)
+            for value in values.tolist()
+        ]
+    data = values.tobytes()
+    offsets = archive[column + '_offsets'].tolist()
+    chunks = [data[start:end] for start, end in zip(offsets, offsets[1:])]
+    if kind == 'str':
+        return [chunk.decode('utf-8') for chunk in chunks]
+    return [None if null else chunk for chunk, null in zip(chunks, archive[column + '_null'].tolist())]
+
+
+def read_archive(path):
+    """
+    :return: dict, {column: list of values}, see ARCHIVE_COLUMNS
+    """
+    with np.load(path) as archive:
+        if int(archive['version']) != ARCHIVE_VERSION:
+            raise ValueError('Unsupported archive version: {}'.format(int(archive['version'])))
+        return {column: decode_column(archive, column, kind) for column, field, kind in ARCHIVE_COLUMNS}
+
+
+def get_archived_consumers(question, shard):
+    """
+    :param shard: str, shard database alias
+    :return: set of the lti consumer pks of the archived responses of a question on a shard
+    """
+    path = get_archive_path(question, shard)
+    if not os.path.exists(path):
+        return set()
+    # only the consumer column is decompressed
+    with np.load(path) as archive:
+        return set(archive['lti_consumer_id'].tolist())
+
+
+def write_archive(path, columns):
+    """
+    Write an archive file, replacing it only once complete
+    :param columns: dict, {column: list of values}, see ARCHIVE_COLUMNS
+    """
+    arrays = {'version': np.array(ARCHIVE_VERSION)}
+    for column, field, kind in ARCHIVE_COLUMNS:
+        for suffix, array in encode_column(columns[column], kind).items():
+            arrays[column + suffix] = array
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    partial = path + '.partial'
+    with open(partial, 'wb') as f:
+        np.savez_compressed(f, **arrays)
+    os.replace(partial, path)
+
+
+def delete_in_batches(rows, batch_size=1000, pause=0.1):
+    """
+    Delete rows in batches of batch_size, each in its own transaction, pausing between batches,
+    so that locks are held briefly and replication keeps up
+    :param rows: queryset of the rows to delete
+    :return: int, number of rows deleted
+    """
+    model = rows.model
+    deleted = 0
+    while True:
+        pks = list(rows.order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return deleted
+        with transaction.atomic(using=router.db_for_write(model)):
+            count, _ = model.objects.filter(pk__in=pks).delete()
+        deleted += count
+        time.sleep(pause)
+
+
+def archive_question(question, shard, chunk_size=10000):
+    """
+    Write the responses of a question on the current shard to its archive file,
+    including the responses of a previous, interrupted archival
+    :param shard: str, shard database alias (the current shard)
+    :return: int, last archived response pk (0 if there are no responses)
+    """
+    path = get_archive_path(question, shard)
+    columns = {column: [] for column, field, kind in ARCHIVE_COLUMNS}
+    if os.path.exists(path):
+        columns = read_archive(path)
+    archived = set(columns['id'])
+    rows = (
+        Response.objects
+        .filter(question=question)
+        .order_by('pk')
+        .values_list(*[field for column, field, kind in ARCHIVE_COLUMNS])
+        .iterator(chunk_size=chunk_size)
+    )
+    for row in rows:
+        if row[0] in archived:
+            continue
+        for (column, field, kind), value in zip(ARCHIVE_COLUMNS, row):
+            columns[column].append(value)
+    if not columns['id']:
+        return 0
+    write_archive(path, columns)
+    return max(columns['id'])
+
+
+def archive_questions(questions, shards, batch_size=1000, pause=0.1):
+    """
+    Archive the responses of questions on each shard, then delete them from the database.
+    Questions are marked as archived once their archive files are written, before their responses are deleted
+    :param questions: iterable of Question model instances, see get_archivable_questions
+    :param shards: list of str, shard database aliases
+    :return: dict, {question pk: number of responses deleted}
+    """
+    deleted = {}
+    for question in questions:
+        last_pks = {}
+        for shard in shards:
+            with use_shard(shard):
+                last_pks[shard] = archive_question(question, shard)
+        question.archived_at = django_timezone.now()
+        question.save(update_fields=['archived_at'])
+        deleted[question.pk] = 0
+        for shard, last_pk in last_pks.items():
+            with use_shard(shard):
+                rows = Response.objects.filter(question=question, pk__lte=last_pk)
+                deleted[question.pk] += delete_in_batches(rows, batch_size, pause)
+    return deleted
+
+
+def rehydrate_question(question, shard, batch_size=1000):
+    """
+    Restore the archived responses of a question on the current shard to the database, with their original pks,
+    recreating pruned learners, and remove the archive file.
+    Responses already in the database (from an interrupted rehydration) are skipped
+    :param shard: str, shard database alias (the current shard)
+    :return: int, number of responses restored
+    """
+    path = get_archive_path(question, shard)
+    if not os.path.exists(path):
+        return 0
+    columns = read_archive(path)
+    rows = [dict(zip(columns, values)) for values in zip(*columns.values())]
+    restored = 0
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        existing = set(Response.objects.filter(pk__in=[row['id'] for row in batch]).values_list('pk', flat=True))
+        batch = [row for row in batch if row['id'] not in existing]
+        if not batch:
+            continue
+        with transaction.atomic(using=router.db_for_write(Response)):
+            users = get_or_create_users(batch)
+            Response.objects.bulk_create([
+                Response(
+                    pk=row['id'],
+                    lti_user_id=users[(row['lti_consumer_id'], row['tool_consumer_instance_guid'], row['user_id'])],
+                    question=question,
+                    choice_id=row['choice_id'],
+                    value=row['value'],
+                    text=row['text'],
+                    ballot=row['ballot'],
+                    context_id=row['context_id'],
+                    resource_link_id=row['resource_link_id'],
+                    created_at=row['created_at'],
+                )
+                for row in batch
+            ])
+        restored += len(batch)
+    os.remove(path)
+    return restored
+
+
+def get_or_create_users(rows):
+    """
+    :param rows: list of archived response dicts
+    :return: dict, {(lti consumer pk, tool consumer instance guid, user id): LtiUser pk}
+    """
+    keys = {(row['lti_consumer_id'], row['tool_consumer_instance_guid'], row['user_id']) for row in rows}
+
+    def get_users():
+        users = LtiUser.objects.filter(user_id__in={user_id for consumer_pk, guid, user_id in keys})
+        return {
+            (consumer_pk, guid, user_id): pk
+            for pk, consumer_pk, guid, user_id in users.values_list(
+                'pk', 'lti_consumer_id', 'tool_consumer_instance_guid', 'user_id'
+            )
+        }
+
+    users = get_users()
+    missing = keys - set(users)
+    if missing:
+        LtiUser.objects.bulk_create([
+            LtiUser(lti_consumer_id=consumer_pk, tool_consumer_instance_guid=guid, user_id=user_id)
+            for consumer_pk, guid, user_id in missing
+        ])
+        # read back the pks (bulk_create doesn't set them on every database backend)
+        users = get_users()
+    return users
+
+
+def rehydrate_questions(questions, shards, batch_size=1000):
+    """
+    Restore the archived responses of questions on each shard, and mark the questions as not archived
+    :param questions: iterable of Question model instances
+    :param shards: list of str, shard database aliases
+    :return: dict, {question pk: number of responses restored}
+    """
+    restored = {}
+    for question in questions:
+        restored[question.pk] = 0
+        for shard in shards:
+            with use_shard(shard):
+                restored[question.pk] += rehydrate_question(question, shard, batch_size)
+        question.archived_at = None
+        question.save(update_fields=['archived_at'])
+    return restored
+
+
+def prune_sessions(batch_size=1000, pause=0.1, now=None):
+    """
+    Delete expired sessions in batches (see delete_in_batches), e.g. the sessions created by lti launches,
+    instead of a single large delete (django's clearsessions)
+    :return: int, number of sessions deleted, or None if sessions are not stored in the database
+    """
+    session_store = import_module(settings.SESSION_ENGINE).SessionStore
+    if not hasattr(session_store, 'get_model_class'):
+        return None
+    model = session_store.get_model_class()
+    rows = model.objects.filter(expire_date__lt=now or django_timezone.now())
+    return delete_in_batches(rows, batch_size, pause)
+
+
+def prune_users(inactive_before=None, batch_size=1000, pause=0.1):
+    """
+    Delete learners of the current shard without responses who haven't launched since a time.
+    Learners whose sessions may still be in use (SESSION_COOKIE_AGE) are kept
+    :param inactive_before: datetime (default: as early as sessions allow)
+    :return: int, number of learners deleted
+    """
+    latest = django_timezone.now() - timedelta(seconds=settings.SESSION_COOKIE_AGE) - LAST_LAUNCH_RESOLUTION
+    if inactive_before is None or inactive_before > latest:
+        inactive_before = latest
+    rows = LtiUser.objects.filter(last_launch__lt=inactive_before, response__isnull=True)
+    deleted = 0
+    last_pk = 0
+    while True:
+        # learners kept in earlier batches are skipped, instead of being read again by every batch
+        pks = list(rows.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return deleted
+        with transaction.atomic(using=router.db_for_write(LtiUser)):
+            # a learner may have answered since the batch was read
+            count, _ = LtiUser.objects.filter(pk__in=pks, response__isnull=True).delete()
+        deleted += count
+        last_pk = pks[-1]
+        time.sleep(pause)
@@ -0,0 +1,274 @@
+"""
+Ballots of multiple choice (select all that apply) and ranked choice questions.
+
+A ballot is stored on the response as a compact array of answer choice pks (little-endian uint32):
+the selected choices of a multiple choice answer, or the choices in order of preference of a ranked choice answer.
+
+As responses are made:
+- multiple choice answers add a vote to the tally of each selected choice, and to the co-occurrence count
+  (ChoicePair) of each pair of selected choices
+- ranked choice answers add a vote to the tally of their first preference
+
+Instant-runoff results are computed from all ballots of a question, read once into a ballot matrix;
+each round is a vectorized counting pass over the matrix. Results are cached until the question's tallies change.
+"""
+from collections import Counter
+from itertools import combinations, islice
+
+import numpy as np
+from django.core.cache import cache
+from django.db.models import Sum
+
+from .counters import get_scope_databases, get_scopes, increment
+from .models import ChoicePair, Question, Response, Tally
+
+
+BALLOT_DTYPE = np.dtype('<u4')
+
+# seconds that instant-runoff results are cached for (results are also invalidated by new votes)
+RUNOFF_CACHE_TIMEOUT = 60 * 60
+
+
+def encode_ballot(choice_pks):
+    """
+    :param choice_pks: list of int, answer choice pks
+    :return: bytes
+    """
+    return np.asarray(choice_pks, dtype=BALLOT_DTYPE).tobytes()
+
+
+def decode_ballot(data):
+    """
+    :param data: bytes or memoryview, see encode_ballot
+    :return: list of int, answer choice pks
+    """
+    return np.frombuffer(bytes(data), dtype=BALLOT_DTYPE).tolist()
+
+
+def record_ballot(question, choice_pks, context_id='', resource_link_id=''):
+    """
+    Count a multiple choice or ranked choice ballot in the tallies (and co-occurrence counts) of each scope
+    Must be called in a transaction
+    :param choice_pks: list of int, selected choice pks, or ranked choice pks in order of preference
+    """
+    if not choice_pks:
+        return
+    if question.question_type == question.RANKED:
+        counted = [choice_pks[0]]
+        pairs = []
+    else:
+        counted = sorted(set(choice_pks))
+        pairs = list(combinations(counted, 2))
+
+    for scope, scope_id in get_scopes(context_id, resource_link_id):
+        for choice_pk in counted:
+            increment(
+                Tally, 'votes',
+                question_id=question.pk, choice_id=choice_pk, scope=scope, scope_id=scope_id
+            )
+        for choice_a, choice_b in pairs:
+            increment(
+                ChoicePair, 'count',
+                question_id=question.pk, scope=scope, scope_id=scope_id, choice_a_id=choice_a, choice_b_id=choice_b
+            )
+
+
+def get_pair_counts(question, scope=Tally.GLOBAL, scope_id=''):
+    """
+    Co-occurrence counts of the answer choices of a multiple choice question within a scope
+    :return: dict, {(choice_a pk, choice_b pk): count} with choice_a pk < choice_b pk
+    """
+    counts = Counter()
+    for database in get_scope_databases(scope, [question]):
+        pairs = ChoicePair.objects.using(database).filter(question=question, scope=scope, scope_id=scope_id)
+        counts.update({(a, b): count for a, b, count in pairs.values_list('choice_a', 'choice_b', 'count')})
+    return dict(counts)
+
+
+def get_scope_responses(question, scope=Tally.GLOBAL, scope_id='', database=None):
+    responses = Response.objects.using(database).filter(question=question, ballot__isnull=False)
+    if scope == Tally.CONTEXT:
+        responses = responses.filter(context_id=scope_id)
+    elif scope == Tally.RESOURCE_LINK:
+        responses = responses.filter(resource_link_id=scope_id)
+    return responses
+
+
+def iter_scope_ballots(question, scope=Tally.GLOBAL, scope_id='', chunk_size=10000):
+    """
+    Ballots of a question within a scope, read from each database of the scope
+    :return: iterator of lists of at most chunk_size ballots
+    """
+    for database in get_scope_databases(scope, [question]):
+        responses = get_scope_responses(question, scope, scope_id, database)
+        rows = responses.values_list('ballot', flat=True).iterator(chunk_size=chunk_size)
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+            yield chunk
+
+
+def decode_ballots(ballots):
+    """
+    Decode a list of ballots at once: their bytes are joined and decoded with a single numpy call,
+    then scattered into the rows of a matrix
+    :param ballots: list of bytes or memoryview, see encode_ballot; trailing bytes short of a choice pk are ignored
+    :return: (choice pks, filled) tuple of numpy arrays of shape (ballots, longest ballot):
+        the choice pks of each ballot in order, and True where a cell holds a choice pk
+    """
+    size = BALLOT_DTYPE.itemsize
+    ballots = [bytes(ballot) for ballot in ballots]
+    lengths = np.fromiter((len(ballot) // size for ballot in ballots), dtype=np.int64, count=len(ballots))
+    data = b''.join(
+        ballot if len(ballot) % size == 0 else ballot[:len(ballot) - len(ballot) % size] for ballot in ballots
+    )
+    values = np.frombuffer(data, dtype=BALLOT_DTYPE).astype(np.int64)
+    width = int(lengths.max()) if len(ballots) else 0
+    rows = np.repeat(np.arange(len(ballots)), lengths)
+    starts = np.cumsum(lengths) - lengths
+    columns = np.arange(len(values)) - np.repeat(starts, lengths)
+    pks = np.zeros((len(ballots), width), dtype=np.int64)
+    pks[rows, columns] = values
+    filled = np.zeros((len(ballots), width), dtype=bool)
+    filled[rows, columns] = True
+    return pks, filled
+
+
+def load_ballot_matrix(question, choice_pks, scope=Tally.GLOBAL, scope_id='', chunk_size=10000):
+    """
+    Read the ranked ballots of a question into a matrix of choice column indexes,
+    one row per ballot in order of preference, padded with -1
+    :param choice_pks: sorted list of the question's answer choice pks (matrix columns)
+    :return: numpy int array of shape (ballots, choices)
+    """
+    choice_pks = np.asarray(choice_pks, dtype=np.int64)
+    blocks = []
+    for chunk in iter_scope_ballots(question, scope, scope_id, chunk_size):
+        pks, filled = decode_ballots(chunk)
+        columns = np.searchsorted(choice_pks, pks)
+        # ignore choices that no longer exist
+        valid = filled & (columns < len(choice_pks))
+        valid &= choice_pks[np.minimum(columns, len(choice_pks) - 1)] == pks
+        # move the valid choices of each ballot to its first columns, keeping their order
+        order = np.argsort(~valid, axis=1, kind='mergesort')
+        rows = np.arange(len(chunk))[:, np.newaxis]
+        columns, valid = columns[rows, order], valid[rows, order]
+        block = np.full((len(chunk), len(choice_pks)), -1, dtype=np.int64)
+        width = min(columns.shape[1], len(choice_pks))
+        block[:, :width] = np.where(valid, columns, -1)[:, :width]
+        blocks.append(block)
+    if not blocks:
+        return np.full((0, len(choice_pks)), -1, dtype=np.int64)
+    return np.concatenate(blocks)
+
+
+def instant_runoff(ballots, choice_count):
+    """
+    Instant-runoff rounds over a ballot matrix.
+    In each round, every ballot counts for its highest ranked choice that hasn't been eliminated;
+    the round is computed with a single vectorized pass over the matrix.
+    A choice wins with a majority of the ballots still counting; otherwise the choice with fewest votes is eliminated
+    :param ballots: numpy int array of shape (ballots, choices), see load_ballot_matrix
+    :param choice_count: int, number of choices
+    :return: (rounds, winner) tuple; rounds is a list of int numpy arrays of votes per choice column,
+        winner is a choice column index or None
+    """
+    eliminated = np.zeros(choice_count, dtype=bool)
+    filled = ballots >= 0
+    rounds = []
+    while True:
+        # highest ranked remaining choice of each ballot
+        remaining = filled & ~eliminated[np.where(filled, ballots, 0)]
+        counting = remaining.any(axis=1)
+        first = np.argmax(remaining, axis=1)[counting]
+        votes = np.bincount(ballots[counting.nonzero()[0], first], minlength=choice_count)
+        rounds.append(votes)
+
+        active = ~eliminated
+        total = votes.sum()
+        if not total:
+            return rounds, None
+        leader = int(np.argmax(votes))
+        if votes[leader] * 2 > total or active.sum() <= 1:
+            return rounds, leader
+        # eliminate the remaining choice with fewest votes (lowest column on ties)
+        candidates = np.where(active, votes, np.iinfo(votes.dtype).max)
+        eliminated[int(np.argmin(candidates))] = True
+
+
+def get_tally_version(question, scope=Tally.GLOBAL, scope_id=''):
+    """
+    Total votes in the tallies of a question within a scope
+    Votes are only ever added, so the total changes whenever a vote is counted
+    :return: int
+    """
+    total = 0
+    for database in get_scope_databases(scope, [question]):
+        tallies = Tally.objects.using(database).filter(question=question, scope=scope, scope_id=scope_id)
+        total += tallies.aggregate(total=Sum('votes'))['total'] or 0
+    return total
+
+
+def get_runoff_results(question, scope=Tally.GLOBAL, scope_id=''):
+    """
+    Instant-runoff results of a ranked choice question within a scope, cached until a vote is counted
+    :return: dict with keys:
+        choices: list of (choice pk, choice text) tuples
+        rounds: list of lists of votes per choice (same order as choices)
+        winner: choice pk, or None if there are no ballots
+    """
+    version = get_tally_version(question, scope, scope_id)
+    cache_key = 'poll:runoff:{}:{}:{}:{}'.format(question.pk, scope, scope_id, version)
+    results = cache.get(cache_key)
+    if results is None:
+        choices = list(question.choice_set.order_by('pk').values_list('pk', 'choice_text'))
+        ballots = load_ballot_matrix(question, [pk for pk, text in choices], scope, scope_id)
+        rounds, winner = instant_runoff(ballots, len(choices))
+        results = {
+            'choices': choices,
+            'rounds': [votes.tolist() for votes in rounds],
+            'winner': choices[winner][0] if winner is not None else None,
+        }
+        cache.set(cache_key, results, RUNOFF_CACHE_TIMEOUT)
+    return results
+
+
+def count_ballots(questions, chunk_size=10000):
+    """
+    Recount the tallies and co-occurrence counts of the ballots of a group of questions
+    :param questions: iterable of Question model instances
+    :return: (list of Tally, list of ChoicePair) unsaved model instances
+    """
+    # questions are on the catalog database, so their types are read separately instead of joined
+    question_types = {question.pk: question.question_type for question in questions}
+    tally_counts = Counter()
+    pair_counts = Counter()
+    rows = (
+        Response.objects
+        .filter(question__in=list(question_types), ballot__isnull=False)
+        .values_list('question', 'ballot', 'context_id', 'resource_link_id')
+        .iterator(chunk_size=chunk_size)
+    )
+    for question_pk, data, context_id, resource_link_id in rows:
+        choice_pks = decode_ballot(data)
+        if not choice_pks:
+            continue
+        if question_types[question_pk] == Question.RANKED:
+            counted, pairs = [choice_pks[0]], []
+        else:
+            counted = sorted(set(choice_pks))
+            pairs = list(combinations(counted, 2))
+        for scope, scope_id in get_scopes(context_id, resource_link_id):
+            tally_counts.update((question_pk, choice_pk, scope, scope_id) for choice_pk in counted)
+            pair_counts.update((question_pk, a, b, scope, scope_id) for a, b in pairs)
+
+    tallies = [
+        Tally(question_id=question_pk, choice_id=choice_pk, scope=scope, scope_id=scope_id, votes=votes)
+        for (question_pk, choice_pk, scope, scope_id), votes in tally_counts.items()
+    ]
+    pairs = [
+        ChoicePair(question_id=question_pk, choice_a_id=a, choice_b_id=b, scope=scope, scope_id=scope_id, count=count)
+        for (question_pk, a, b, scope, scope_id), count in pair_counts.items()
+    ]
+    return tallies, pairs
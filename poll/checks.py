@@ -0,0 +1,59 @@
+import os
+import re
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.checks import Error, register
+from django.template import engines
+
+
+STATIC_TAG_RE = re.compile(r"""{%\s*static\s+(['"])(?P<path>[^'"]+)\1\s*(?:as\s+\w+\s*)?%}""")
+
+
+def get_template_static_references():
+    """
+    Static file paths referenced with a literal {% static %} tag in the project's templates
+    :return: set of (template path, static path) tuples
+    """
+    references = set()
+    for engine in engines.all():
+        for template_dir in getattr(engine, 'template_dirs', ()):
+            template_dir = str(template_dir)
+            # only check the project's own templates
+            if not os.path.abspath(template_dir).startswith(settings.BASE_DIR):
+                continue
+            for root, dirs, files in os.walk(template_dir):
+                for filename in files:
+                    if not filename.endswith('.html'):
+                        continue
+                    template_path = os.path.join(root, filename)
+                    with open(template_path, encoding='utf-8') as f:
+                        for match in STATIC_TAG_RE.finditer(f.read()):
+                            references.add((template_path, match.group('path')))
+    return references
+
+
+@register('staticfiles', deploy=True)
+def check_static_references(app_configs, **kwargs):
+    """
+    Check that every static file referenced by the templates is in the staticfiles manifest
+    (or can be found by the staticfiles finders if the storage doesn't use a manifest)
+    Run with "manage.py check --deploy" after collectstatic
+    """
+    errors = []
+    manifest = getattr(staticfiles_storage, 'hashed_files', None)
+    for template_path, static_path in sorted(get_template_static_references()):
+        if manifest is not None:
+            missing = static_path not in manifest
+            location = 'staticfiles manifest'
+        else:
+            missing = finders.find(static_path) is None
+            location = 'static files directories'
+        if missing:
+            errors.append(Error(
+                "Static file '{}' referenced in {} is not in the {}".format(static_path, template_path, location),
+                hint='Run collectstatic, or fix the static file path.',
+                id='poll.E001',
+            ))
+    return errors
@@ -0,0 +1,96 @@
+"""
+Helpers for counter rows (tallies, value buckets) that are updated incrementally as responses are made
+
+Counter rows are stored on the shard database of the lti consumer (see ltiprovider.routers):
+course and resource link scopes are on the current shard, global scope counts are summed across all shards.
+Counter rows of anonymous questions are on the voter shard instead (see poll.voters.get_voter_shard), with their
+voter records, so that they stay in place when a consumer moves to another shard.
+"""
+from django.db import IntegrityError, router, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from ltiprovider.routers import get_shard, get_shard_databases
+
+from .models import Tally
+from .voters import get_voter_shard
+
+
+def get_scopes(context_id='', resource_link_id=''):
+    """
+    Tally scopes that a response counts towards
+    :param context_id: str, lti context id of the response
+    :param resource_link_id: str, lti resource link id of the response
+    :return: list of (scope, scope_id) tuples
+    """
+    scopes = [(Tally.GLOBAL, '')]
+    if context_id:
+        scopes.append((Tally.CONTEXT, context_id))
+    if resource_link_id:
+        scopes.append((Tally.RESOURCE_LINK, resource_link_id))
+    return scopes
+
+
+def get_counter_shard(question):
+    """
+    :param question: Question model instance
+    :return: str, shard database alias the counter rows of a question are updated on:
+        the voter shard for anonymous questions, the current shard otherwise
+    """
+    return get_voter_shard() if question.anonymous else get_shard()
+
+
+def get_scope_databases(scope, questions):
+    """
+    Databases holding the counter rows of a scope
+    :param scope: str, one of Tally.SCOPE_CHOICES
+    :param questions: iterable of Question model instances whose counter rows are read
+    :return: list of str, database aliases: all shards for the global scope,
+        the counter shards of the questions otherwise (see get_counter_shard)
+    """
+    if scope == Tally.GLOBAL:
+        return get_shard_databases()
+    return sorted({get_counter_shard(question) for question in questions}) or [get_shard()]
+
+
+def lock_counters(model, **lookup):
+    """
+    Lock the counter rows matching lookup until the end of the transaction, before they are recounted:
+    answers made in the meantime wait to be counted, and are then added to the recounted rows (see increment).
+    Responses must be counted after the lock, in the same transaction
+    :param model: model class
+    :param lookup: field lookups of the rows
+    """
+    list(model.objects.select_for_update().filter(**lookup).values_list('pk', flat=True))
+
+
+def has_update_time(model):
+    """
+    :param model: model class
+    :return: bool, True if the counter rows record the time they were last updated (updated_at, e.g. Tally)
+    """
+    return any(field.name == 'updated_at' for field in model._meta.concrete_fields)
+
+
+def increment(model, field, amount=1, **lookup):
+    """
+    Add to a counter field of the row matching lookup, creating the row if it doesn't exist yet
+    Must be called in a transaction
+    :param model: model class
+    :param field: str, name of the counter field
+    :param amount: int, amount to add
+    :param lookup: field values identifying the row
+    """
+    rows = model.objects.filter(**lookup)
+    updates = {field: F(field) + amount}
+    if has_update_time(model):
+        # auto_now isn't set by queryset updates
+        updates['updated_at'] = timezone.now()
+    if rows.update(**updates):
+        return
+    try:
+        # savepoint, so that losing a race to create the row doesn't break the outer transaction
+        with transaction.atomic(using=router.db_for_write(model)):
+            model.objects.create(**dict(lookup, **{field: amount}))
+    except IntegrityError:
+        rows.update(**updates)
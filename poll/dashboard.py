@@ -0,0 +1,127 @@
+"""
+Course results for instructors: the tallies of every question answered in a course (lti context).
+
+Tallies of the course scope are read for a page of questions in one query, instead of one results page per question.
+The version of a question's results is the last update time of its course tallies, in microseconds (votes and
+recounts, e.g. after a consumer move, update it), so that a refresh can fetch only the questions whose results changed.
+Only questions answered with answer choices (single, multiple and ranked choice) have tallies.
+Course tallies are read from the current shard, and from the voter shard for anonymous questions (see poll.counters).
+"""
+from django.db.models import Max
+
+from ltiprovider.routers import get_shard
+
+from .models import Question, Tally
+from .voters import get_voter_shard
+
+
+def get_course_databases():
+    """
+    :return: list of str, database aliases of the course tallies: the current shard and the voter shard
+    """
+    return sorted({get_shard(), get_voter_shard()})
+
+
+def get_course_versions(context_id):
+    """
+    Versions of the results of the questions answered in a course, in a single grouped query per database
+    :param context_id: str, lti context id
+    :return: dict, {question pk: version}, in question pk order
+    """
+    versions = {}
+    for database in get_course_databases():
+        updates = (
+            Tally.objects.using(database)
+            .filter(scope=Tally.CONTEXT, scope_id=context_id)
+            .values_list('question')
+            .annotate(updated_at=Max('updated_at'))
+            .order_by('question')
+        )
+        for question_pk, updated_at in updates:
+            version = int(updated_at.timestamp() * 1e6)
+            versions[question_pk] = max(versions.get(question_pk, 0), version)
+    return dict(sorted(versions.items()))
+
+
+def parse_versions(value):
+    """
+    :param value: str, versions known by the client as "<question pk>:<version>,..."
+    :return: dict, {question pk: version}; malformed items are ignored
+    """
+    versions = {}
+    for item in value.split(','):
+        pk, _, version = item.partition(':')
+        try:
+            versions[int(pk)] = int(version)
+        except ValueError:
+            continue
+    return versions
+
+
+def get_course_tallies(context_id, question_pks):
+    """
+    Votes for each answer choice of a group of questions within a course, in a single query per database
+    :param context_id: str, lti context id
+    :param question_pks: list of question pks
+    :return: dict, {question pk: {choice pk: votes}}
+    """
+    votes = {}
+    for database in get_course_databases():
+        tallies = (
+            Tally.objects.using(database)
+            .filter(scope=Tally.CONTEXT, scope_id=context_id, question__in=question_pks)
+            .values_list('question', 'choice', 'votes')
+        )
+        for question_pk, choice_pk, count in tallies:
+            question_votes = votes.setdefault(question_pk, {})
+            question_votes[choice_pk] = question_votes.get(choice_pk, 0) + count
+    return votes
+
+
+def get_course_results(context_id, versions):
+    """
+    Results of a group of questions within a course: tallies in one query, questions and choices in two more
+    :param context_id: str, lti context id
+    :param versions: dict, {question pk: version} of the questions, in display order (see get_course_versions)
+    :return: list of dicts, per question:
+        id, text, type, version, total (votes),
+        choices: list of dicts with id, text, votes and percent (of the total)
+    """
+    question_pks = list(versions)
+    votes = get_course_tallies(context_id, question_pks)
+    questions = Question.objects.prefetch_related('choice_set').in_bulk(question_pks)
+    results = []
+    for pk in question_pks:
+        question = questions.get(pk)
+        if question is None:
+            continue
+        question_votes = votes.get(pk, {})
+        total = sum(question_votes.values())
+        results.append({
+            'id': pk,
+            'text': question.question_text,
+            'type': question.question_type,
+            'version': versions[pk],
+            'total': total,
+            'choices': [
+                {
+                    'id': choice.pk,
+                    'text': choice.choice_text,
+                    'votes': question_votes.get(choice.pk, 0),
+                    'percent': round(100 * question_votes.get(choice.pk, 0) / total, 1) if total else 0,
+                }
+                for choice in question.choice_set.all()
+            ],
+        })
+    return results
+
+
+def iter_course_results(context_id, versions, chunk_size):
+    """
+    Results of the questions of a course, computed chunk_size questions at a time (see get_course_results)
+    :return: generator of result dicts
+    """
+    question_pks = list(versions)
+    for start in range(0, len(question_pks), chunk_size):
+        chunk = {pk: versions[pk] for pk in question_pks[start:start + chunk_size]}
+        yield from get_course_results(context_id, chunk)
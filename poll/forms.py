@@ -4,6 +4,10 @@ from django import forms
 class QuestionForm(forms.Form):
     """
     Input form for the poll question
+    Single choice questions are answered with the "choice" field,
+    numeric and scale questions with the "value" field, free text questions with the "text" field,
+    multiple choice questions with the "choices" field, and ranked choice questions with one "rank_<n>" field
+    per preference, in order
     """
     choice = forms.ModelChoiceField(
         queryset=None,  # set queryset in init
@@ -17,6 +21,64 @@ class QuestionForm(forms.Form):
         in order to retrieve question text and answer choices
         """
         super().__init__(*args, **kwargs)
-        # display related answer choices for this question
-        self.fields['choice'].queryset = question.choice_set.all()
-        self.fields['choice'].label = question.question_text
+        self.question = question
+        if question.question_type == question.NUMERIC:
+            del self.fields['choice']
+            self.fields['value'] = forms.FloatField(min_value=question.min_value, max_value=question.max_value)
+        elif question.question_type == question.SCALE:
+            del self.fields['choice']
+            self.fields['value'] = forms.TypedChoiceField(
+                choices=[(value, value) for value in range(int(question.min_value), int(question.max_value) + 1)],
+                coerce=float,
+                widget=forms.RadioSelect,
+            )
+        elif question.question_type == question.TEXT:
+            del self.fields['choice']
+            self.fields['text'] = forms.CharField(max_length=200, strip=True)
+        elif question.question_type == question.MULTIPLE:
+            del self.fields['choice']
+            self.fields['choices'] = forms.ModelMultipleChoiceField(
+                queryset=question.choice_set.all(),
+                widget=forms.CheckboxSelectMultiple,
+            )
+        elif question.question_type == question.RANKED:
+            del self.fields['choice']
+            choices = question.choice_set.all()
+            # at least one rank field, so that a question without answer choices can't be answered
+            for rank in range(1, max(len(choices), 1) + 1):
+                self.fields['rank_{}'.format(rank)] = forms.ModelChoiceField(
+                    queryset=choices,
+                    required=rank == 1,  # at least the first choice must be ranked
+                    label='Choice ranked {}'.format(rank),
+                )
+            self.fields['rank_1'].help_text = 'First choice'
+        else:
+            # display related answer choices for this question
+            self.fields['choice'].queryset = question.choice_set.all()
+        answer_field = next(iter(self.fields))
+        self.fields[answer_field].label = question.question_text
+
+    def get_rank_fields(self):
+        return [name for name in self.fields if name.startswith('rank_')]
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if self.question.question_type == self.question.RANKED:
+            ranking = [cleaned_data.get(name) for name in self.get_rank_fields()]
+            ranked = [choice for choice in ranking if choice is not None]
+            if None in ranking[:len(ranked)]:
+                raise forms.ValidationError('Rank choices in order, without leaving gaps.')
+            if len(set(ranked)) != len(ranked):
+                raise forms.ValidationError('Each choice can only be ranked once.')
+        return cleaned_data
+
+    def get_answer(self):
+        """
+        :return: dict, answer of a valid form as keyword arguments of poll.tallies.create_response
+        """
+        if self.question.question_type == self.question.MULTIPLE:
+            return {'selection': list(self.cleaned_data['choices'])}
+        if self.question.question_type == self.question.RANKED:
+            ranking = [self.cleaned_data[name] for name in self.get_rank_fields()]
+            return {'ranking': [choice for choice in ranking if choice is not None]}
+        return self.cleaned_data
@@ -0,0 +1,34 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from ltiprovider.routers import get_shard_databases
+from poll.archive import archive_questions, get_archivable_questions
+
+
+class Command(BaseCommand):
+    help = ('Archive the responses of questions closed for a while to compressed column files, '
+            'and delete them from the database in batches (results are kept)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('question', nargs='*', type=int, help='Question pks (default: all archivable questions)')
+        parser.add_argument(
+            '--days', type=int, default=getattr(settings, 'POLL_ARCHIVE_AFTER_DAYS', 90),
+            help='Days since the questions were closed (default: POLL_ARCHIVE_AFTER_DAYS)'
+        )
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of responses deleted per batch')
+        parser.add_argument('--pause', type=float, default=0.1, help='Seconds to wait between batches')
+        parser.add_argument('--shard', action='append', help='Shard databases (default: all shards)')
+
+    def handle(self, *args, **options):
+        questions = get_archivable_questions(timezone.now() - timedelta(days=options['days']))
+        if options['question']:
+            questions = questions.filter(pk__in=options['question'])
+        deleted = archive_questions(
+            questions, options['shard'] or get_shard_databases(),
+            batch_size=options['batch_size'], pause=options['pause']
+        )
+        for question_pk, count in deleted.items():
+            self.stdout.write('Question {}: {} responses archived'.format(question_pk, count))
@@ -0,0 +1,33 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+from config.logging import benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the per-request logging overhead on the request thread: eagerly formatted messages '
+        'with a synchronous handler (before), and lazy, sampled, queued json records (after)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000, help='Number of requests timed')
+        parser.add_argument('--output', help='File the records are written to (default: discarded)')
+        parser.add_argument(
+            '--level', default='DEBUG', choices=['DEBUG', 'INFO', 'WARNING'],
+            help='Level of the loggers, e.g. INFO to time the debug records of a production configuration'
+        )
+        parser.add_argument(
+            '--io-wait', type=float, default=0.002, help='Seconds each request waits for the database and the lms'
+        )
+
+    def handle(self, *args, **options):
+        level = getattr(logging, options['level'])
+        if options['output']:
+            with open(options['output'], 'w') as stream:
+                results = benchmark(options['requests'], stream, level=level, io_wait=options['io_wait'])
+        else:
+            results = benchmark(options['requests'], level=level, io_wait=options['io_wait'])
+        for name in ('before', 'after'):
+            self.stdout.write('{}: {:.1f} us of logging per request'.format(name, results[name]))
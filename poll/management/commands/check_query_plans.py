@@ -0,0 +1,51 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ltiprovider.models import LtiConsumer
+from poll.models import Question
+from poll.queryplans import DEFAULT_MIN_ROWS, check_query_plans, compare_reports
+
+
+class Command(BaseCommand):
+    help = (
+        'Check the query counts and query plans of the hot request paths: fails on full scans of large tables, '
+        'and on query count increases over a baseline report'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--consumer-key', help='Consumer of the checked requests (default: the last consumer)')
+        parser.add_argument('--question', type=int, help='Question pk (default: the last question with choices)')
+        parser.add_argument(
+            '--min-rows', type=int, default=DEFAULT_MIN_ROWS,
+            help='Table size from which full scans fail the check'
+        )
+        parser.add_argument('--baseline', help='Report of an earlier run to compare query counts with')
+        parser.add_argument('--output', help='File to write the json report to (default: stdout)')
+
+    def handle(self, *args, **options):
+        consumer = None
+        if options['consumer_key']:
+            consumer = LtiConsumer.objects.get(consumer_key=options['consumer_key'])
+        question = Question.objects.get(pk=options['question']) if options['question'] else None
+        try:
+            report = check_query_plans(consumer, question, options['min_rows'])
+        except ValueError as err:
+            raise CommandError(str(err))
+
+        output = json.dumps(report, indent=2, sort_keys=True) + '\n'
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+        else:
+            self.stdout.write(output, ending='')
+
+        problems = [problem for path in report.values() for problem in path['problems']]
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                problems += compare_reports(report, json.load(f))
+        for problem in problems:
+            self.stderr.write(problem)
+        if problems:
+            raise CommandError('{} query problems'.format(len(problems)))
+        self.stderr.write(self.style.SUCCESS('Query counts and plans ok'))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from ltiprovider.routers import get_shard_databases, use_shard
+from poll.models import Question, TimelineBucket
+from poll.timeline import ROLLUPS, compact_timeline
+
+
+class Command(BaseCommand):
+    help = 'Roll up the timeline buckets of questions into coarser buckets as they age (run periodically, e.g. hourly)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('question', nargs='*', type=int, help='Question pks (default: all questions)')
+        parser.add_argument('--shard', action='append', help='Shard databases (default: all shards)')
+
+    def handle(self, *args, **options):
+        for shard in options['shard'] or get_shard_databases():
+            with use_shard(shard):
+                # only questions with buckets that aren't at the coarsest resolution yet
+                question_pks = set(
+                    TimelineBucket.objects.filter(resolution__in=[fine for fine, _, _ in ROLLUPS])
+                    .values_list('question', flat=True).distinct()
+                )
+                if options['question']:
+                    question_pks &= set(options['question'])
+                for question in Question.objects.filter(pk__in=sorted(question_pks)).iterator():
+                    count = compact_timeline(question)
+                    self.stdout.write('Shard {}, question {}: {} timeline buckets rolled up'.format(
+                        shard, question.pk, count
+                    ))
@@ -0,0 +1,23 @@
+import os
+
+from django.core.management.base import BaseCommand
+
+from config.health import get_drain_file
+
+
+class Command(BaseCommand):
+    help = 'Put the web workers in drain mode (readiness fails) before stopping them, see config/health.py'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cancel', action='store_true', help='Leave drain mode')
+
+    def handle(self, *args, **options):
+        path = get_drain_file()
+        if options['cancel']:
+            if os.path.exists(path):
+                os.remove(path)
+            self.stdout.write('Drain mode cancelled')
+        else:
+            with open(path, 'w'):
+                pass
+            self.stdout.write('Drain mode started ({})'.format(path))
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from poll.synthetic import generate
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate synthetic questions, consumers, users and responses at production scale, '
+        'e.g. for the check_query_plans command'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--consumers', type=int, default=2, help='Number of consumers (spread over shards)')
+        parser.add_argument('--users', type=int, default=100000, help='Number of users per consumer')
+        parser.add_argument('--questions', type=int, default=20, help='Number of questions')
+        parser.add_argument('--choices', type=int, default=4, help='Number of answer choices per question')
+        parser.add_argument('--answer-rate', type=float, default=0.5, help='Fraction of users answering each question')
+        parser.add_argument('--contexts', type=int, default=100, help='Number of courses per consumer')
+        parser.add_argument('--batch-size', type=int, default=10000, help='Number of users per insert batch')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed')
+
+    def handle(self, *args, **options):
+        generate(
+            consumer_count=options['consumers'],
+            user_count=options['users'],
+            question_count=options['questions'],
+            choice_count=options['choices'],
+            answer_rate=options['answer_rate'],
+            context_count=options['contexts'],
+            batch_size=options['batch_size'],
+            seed=options['seed'],
+            log=self.stdout.write,
+        )
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ltiprovider.models import LtiConsumer
+from ltiprovider.routers import get_shard_databases
+from poll.shards import ConsumerMove
+
+
+class Command(BaseCommand):
+    help = 'Move the learner and response data of an lti consumer to another shard database, while it is in use'
+
+    def add_arguments(self, parser):
+        parser.add_argument('consumer_key', help='Consumer key of the lti consumer')
+        parser.add_argument('shard', help='Target shard database alias')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of rows copied or deleted per batch')
+        parser.add_argument(
+            '--grace-period', type=float, default=5,
+            help='Seconds to wait after switching shards for requests in progress on the source shard'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            consumer = LtiConsumer.objects.get(consumer_key=options['consumer_key'])
+        except LtiConsumer.DoesNotExist:
+            raise CommandError('Consumer not found: {}'.format(options['consumer_key']))
+        if options['shard'] not in get_shard_databases():
+            raise CommandError('Unknown shard database: {}'.format(options['shard']))
+        if options['shard'] == consumer.get_shard():
+            raise CommandError('Consumer is already on shard {}'.format(options['shard']))
+
+        move = ConsumerMove(consumer, options['shard'], batch_size=options['batch_size'])
+        move.run(grace_period=options['grace_period'])
+        self.stdout.write('Moved consumer {} to shard {} ({} questions recounted)'.format(
+            consumer.consumer_name, options['shard'], len(move.question_pks)
+        ))
@@ -0,0 +1,35 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from ltiprovider.routers import get_shard_databases, use_shard
+from poll.archive import prune_sessions, prune_users
+
+
+class Command(BaseCommand):
+    help = 'Delete expired sessions and inactive lti users without responses, in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user-days', type=int,
+            help='Days since the last launch of deleted users (default, and at least: the session cookie age)'
+        )
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of rows deleted per batch')
+        parser.add_argument('--pause', type=float, default=0.1, help='Seconds to wait between batches')
+        parser.add_argument('--shard', action='append', help='Shard databases of the users (default: all shards)')
+
+    def handle(self, *args, **options):
+        count = prune_sessions(batch_size=options['batch_size'], pause=options['pause'])
+        if count is None:
+            self.stdout.write('Sessions are not stored in the database')
+        else:
+            self.stdout.write('{} expired sessions deleted'.format(count))
+
+        inactive_before = None
+        if options['user_days'] is not None:
+            inactive_before = timezone.now() - timedelta(days=options['user_days'])
+        for shard in options['shard'] or get_shard_databases():
+            with use_shard(shard):
+                count = prune_users(inactive_before, batch_size=options['batch_size'], pause=options['pause'])
+                self.stdout.write('Shard {}: {} inactive users deleted'.format(shard, count))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from ltiprovider.routers import get_shard_databases, use_shard
+from poll.models import Question
+from poll.tallies import rebuild_tallies
+
+
+class Command(BaseCommand):
+    help = 'Recompute the vote tallies of questions from their responses'
+
+    def add_arguments(self, parser):
+        parser.add_argument('question', nargs='*', type=int, help='Question pks (default: all questions)')
+        parser.add_argument('--shard', action='append', help='Shard databases (default: all shards)')
+
+    def handle(self, *args, **options):
+        questions = Question.objects.all()
+        if options['question']:
+            questions = questions.filter(pk__in=options['question'])
+        for shard in options['shard'] or get_shard_databases():
+            with use_shard(shard):
+                for question in questions.iterator():
+                    count = rebuild_tallies(Question.objects.filter(pk=question.pk))
+                    self.stdout.write('Shard {}, question {}: {} tallies'.format(shard, question.pk, count))
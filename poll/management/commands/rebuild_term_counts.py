@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from ltiprovider.routers import get_shard_databases, use_shard
+from poll.models import Question
+from poll.text import rebuild_term_counts
+
+
+class Command(BaseCommand):
+    help = 'Recompute the term index of free text questions from their responses'
+
+    def add_arguments(self, parser):
+        parser.add_argument('question', nargs='*', type=int, help='Question pks (default: all free text questions)')
+        parser.add_argument('--chunk-size', type=int, default=10000, help='Number of responses read per batch')
+        parser.add_argument('--shard', action='append', help='Shard databases (default: all shards)')
+
+    def handle(self, *args, **options):
+        questions = Question.objects.filter(question_type=Question.TEXT)
+        if options['question']:
+            questions = questions.filter(pk__in=options['question'])
+        for shard in options['shard'] or get_shard_databases():
+            with use_shard(shard):
+                for question in questions.iterator():
+                    count = rebuild_term_counts(question, chunk_size=options['chunk_size'])
+                    self.stdout.write('Shard {}, question {}: {} term counts'.format(shard, question.pk, count))
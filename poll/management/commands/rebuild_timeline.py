@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+
+from ltiprovider.routers import get_shard_databases, use_shard
+from poll.models import Question, Response
+from poll.timeline import rebuild_timeline, set_missing_response_times
+
+
+class Command(BaseCommand):
+    help = 'Recompute the timeline buckets of questions from the times of their responses'
+
+    def add_arguments(self, parser):
+        parser.add_argument('question', nargs='*', type=int, help='Question pks (default: all questions)')
+        parser.add_argument('--chunk-size', type=int, default=10000, help='Number of responses counted per batch')
+        parser.add_argument('--shard', action='append', help='Shard databases (default: all shards)')
+        parser.add_argument(
+            '--set-missing', metavar='DATETIME',
+            help='Response time (ISO 8601) of the responses made before response times were recorded '
+                 '(default: these responses are not counted)'
+        )
+
+    def handle(self, *args, **options):
+        created_at = None
+        if options['set_missing']:
+            created_at = parse_datetime(options['set_missing'])
+            if created_at is None or created_at.tzinfo is None:
+                raise CommandError('--set-missing must be an ISO 8601 datetime with a time zone')
+        questions = Question.objects.all()
+        if options['question']:
+            questions = questions.filter(pk__in=options['question'])
+        for shard in options['shard'] or get_shard_databases():
+            with use_shard(shard):
+                for question in questions.iterator():
+                    if created_at is not None:
+                        set_missing_response_times(question, created_at)
+                    count = rebuild_timeline(question, chunk_size=options['chunk_size'])
+                    skipped = Response.objects.filter(question=question, created_at__isnull=True).count()
+                    self.stdout.write('Shard {}, question {}: {} timeline buckets, {} responses without time'.format(
+                        shard, question.pk, count, skipped
+                    ))
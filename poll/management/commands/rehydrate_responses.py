@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from ltiprovider.routers import get_shard_databases
+from poll.archive import rehydrate_questions
+from poll.models import Question
+
+
+class Command(BaseCommand):
+    help = 'Restore the archived responses of questions to the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('question', nargs='+', type=int, help='Question pks')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of responses restored per batch')
+        parser.add_argument('--shard', action='append', help='Shard databases (default: all shards)')
+
+    def handle(self, *args, **options):
+        questions = Question.objects.filter(pk__in=options['question'], archived_at__isnull=False)
+        restored = rehydrate_questions(
+            questions, options['shard'] or get_shard_databases(), batch_size=options['batch_size']
+        )
+        for question_pk, count in restored.items():
+            self.stdout.write('Question {}: {} responses restored'.format(question_pk, count))
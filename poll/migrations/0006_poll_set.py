@@ -0,0 +1,42 @@
+# Generated by Django 2.0.5 on 2026-10-19 19:08
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('poll', '0005_auto_20180622_0501'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PollSet',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=200)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PollSetQuestion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('order', models.PositiveIntegerField(default=0)),
+                ('poll_set', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='poll.PollSet')),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='poll.Question')),
+            ],
+            options={
+                'ordering': ('order', 'pk'),
+            },
+        ),
+        migrations.AddField(
+            model_name='pollset',
+            name='questions',
+            field=models.ManyToManyField(through='poll.PollSetQuestion', to='poll.Question'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='pollsetquestion',
+            unique_together={('poll_set', 'question')},
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 2.0.5 on 2026-10-19 19:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def create_global_tallies(apps, schema_editor):
+    """
+    Count existing responses into global tallies; they predate context and resource link ids
+    """
+    Response = apps.get_model('poll', 'Response')
+    Tally = apps.get_model('poll', 'Tally')
+    db = schema_editor.connection.alias
+    counts = Response.objects.using(db).values_list('question', 'choice').annotate(votes=models.Count('id')).order_by()
+    Tally.objects.using(db).bulk_create(
+        [Tally(question_id=question, choice_id=choice, scope='global', votes=votes) for question, choice, votes in counts],
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('poll', '0006_poll_set'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tally',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scope', models.CharField(choices=[('global', 'Global'), ('context', 'Course'), ('resource_link', 'Resource link')], default='global', max_length=16)),
+                ('scope_id', models.CharField(blank=True, default='', max_length=255)),
+                ('votes', models.PositiveIntegerField(default=0)),
+                ('choice', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='poll.Choice')),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='poll.Question')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='response',
+            name='context_id',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='response',
+            name='resource_link_id',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AlterUniqueTogether(
+            name='tally',
+            unique_together={('question', 'scope', 'scope_id', 'choice')},
+        ),
+        migrations.RunPython(create_global_tallies, migrations.RunPython.noop, hints={'model_name': 'tally'}),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 2.0.5 on 2026-10-19 19:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('poll', '0007_response_scope_tally'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='response',
+            name='context_id',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='response',
+            name='resource_link_id',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=255),
+        ),
+        migrations.AddIndex(
+            model_name='response',
+            index=models.Index(fields=['lti_user', 'question'], name='poll_respon_lti_use_caa1a5_idx'),
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 2.0.5 on 2026-10-19 19:18
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('poll', '0008_response_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ValueBucket',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scope', models.CharField(choices=[('global', 'Global'), ('context', 'Course'), ('resource_link', 'Resource link')], default='global', max_length=16)),
+                ('scope_id', models.CharField(blank=True, default='', max_length=255)),
+                ('kind', models.CharField(choices=[('histogram', 'Histogram bin'), ('positive', 'Sketch positive bucket'), ('negative', 'Sketch negative bucket'), ('zero', 'Sketch zero bucket')], max_length=16)),
+                ('index', models.IntegerField()),
+                ('count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='bin_count',
+            field=models.PositiveSmallIntegerField(default=10),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='max_value',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='min_value',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='question_type',
+            field=models.CharField(choices=[('choice', 'Single choice'), ('numeric', 'Numeric value'), ('scale', 'Scale (e.g. 1-10)')], default='choice', max_length=16),
+        ),
+        migrations.AddField(
+            model_name='response',
+            name='value',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='response',
+            name='choice',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='poll.Choice'),
+        ),
+        migrations.AddField(
+            model_name='valuebucket',
+            name='question',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='poll.Question'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='valuebucket',
+            unique_together={('question', 'scope', 'scope_id', 'kind', 'index')},
+        ),
+    ]
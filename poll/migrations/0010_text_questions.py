@@ -0,0 +1,47 @@
+# Generated by Django 2.0.5 on 2026-10-19 19:19
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('poll', '0009_value_questions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TermCount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scope', models.CharField(choices=[('global', 'Global'), ('context', 'Course'), ('resource_link', 'Resource link')], default='global', max_length=16)),
+                ('scope_id', models.CharField(blank=True, default='', max_length=255)),
+                ('term', models.CharField(max_length=100)),
+                ('count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='response',
+            name='text',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AlterField(
+            model_name='question',
+            name='question_type',
+            field=models.CharField(choices=[('choice', 'Single choice'), ('numeric', 'Numeric value'), ('scale', 'Scale (e.g. 1-10)'), ('text', 'Free text')], default='choice', max_length=16),
+        ),
+        migrations.AddField(
+            model_name='termcount',
+            name='question',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='poll.Question'),
+        ),
+        migrations.AddIndex(
+            model_name='termcount',
+            index=models.Index(fields=['question', 'scope', 'scope_id', '-count', 'term'], name='poll_termco_questio_290bfc_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='termcount',
+            unique_together={('question', 'scope', 'scope_id', 'term')},
+        ),
+    ]
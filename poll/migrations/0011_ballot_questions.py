@@ -0,0 +1,44 @@
+# Generated by Django 2.0.5 on 2026-10-19 19:23
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('poll', '0010_text_questions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChoicePair',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scope', models.CharField(choices=[('global', 'Global'), ('context', 'Course'), ('resource_link', 'Resource link')], default='global', max_length=16)),
+                ('scope_id', models.CharField(blank=True, default='', max_length=255)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('choice_a', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='poll.Choice')),
+                ('choice_b', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='poll.Choice')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='response',
+            name='ballot',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='question',
+            name='question_type',
+            field=models.CharField(choices=[('choice', 'Single choice'), ('numeric', 'Numeric value'), ('scale', 'Scale (e.g. 1-10)'), ('text', 'Free text'), ('multiple', 'Multiple choice (select all that apply)'), ('ranked', 'Ranked choice')], default='choice', max_length=16),
+        ),
+        migrations.AddField(
+            model_name='choicepair',
+            name='question',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='poll.Question'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='choicepair',
+            unique_together={('question', 'scope', 'scope_id', 'choice_a', 'choice_b')},
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 2.0.5 on 2026-10-19 19:27
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('poll', '0011_ballot_questions'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='choicepair',
+            name='choice_a',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='poll.Choice'),
+        ),
+        migrations.AlterField(
+            model_name='choicepair',
+            name='choice_b',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='poll.Choice'),
+        ),
+        migrations.AlterField(
+            model_name='choicepair',
+            name='question',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, to='poll.Question'),
+        ),
+        migrations.AlterField(
+            model_name='response',
+            name='choice',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, to='poll.Choice'),
+        ),
+        migrations.AlterField(
+            model_name='response',
+            name='question',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, to='poll.Question'),
+        ),
+        migrations.AlterField(
+            model_name='tally',
+            name='choice',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, to='poll.Choice'),
+        ),
+        migrations.AlterField(
+            model_name='tally',
+            name='question',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, to='poll.Question'),
+        ),
+        migrations.AlterField(
+            model_name='termcount',
+            name='question',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, to='poll.Question'),
+        ),
+        migrations.AlterField(
+            model_name='valuebucket',
+            name='question',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, to='poll.Question'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 2.0.5 on 2026-10-19 19:46
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('poll', '0012_shard_foreign_keys'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TimelineBucket',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scope', models.CharField(choices=[('global', 'Global'), ('context', 'Course'), ('resource_link', 'Resource link')], default='global', max_length=16)),
+                ('scope_id', models.CharField(blank=True, default='', max_length=255)),
+                ('resolution', models.PositiveIntegerField()),
+                ('start', models.BigIntegerField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('choice', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, to='poll.Choice')),
+                ('question', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, to='poll.Question')),
+            ],
+        ),
+        # existing responses have no response time (null), only new responses get the default
+        migrations.AddField(
+            model_name='response',
+            name='created_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='response',
+            name='created_at',
+            field=models.DateTimeField(blank=True, default=django.utils.timezone.now, null=True),
+        ),
+        migrations.AlterUniqueTogether(
+            name='timelinebucket',
+            unique_together={('question', 'scope', 'scope_id', 'resolution', 'start', 'choice')},
+        ),
+    ]
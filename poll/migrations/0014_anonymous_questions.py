@@ -0,0 +1,57 @@
+# Generated by Django 2.0.5 on 2026-10-19 19:50
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('poll', '0013_response_timeline'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Voter',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.BigIntegerField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='VoterFilter',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('block', models.PositiveIntegerField()),
+                ('bits', models.BinaryField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='anonymous',
+            field=models.BooleanField(default=False, help_text='Only count answers, without storing responses linked to learners.'),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='expected_voters',
+            field=models.PositiveIntegerField(blank=True, help_text='Anonymous questions with a very large audience: record voters in a Bloom filter sized for this many voters (a few learners may be wrongly seen as having voted, see POLL_VOTER_FILTER_ERROR_RATE).', null=True),
+        ),
+        migrations.AddField(
+            model_name='voterfilter',
+            name='question',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, to='poll.Question'),
+        ),
+        migrations.AddField(
+            model_name='voter',
+            name='question',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, to='poll.Question'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='voterfilter',
+            unique_together={('question', 'block')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='voter',
+            unique_together={('question', 'digest')},
+        ),
+    ]
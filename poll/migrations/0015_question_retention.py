@@ -0,0 +1,23 @@
+# Generated by Django 2.0.5 on 2026-10-19 19:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('poll', '0014_anonymous_questions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='archived_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='closed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 2.0.5 on 2026-10-19 20:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('poll', '0015_question_retention'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='tally',
+            index=models.Index(fields=['scope', 'scope_id', 'question'], name='poll_tally_scope_e75705_idx'),
+        ),
+    ]
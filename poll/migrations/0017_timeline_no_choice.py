@@ -0,0 +1,46 @@
+# Generated by Django 2.0.5 on 2026-10-19 21:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def set_no_choice(apps, schema_editor):
+    """
+    Merge the buckets without an answer choice (null, which the unique index doesn't match, so concurrent responses
+    may have created a bucket twice) into a single bucket with the NO_CHOICE key (0)
+    """
+    TimelineBucket = apps.get_model('poll', 'TimelineBucket')
+    db = schema_editor.connection.alias
+    buckets = TimelineBucket.objects.using(db).filter(choice__isnull=True)
+    counts = list(
+        buckets.values_list('question', 'scope', 'scope_id', 'resolution', 'start')
+        .annotate(total=models.Sum('count'))
+        .order_by()
+    )
+    buckets.delete()
+    TimelineBucket.objects.using(db).bulk_create(
+        [
+            TimelineBucket(
+                question_id=question, choice_id=0, scope=scope, scope_id=scope_id,
+                resolution=resolution, start=start, count=count
+            )
+            for question, scope, scope_id, resolution, start, count in counts
+        ],
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('poll', '0016_tally_scope_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(set_no_choice, migrations.RunPython.noop, hints={'model_name': 'timelinebucket'}),
+        migrations.AlterField(
+            model_name='timelinebucket',
+            name='choice',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, to='poll.Choice'),
+        ),
+    ]
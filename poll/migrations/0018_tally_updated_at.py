@@ -0,0 +1,20 @@
+# Generated by Django 2.0.5 on 2026-10-19 21:40
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('poll', '0017_timeline_no_choice'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tally',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+    ]
@@ -1,13 +1,115 @@
+from django.core.exceptions import ValidationError
 from django.db import models
+from django.utils import timezone
 from ltiprovider.models import LtiUser
+from ltiprovider.routers import get_shard_databases
 
 
 class Question(models.Model):
+    CHOICE = 'choice'
+    NUMERIC = 'numeric'
+    SCALE = 'scale'
+    TEXT = 'text'
+    MULTIPLE = 'multiple'
+    RANKED = 'ranked'
+    QUESTION_TYPE_CHOICES = (
+        (CHOICE, 'Single choice'),
+        (NUMERIC, 'Numeric value'),
+        (SCALE, 'Scale (e.g. 1-10)'),
+        (TEXT, 'Free text'),
+        (MULTIPLE, 'Multiple choice (select all that apply)'),
+        (RANKED, 'Ranked choice'),
+    )
+
     question_text = models.TextField()
+    question_type = models.CharField(max_length=16, choices=QUESTION_TYPE_CHOICES, default=CHOICE)
+    # range of numeric and scale answers; numeric questions without a range have no histogram
+    min_value = models.FloatField(null=True, blank=True)
+    max_value = models.FloatField(null=True, blank=True)
+    # number of histogram bins of numeric questions (scale questions have one bin per value)
+    bin_count = models.PositiveSmallIntegerField(default=10)
+    # anonymous questions only count answers (no Response rows), and record who voted as keyed hashes,
+    # or in a Bloom filter sized for expected_voters (see poll.voters)
+    anonymous = models.BooleanField(
+        default=False,
+        help_text='Only count answers, without storing responses linked to learners.'
+    )
+    expected_voters = models.PositiveIntegerField(
+        null=True, blank=True,
+        help_text='Anonymous questions with a very large audience: record voters in a Bloom filter sized for this '
+                  'many voters (a few learners may be wrongly seen as having voted, see POLL_VOTER_FILTER_ERROR_RATE).'
+    )
+    # closed questions don't accept answers; their responses are archived after a while (see poll.archive)
+    closed_at = models.DateTimeField(null=True, blank=True)
+    archived_at = models.DateTimeField(null=True, blank=True, editable=False)
 
     def __str__(self):
         return self.question_text
 
+    def clean(self):
+        if self.question_type == self.SCALE and (self.min_value is None or self.max_value is None):
+            raise ValidationError('Scale questions require a minimum and maximum value.')
+        if self.min_value is not None and self.max_value is not None and self.min_value >= self.max_value:
+            raise ValidationError('Minimum value must be less than maximum value.')
+        if self.anonymous and self.question_type == self.RANKED:
+            raise ValidationError('Ranked choice questions cannot be anonymous, their results are computed from '
+                                  'the stored ballots.')
+        if self.expected_voters and not self.anonymous:
+            raise ValidationError('Expected voters only applies to anonymous questions.')
+        if self.pk is not None:
+            # answers are recorded as responses or as voter records, in a filter sized for expected_voters
+            previous = Question.objects.filter(pk=self.pk).values_list('anonymous', 'expected_voters').first()
+            if previous not in (None, (self.anonymous, self.expected_voters)) and self.has_answers():
+                raise ValidationError('Anonymous and expected voters cannot be changed once the question has answers.')
+
+    def has_answers(self):
+        """
+        :return: bool, True if the question has responses, voter records or counted answers on any shard
+        """
+        return any(
+            model.objects.using(shard).filter(question_id=self.pk).exists()
+            for shard in get_shard_databases()
+            for model in (Response, Tally, TimelineBucket, Voter, VoterFilter)
+        )
+
+    def is_closed(self):
+        """
+        :return: bool, True if the question no longer accepts answers
+        """
+        return self.closed_at is not None and self.closed_at <= timezone.now()
+
+    def can_rebuild_counters(self):
+        """
+        Counters (tallies, value buckets, term counts, timeline) can only be recomputed from stored responses,
+        not for anonymous questions or questions whose responses are archived
+        :return: bool
+        """
+        return not self.anonymous and self.archived_at is None
+
+    def has_ballot_answer(self):
+        """
+        :return: bool, True if answers are several answer choices (see Response.ballot)
+        """
+        return self.question_type in (self.MULTIPLE, self.RANKED)
+
+    def has_value_answer(self):
+        """
+        :return: bool, True if answers are numeric values instead of answer choices
+        """
+        return self.question_type in (self.NUMERIC, self.SCALE)
+
+    def get_bins(self):
+        """
+        Fixed-width histogram bins of the answer values
+        :return: (lower edge, bin width, number of bins) tuple, or None if the question has no histogram
+        """
+        if not self.has_value_answer() or self.min_value is None or self.max_value is None:
+            return None
+        if self.question_type == self.SCALE:
+            # one bin centered on each integer value
+            return self.min_value - 0.5, 1.0, int(self.max_value - self.min_value) + 1
+        return self.min_value, (self.max_value - self.min_value) / self.bin_count, self.bin_count
+
 
 class Choice(models.Model):
     question = models.ForeignKey(Question, on_delete=models.CASCADE)
@@ -18,6 +120,244 @@ class Choice(models.Model):
 
 
 class Response(models.Model):
+    """
+    Learner's answer to a question.
+    Responses and counter rows (tallies, value buckets, term counts) are stored on the shard database of the
+    lti consumer (see ltiprovider.routers); they are deleted with their question or answer choice by signal handlers
+    (see poll.signals), since questions are on the catalog database
+    """
+    sharded = True
+
     lti_user = models.ForeignKey(LtiUser, on_delete=models.CASCADE)
+    question = models.ForeignKey(Question, on_delete=models.DO_NOTHING, db_constraint=False)
+    # answer: an answer choice, a value for numeric and scale questions, text for free text questions,
+    # or the selected (multiple choice) or ranked (ranked choice) answer choice pks, see poll.ballots
+    choice = models.ForeignKey(Choice, on_delete=models.DO_NOTHING, db_constraint=False, null=True, blank=True)
+    value = models.FloatField(null=True, blank=True)
+    text = models.TextField(blank=True, default='')
+    ballot = models.BinaryField(null=True, blank=True)
+    # course and lti component the response was made in, from the lti launch params
+    context_id = models.CharField(max_length=255, blank=True, default='', db_index=True)
+    resource_link_id = models.CharField(max_length=255, blank=True, default='', db_index=True)
+    # null for responses made before response times were recorded
+    created_at = models.DateTimeField(default=timezone.now, null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # learner's response to a question ("already answered" check)
+            models.Index(fields=['lti_user', 'question']),
+        ]
+
+    @property
+    def answer(self):
+        """
+        :return: answer for display
+        """
+        if self.choice_id is not None:
+            return self.choice.choice_text
+        if self.value is not None:
+            return self.value
+        if self.ballot is not None:
+            from .ballots import decode_ballot
+            choices = dict(Choice.objects.filter(question_id=self.question_id).values_list('pk', 'choice_text'))
+            return ', '.join(choices[pk] for pk in decode_ballot(self.ballot) if pk in choices)
+        return self.text
+
+
+class Tally(models.Model):
+    """
+    Vote count of an answer choice within a scope, updated incrementally as responses are made (see poll.tallies).
+    Scope is either all responses (global), responses in a course (context) or in an lti component (resource link)
+    """
+    GLOBAL = 'global'
+    CONTEXT = 'context'
+    RESOURCE_LINK = 'resource_link'
+    SCOPE_CHOICES = (
+        (GLOBAL, 'Global'),
+        (CONTEXT, 'Course'),
+        (RESOURCE_LINK, 'Resource link'),
+    )
+    sharded = True
+
+    question = models.ForeignKey(Question, on_delete=models.DO_NOTHING, db_constraint=False)
+    choice = models.ForeignKey(Choice, on_delete=models.DO_NOTHING, db_constraint=False)
+    scope = models.CharField(max_length=16, choices=SCOPE_CHOICES, default=GLOBAL)
+    # context_id or resource_link_id, empty for global scope
+    scope_id = models.CharField(max_length=255, blank=True, default='')
+    votes = models.PositiveIntegerField(default=0)
+    # time of the last vote or recount, the version of the course results (see poll.dashboard)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = (
+            ('question', 'scope', 'scope_id', 'choice'),
+        )
+        indexes = [
+            # tallies of a course or resource link, across questions (see poll.dashboard)
+            models.Index(fields=['scope', 'scope_id', 'question']),
+        ]
+
+
+class ChoicePair(models.Model):
+    """
+    Number of multiple choice answers that selected both answer choices of a pair (choice_a.pk < choice_b.pk),
+    within a tally scope, updated incrementally as responses are made (see poll.ballots)
+    """
+    sharded = True
+
+    question = models.ForeignKey(Question, on_delete=models.DO_NOTHING, db_constraint=False)
+    scope = models.CharField(max_length=16, choices=Tally.SCOPE_CHOICES, default=Tally.GLOBAL)
+    scope_id = models.CharField(max_length=255, blank=True, default='')
+    choice_a = models.ForeignKey(Choice, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    choice_b = models.ForeignKey(Choice, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = (
+            ('question', 'scope', 'scope_id', 'choice_a', 'choice_b'),
+        )
+
+
+class ValueBucket(models.Model):
+    """
+    Count of the answer values of a numeric or scale question that fall in a bucket, within a tally scope,
+    updated incrementally as responses are made (see poll.aggregates).
+    Histogram buckets are the question's fixed-width bins (see Question.get_bins);
+    positive, negative and zero buckets are the logarithmic buckets of a quantile sketch (see poll.sketches).
+    """
+    HISTOGRAM = 'histogram'
+    POSITIVE = 'positive'
+    NEGATIVE = 'negative'
+    ZERO = 'zero'
+    KIND_CHOICES = (
+        (HISTOGRAM, 'Histogram bin'),
+        (POSITIVE, 'Sketch positive bucket'),
+        (NEGATIVE, 'Sketch negative bucket'),
+        (ZERO, 'Sketch zero bucket'),
+    )
+    sharded = True
+
+    question = models.ForeignKey(Question, on_delete=models.DO_NOTHING, db_constraint=False)
+    scope = models.CharField(max_length=16, choices=Tally.SCOPE_CHOICES, default=Tally.GLOBAL)
+    scope_id = models.CharField(max_length=255, blank=True, default='')
+    kind = models.CharField(max_length=16, choices=KIND_CHOICES)
+    index = models.IntegerField()
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = (
+            ('question', 'scope', 'scope_id', 'kind', 'index'),
+        )
+
+
+class TermCount(models.Model):
+    """
+    Number of free text answers of a question that contain a term, within a tally scope,
+    updated incrementally as responses are made (see poll.text)
+    """
+    sharded = True
+
+    question = models.ForeignKey(Question, on_delete=models.DO_NOTHING, db_constraint=False)
+    scope = models.CharField(max_length=16, choices=Tally.SCOPE_CHOICES, default=Tally.GLOBAL)
+    scope_id = models.CharField(max_length=255, blank=True, default='')
+    term = models.CharField(max_length=100)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = (
+            ('question', 'scope', 'scope_id', 'term'),
+        )
+        indexes = [
+            # top terms of a question in a scope, read in index order
+            models.Index(fields=['question', 'scope', 'scope_id', '-count', 'term']),
+        ]
+
+
+class TimelineBucket(models.Model):
+    """
+    Number of responses to a question (counted for an answer choice, see poll.timeline) made within a time bucket,
+    within a tally scope, updated incrementally as responses are made.
+    Buckets are recorded at the finest resolution, and rolled up into coarser buckets as they age.
+    """
+    sharded = True
+
+    question = models.ForeignKey(Question, on_delete=models.DO_NOTHING, db_constraint=False)
+    # 0 for questions without answer choices (see poll.timeline.NO_CHOICE)
+    choice = models.ForeignKey(Choice, on_delete=models.DO_NOTHING, db_constraint=False)
+    scope = models.CharField(max_length=16, choices=Tally.SCOPE_CHOICES, default=Tally.GLOBAL)
+    scope_id = models.CharField(max_length=255, blank=True, default='')
+    # bucket duration and start, in seconds (unix time, a multiple of the resolution)
+    resolution = models.PositiveIntegerField()
+    start = models.BigIntegerField()
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = (
+            ('question', 'scope', 'scope_id', 'resolution', 'start', 'choice'),
+        )
+
+
+class Voter(models.Model):
+    """
+    Keyed hash of a learner who answered an anonymous question (see poll.voters)
+    """
+    sharded = True
+
+    question = models.ForeignKey(Question, on_delete=models.DO_NOTHING, db_constraint=False)
+    digest = models.BigIntegerField()
+
+    class Meta:
+        unique_together = (
+            ('question', 'digest'),
+        )
+
+
+class VoterFilter(models.Model):
+    """
+    Block of the Bloom filter of the learners who answered an anonymous question (see poll.voters)
+    """
+    sharded = True
+
+    question = models.ForeignKey(Question, on_delete=models.DO_NOTHING, db_constraint=False)
+    block = models.PositiveIntegerField()
+    bits = models.BinaryField()
+
+    class Meta:
+        unique_together = (
+            ('question', 'block'),
+        )
+
+
+class PollSet(models.Model):
+    """
+    Ordered group of questions served from a single LTI launch
+    """
+    title = models.CharField(max_length=200)
+    questions = models.ManyToManyField(Question, through='PollSetQuestion')
+
+    def __str__(self):
+        return self.title
+
+    def get_questions(self):
+        """
+        Questions in the set in order, with their answer choices prefetched
+        :return: list of Question model instances
+        """
+        items = (
+            self.pollsetquestion_set
+            .select_related('question')
+            .prefetch_related('question__choice_set')
+        )
+        return [item.question for item in items]
+
+
+class PollSetQuestion(models.Model):
+    poll_set = models.ForeignKey(PollSet, on_delete=models.CASCADE)
     question = models.ForeignKey(Question, on_delete=models.CASCADE)
-    choice = models.ForeignKey(Choice, on_delete=models.CASCADE)
+    order = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ('order', 'pk')
+        unique_together = (
+            ('poll_set', 'question'),
+        )
@@ -1,22 +1,209 @@
+import numpy as np
 import plotly.offline as opy
 import plotly.graph_objs as go
-from django.db.models import Count
-from poll.models import Choice
+from django.utils.html import format_html, format_html_join
+from poll.aggregates import get_value_summary
+from poll.ballots import get_pair_counts, get_runoff_results
+from poll.models import Choice, Tally
+from poll.tallies import get_vote_counts
+from poll.text import get_top_terms
+from poll.timeline import get_timeline
 
 
-def results_pie(question, **kwargs):
-    # get choices and sum responses for each
-    choices = Choice.objects.filter(question=question).annotate(votes=Count('response'))
-    choice_text, votes = list(zip(*choices.values_list('choice_text','votes')))
+def results_plot(question, scope=Tally.GLOBAL, scope_id='', **kwargs):
+    """
+    Results chart of a question: pie of answer choice votes, histogram of numeric answer values,
+    word cloud of free text answers, selection counts and co-occurrence of multiple choice answers,
+    or instant-runoff rounds of ranked choice answers
+    """
+    if question.has_value_answer():
+        return results_histogram(question, scope, scope_id)
+    if question.question_type == question.TEXT:
+        return results_word_cloud(question, scope, scope_id)
+    if question.question_type == question.MULTIPLE:
+        return results_selection(question, scope, scope_id)
+    if question.question_type == question.RANKED:
+        return results_runoff(question, scope, scope_id)
+    return results_pie(question, scope, scope_id)
 
-    # create plotly graph
-    trace = go.Pie(labels=choice_text, values=votes)
-    data = go.Data([trace])
-    layout = go.Layout()
-    figure = go.Figure(data=data,layout=layout)
+
+def results_pie(question, scope=Tally.GLOBAL, scope_id='', **kwargs):
+    # get choices and their vote tallies in the scope
+    choices = Choice.objects.filter(question=question).values_list('pk', 'choice_text')
+    votes = get_vote_counts([question], scope, scope_id)
+    return pie([text for pk, text in choices], [votes.get(pk, 0) for pk, text in choices])
+
+
+def results_histogram(question, scope=Tally.GLOBAL, scope_id='', **kwargs):
+    # get histogram and quantiles from the value buckets in the scope
+    return histogram(get_value_summary(question, scope, scope_id))
+
+
+def results_word_cloud(question, scope=Tally.GLOBAL, scope_id='', **kwargs):
+    # get the most frequent terms from the term index in the scope
+    return word_cloud(get_top_terms(question, scope, scope_id))
+
+
+def results_selection(question, scope=Tally.GLOBAL, scope_id='', **kwargs):
+    # get selection tallies and co-occurrence counts in the scope
+    choices = Choice.objects.filter(question=question).order_by('pk').values_list('pk', 'choice_text')
+    votes = get_vote_counts([question], scope, scope_id)
+    pairs = get_pair_counts(question, scope, scope_id)
+    return selection(choices, votes, pairs)
+
+
+def results_runoff(question, scope=Tally.GLOBAL, scope_id='', **kwargs):
+    # get instant-runoff rounds computed from the ballots in the scope
+    return runoff(get_runoff_results(question, scope, scope_id))
+
+
+def results_timeline(question, scope=Tally.GLOBAL, scope_id='', cumulative=True, **kwargs):
+    # get the responses per interval from the timeline buckets in the scope
+    choices = dict(Choice.objects.filter(question=question).values_list('pk', 'choice_text'))
+    return timeline(get_timeline(question, scope, scope_id), choices, cumulative)
+
+
+def pie(labels, values):
+    """
+    Render a pie chart as an html div
+    :param labels: list of str, slice labels
+    :param values: list of int, slice values
+    :return: str, html div
+    """
+    trace = go.Pie(labels=labels, values=values)
+    return render([trace], go.Layout())
+
+
+def histogram(summary):
+    """
+    Render a histogram of answer values, titled with the median and interquartile range, as an html div
+    :param summary: dict, see poll.aggregates.get_value_summary
+    :return: str, html div
+    """
+    data = []
+    if summary['histogram'] is not None:
+        edges = summary['bin_edges']
+        trace = go.Bar(
+            x=[(lower + upper) / 2 for lower, upper in zip(edges, edges[1:])],
+            y=summary['histogram'],
+            width=[upper - lower for lower, upper in zip(edges, edges[1:])],
+        )
+        data.append(trace)
+
+    if summary['count']:
+        title = 'Median: {:.3g} (interquartile range {:.3g} to {:.3g}), {} answers'.format(
+            summary['median'], summary['q1'], summary['q3'], summary['count']
+        )
+    else:
+        title = 'No answers yet'
+    return render(data, go.Layout(title=title, bargap=0.05))
+
+
+def word_cloud(terms, min_size=100, max_size=300):
+    """
+    Render terms as an html div, with font size (percent) proportional to term count
+    :param terms: list of (term, count) tuples
+    :return: str, html div
+    """
+    if not terms:
+        return format_html('<div class="word_cloud">{}</div>', 'No answers yet')
+    max_count = max(count for term, count in terms)
+    words = format_html_join(
+        ' ', '<span style="font-size: {}%" title="{}">{}</span>',
+        (
+            (min_size + (max_size - min_size) * count // max_count, count, term)
+            # alphabetical, so that frequent terms are spread out
+            for term, count in sorted(terms)
+        )
+    )
+    return format_html('<div class="word_cloud">{}</div>', words)
+
+
+def selection(choices, votes, pairs):
+    """
+    Render a bar chart of the number of answers selecting each choice,
+    and a heatmap of the number of answers selecting each pair of choices, as html divs
+    :param choices: list of (choice pk, choice text) tuples
+    :param votes: dict, {choice pk: number of answers selecting it}
+    :param pairs: dict, {(choice pk, choice pk): number of answers selecting both}, see poll.ballots.get_pair_counts
+    :return: str, html divs
+    """
+    labels = [text for pk, text in choices]
+    bars = go.Bar(x=labels, y=[votes.get(pk, 0) for pk, text in choices])
+    # symmetric co-occurrence matrix, with the selection counts on the diagonal
+    matrix = [
+        [votes.get(a, 0) if a == b else pairs.get((min(a, b), max(a, b)), 0) for b, text in choices]
+        for a, text in choices
+    ]
+    heatmap = go.Heatmap(x=labels, y=labels, z=matrix, colorscale='Blues')
+    return (
+        render([bars], go.Layout(title='Answers selecting each choice'))
+        + render([heatmap], go.Layout(title='Answers selecting both choices'))
+    )
+
+
+def runoff(results):
+    """
+    Render the instant-runoff rounds as a grouped bar chart, titled with the winner, as an html div
+    :param results: dict, see poll.ballots.get_runoff_results
+    :return: str, html div
+    """
+    labels = [text for pk, text in results['choices']]
+    data = [
+        go.Bar(x=labels, y=votes, name='Round {}'.format(number))
+        for number, votes in enumerate(results['rounds'], 1)
+    ]
+    winner = dict(results['choices']).get(results['winner'])
+    title = 'Winner: {}'.format(winner) if winner else 'No answers yet'
+    return render(data, go.Layout(title=title, barmode='group'))
+
+
+def timeline(data, choices, cumulative=True):
+    """
+    Render the number of responses over time as a line chart, with a line per answer choice, as an html div
+    :param data: dict, see poll.timeline.get_timeline (or None if there are no responses)
+    :param choices: dict, {choice pk: choice text}
+    :param cumulative: bool, show the total number of responses at each time instead of the number per interval
+    :return: str, html div
+    """
+    if data is None:
+        return render([], go.Layout(title='No answers yet'))
+    counts = np.cumsum(data['counts'], axis=1) if cumulative else data['counts']
+    traces = [
+        go.Scatter(
+            x=data['starts'], y=row.tolist(), mode='lines', name=choices.get(pk, 'Responses'),
+            line=dict(shape='hv')
+        )
+        for pk, row in zip(data['choices'], counts)
+    ]
+    if cumulative:
+        title = 'Total responses'
+    else:
+        title = 'Responses per {}'.format(format_interval(data['interval']))
+    return render(traces, go.Layout(title=title))
+
+
+def format_interval(seconds):
+    """
+    :return: str, e.g. "10 seconds", "minute", "6 hours"
+    """
+    for unit, size in (('week', 7 * 24 * 3600), ('day', 24 * 3600), ('hour', 3600), ('minute', 60)):
+        if seconds % size == 0:
+            count = seconds // size
+            return unit if count == 1 else '{} {}s'.format(count, unit)
+    return '{} seconds'.format(seconds)
+
+
+def render(data, layout):
+    """
+    Render a plotly chart as an html div
+    :return: str, html div
+    """
+    figure = go.Figure(data=go.Data(data), layout=layout)
     config = dict(
         displayModeBar=False,  # hide floating options toolbar
         showLink=False  # hide "export to plotly" link
     )
-    div = opy.plot(figure, output_type='div', config=config)
+    # plotly.js is loaded by the template as a static file
+    div = opy.plot(figure, output_type='div', config=config, include_plotlyjs=False)
     return div
@@ -0,0 +1,239 @@
+"""
+Query count and query plan checks of the hot request paths.
+
+Each hot path is run against the current data (e.g. generated with the generate_synthetic_data command)
+in a transaction that is rolled back. Its SQL statements are captured on every database, and explained:
+full scans of large tables (sequential, or of a whole index) are reported as problems,
+as are query count increases over a baseline report.
+Reports are json, with stable ordering and without costs, so that reports of two commits can be diffed.
+"""
+from contextlib import ExitStack
+import re
+from types import SimpleNamespace
+
+from django.contrib.sessions.backends.db import SessionStore
+from django.db import connections, transaction
+from django.test import RequestFactory
+from django.urls import reverse
+
+from ltiprovider.mixins import get_or_create_lti_user
+from ltiprovider.models import LtiConsumer, LtiUser
+from ltiprovider.routers import set_shard
+from ltiprovider.validator import SignatureValidator
+
+from .models import Question
+from .plots import results_pie
+from .views import QuestionView, ResultsView, VoteView
+
+
+# statements that are explained
+EXPLAINED_RE = re.compile(r'^\s*(SELECT|UPDATE|DELETE)\b', re.IGNORECASE)
+
+# savepoint names differ between runs
+SAVEPOINT_RE = re.compile(r'"s\d+_x\d+"')
+
+# tables with fewer rows than this can be scanned
+DEFAULT_MIN_ROWS = 10000
+
+
+class QueryRecorder:
+    """
+    Records the SQL statements executed on a database connection, see connection.execute_wrapper
+    """
+
+    def __init__(self, alias, statements):
+        self.alias = alias
+        self.statements = statements
+
+    def __call__(self, execute, sql, params, many, context):
+        self.statements.append((self.alias, sql, params))
+        return execute(sql, params, many, context)
+
+
+def session_request(method, path, session_key, data=None):
+    """
+    :return: request to a lti view, with the session key in the url (as when cookies are blocked)
+    """
+    factory = RequestFactory()
+    path = '{}?session={}'.format(path, session_key)
+    request = factory.post(path, data or {}) if method == 'POST' else factory.get(path)
+    request.session = SessionStore()
+    return request
+
+
+def render(response):
+    if hasattr(response, 'render'):
+        response.render()
+    return response
+
+
+def create_session(consumer):
+    """
+    Create the lti session and user of the learner of the hot paths, on the current shard
+    :return: str, session key
+    """
+    session = SessionStore()
+    session.update({
+        'lti_message_type': 'basic-lti-launch-request',
+        'user_id': 'query-plan-check',
+        'oauth_consumer_key': consumer.consumer_key,
+    })
+    session.create()
+    LtiUser.objects.create(user_id='query-plan-check', lti_consumer=consumer)
+    return session.session_key
+
+
+def get_hot_paths(consumer, question):
+    """
+    Hot request paths, run in order by a learner who hasn't answered the question yet
+    :return: list of (name, function) tuples; functions take the lti session key
+    """
+    choice = question.choice_set.first()
+    launch_params = {
+        'user_id': 'query-plan-check',
+        'oauth_consumer_key': consumer.consumer_key,
+        'tool_consumer_instance_guid': '',
+    }
+    return [
+        ('validate_client_key', lambda session_key: SignatureValidator().validate_client_key(
+            consumer.consumer_key, None
+        )),
+        ('get_or_create_lti_user', lambda session_key: get_or_create_lti_user(
+            SimpleNamespace(launch_params=launch_params)
+        )),
+        ('QuestionView.get', lambda session_key: render(QuestionView.as_view()(
+            session_request('GET', reverse('poll:question', args=[question.pk]), session_key), pk=question.pk
+        ))),
+        ('VoteView.post', lambda session_key: render(VoteView.as_view()(
+            session_request('POST', reverse('poll:vote', args=[question.pk]), session_key, {'choice': choice.pk}),
+            pk=question.pk
+        ))),
+        ('ResultsView.get', lambda session_key: render(ResultsView.as_view()(
+            session_request('GET', reverse('poll:results', args=[question.pk]), session_key), pk=question.pk
+        ))),
+        ('results_pie', lambda session_key: results_pie(question)),
+    ]
+
+
+def explain(alias, sql, params):
+    """
+    :return: list of str, scans of the query plan (without costs), or None if not supported by the database
+    """
+    connection = connections[alias]
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+            plans = [cursor.fetchone()[0][0]['Plan']]
+            scans = []
+            while plans:
+                plan = plans.pop(0)
+                if 'Relation Name' in plan:
+                    scan = '{} on {}'.format(plan['Node Type'], plan['Relation Name'])
+                    if 'Index Name' in plan:
+                        scan += ' using {}'.format(plan['Index Name'])
+                        # index scans without an index condition read the whole index, e.g. for its order
+                        if 'Index Cond' not in plan:
+                            scan += ' (full)'
+                    scans.append(scan)
+                plans.extend(plan.get('Plans', []))
+            return scans
+        if connection.vendor == 'sqlite':
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return [row[-1] for row in cursor.fetchall()]
+    return None
+
+
+def get_scanned_tables(scans):
+    """
+    :return: list of str, tables read in full: by a sequential scan, or by a scan of a whole index
+    """
+    tables = []
+    for scan in scans:
+        # postgresql "Seq Scan on <table>" or "<Node Type> on <table> using <index> (full)",
+        # sqlite "SCAN [TABLE] <table> [USING [COVERING] INDEX <index>]" (lookups are "SEARCH")
+        match = (
+            re.match(r'^Seq Scan on (\w+)', scan) or
+            re.match(r'^[\w ]+ on (\w+) using \w+ \(full\)$', scan) or
+            re.match(r'^SCAN(?: TABLE)? (?!SUBQUERY\b|CONSTANT ROW)(\w+)', scan)
+        )
+        if match:
+            tables.append(match.group(1))
+    return tables
+
+
+def count_rows(alias, table):
+    """
+    :return: int, number of rows of a table (planner estimate on postgresql)
+    """
+    connection = connections[alias]
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE relname = %s', [table])
+            row = cursor.fetchone()
+            return row[0] if row else 0
+        cursor.execute('SELECT COUNT(*) FROM {}'.format(connection.ops.quote_name(table)))
+        return cursor.fetchone()[0]
+
+
+def check_query_plans(consumer=None, question=None, min_rows=DEFAULT_MIN_ROWS):
+    """
+    Run the hot paths in a rolled back transaction, capturing and explaining their statements
+    :param consumer: LtiConsumer model instance (default: the last one)
+    :param question: Question model instance with answer choices (default: the last one)
+    :param min_rows: int, size from which full scans of a table are problems
+    :return: dict, report {path name: {'queries': int, 'statements': [...], 'problems': [...]}}
+    """
+    consumer = consumer or LtiConsumer.objects.order_by('pk').last()
+    question = question or Question.objects.filter(choice__isnull=False).order_by('pk').last()
+    if consumer is None or question is None:
+        raise ValueError('A consumer and a question with answer choices are required')
+    set_shard(consumer.get_shard())
+
+    report = {}
+    row_counts = {}
+    with ExitStack() as transactions:
+        for connection in connections.all():
+            transactions.enter_context(transaction.atomic(using=connection.alias))
+        try:
+            session_key = create_session(consumer)
+            for name, path in get_hot_paths(consumer, question):
+                statements = []
+                with ExitStack() as wrappers:
+                    for connection in connections.all():
+                        wrappers.enter_context(connection.execute_wrapper(QueryRecorder(connection.alias, statements)))
+                    path(session_key)
+
+                entries = []
+                problems = []
+                for alias, sql, params in statements:
+                    entry = {'database': alias, 'sql': SAVEPOINT_RE.sub('"savepoint"', sql)}
+                    if EXPLAINED_RE.match(sql):
+                        scans = explain(alias, sql, params)
+                        entry['plan'] = scans
+                        for table in get_scanned_tables(scans or []):
+                            if (alias, table) not in row_counts:
+                                row_counts[(alias, table)] = count_rows(alias, table)
+                            if row_counts[(alias, table)] >= min_rows:
+                                problems.append('Full scan of {} ({} rows) on {}: {}'.format(
+                                    table, row_counts[(alias, table)], alias, entry['sql']
+                                ))
+                    entries.append(entry)
+                report[name] = {'queries': len(entries), 'statements': entries, 'problems': problems}
+        finally:
+            set_shard(None)
+            for connection in connections.all():
+                transaction.set_rollback(True, using=connection.alias)
+    return report
+
+
+def compare_reports(report, baseline):
+    """
+    :param report: dict, see check_query_plans
+    :param baseline: dict, report of an earlier run
+    :return: list of str, query count increases over the baseline
+    """
+    problems = []
+    for name, path in sorted(report.items()):
+        if name in baseline and path['queries'] > baseline[name]['queries']:
+            problems.append('{}: {} queries, {} in baseline'.format(name, path['queries'], baseline[name]['queries']))
+    return problems
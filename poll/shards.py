@@ -0,0 +1,281 @@
+"""
+Moving the learner and response data of an lti consumer to another shard database (see ltiprovider.routers).
+
+The move runs while the consumer is in use:
+1. the archived responses of the questions answered by the consumer's learners (see poll.archive) are restored,
+   so that they are moved and counted like the others (the questions are archived again by the next archival)
+2. users and responses are copied to the target shard in batches, in primary key order, until caught up
+   (users and responses are only ever created, so each pass copies the rows created since the last one)
+3. the consumer is switched to the target shard, so that new requests use it
+4. after a grace period for requests in progress on the source shard, the last rows are copied, and the rows
+   committed out of primary key order (behind the copy cursors) are found by comparing source and copied pks
+5. the copied rows are deleted from the source shard in batches,
+   and the counters of the affected questions are recomputed on both shards
+Answers to anonymous questions are not linked to learners: their counters and voter records are on the voter shard
+whatever the consumer's shard (see poll.voters), and aren't moved.
+"""
+import logging
+import time
+
+import numpy as np
+from django.db import transaction
+
+from ltiprovider.models import LtiUser
+from ltiprovider.routers import get_shard_databases, use_shard
+
+from .aggregates import rebuild_value_buckets
+from .archive import get_archived_consumers, rehydrate_questions
+from .models import Question, Response
+from .tallies import rebuild_tallies
+from .text import rebuild_term_counts
+from .timeline import rebuild_timeline
+
+
+log = logging.getLogger(__name__)
+
+# fields of the copied rows, other than the primary key and the lti user
+RESPONSE_FIELDS = ('question_id', 'choice_id', 'value', 'text', 'ballot', 'context_id', 'resource_link_id',
+                   'created_at')
+
+
+class ConsumerMove:
+    """
+    State of the move of a consumer's data from its shard to a target shard
+    """
+
+    def __init__(self, consumer, target, batch_size=1000):
+        """
+        :param consumer: LtiConsumer model instance
+        :param target: str, target shard database alias
+        :param batch_size: int, number of rows copied or deleted per batch
+        """
+        self.consumer = consumer
+        self.source = consumer.get_shard()
+        self.target = target
+        self.batch_size = batch_size
+        self.user_pks = {}  # {source user pk: target user pk}
+        self.last_user_pk = 0
+        self.last_response_pk = 0
+        self.response_pks = []  # numpy arrays of the source pks of the copied responses, one per batch
+        self.question_pks = set()
+
+    def rehydrate(self):
+        """
+        Restore the archived responses of the questions answered by the consumer's learners on the source shard
+        :return: int, number of questions restored
+        """
+        questions = [
+            question for question in Question.objects.filter(archived_at__isnull=False)
+            if self.consumer.pk in get_archived_consumers(question, self.source)
+        ]
+        rehydrate_questions(questions, get_shard_databases())
+        return len(questions)
+
+    def copy_users(self):
+        """
+        Copy the next batch of users to the target shard
+        :return: int, number of users copied
+        """
+        users = list(
+            LtiUser.objects.using(self.source)
+            .filter(lti_consumer_id=self.consumer.pk, pk__gt=self.last_user_pk)
+            .order_by('pk')[:self.batch_size]
+        )
+        if not users:
+            return 0
+        self.copy_user_rows(users)
+        self.last_user_pk = users[-1].pk
+        return len(users)
+
+    def copy_user_rows(self, users):
+        """
+        Copy users to the target shard, reusing users that already exist there
+        :param users: list of LtiUser model instances of the source shard
+        """
+        target_users = LtiUser.objects.using(self.target).filter(
+            lti_consumer_id=self.consumer.pk,
+            user_id__in=[user.user_id for user in users]
+        )
+        existing = {
+            (user_id, guid): pk
+            for pk, user_id, guid in target_users.values_list('pk', 'user_id', 'tool_consumer_instance_guid')
+        }
+        LtiUser.objects.using(self.target).bulk_create([
+            LtiUser(
+                user_id=user.user_id,
+                email=user.email,
+                lti_consumer_id=user.lti_consumer_id,
+                tool_consumer_instance_guid=user.tool_consumer_instance_guid,
+                last_launch=user.last_launch,
+            )
+            for user in users if (user.user_id, user.tool_consumer_instance_guid) not in existing
+        ])
+        # read back the target pks (bulk_create doesn't set them on every database backend)
+        existing = {
+            (user_id, guid): pk
+            for pk, user_id, guid in target_users.values_list('pk', 'user_id', 'tool_consumer_instance_guid')
+        }
+        for user in users:
+            self.user_pks[user.pk] = existing[(user.user_id, user.tool_consumer_instance_guid)]
+
+    def get_source_responses(self):
+        return Response.objects.using(self.source).filter(lti_user__lti_consumer_id=self.consumer.pk)
+
+    def copy_responses(self):
+        """
+        Copy the next batch of responses to the target shard
+        :return: int, number of responses copied
+        """
+        responses = list(
+            self.get_source_responses()
+            .filter(pk__gt=self.last_response_pk)
+            .order_by('pk')
+            .values_list('pk', 'lti_user_id', *RESPONSE_FIELDS)[:self.batch_size]
+        )
+        if not responses:
+            return 0
+        self.copy_response_rows(responses)
+        self.last_response_pk = responses[-1][0]
+        return len(responses)
+
+    def copy_response_rows(self, responses):
+        """
+        Copy responses to the target shard, after the users that made them
+        :param responses: list of (pk, lti user pk, *RESPONSE_FIELDS) tuples of the source shard
+        """
+        missing = {row[1] for row in responses} - set(self.user_pks)
+        if missing:
+            # users committed after users with higher pks, which copy_users has already passed
+            self.copy_user_rows(list(LtiUser.objects.using(self.source).filter(pk__in=missing)))
+        Response.objects.using(self.target).bulk_create([
+            Response(lti_user_id=self.user_pks[row[1]], **dict(zip(RESPONSE_FIELDS, row[2:])))
+            for row in responses
+        ])
+        self.response_pks.append(np.array([row[0] for row in responses], dtype=np.int64))
+        self.question_pks.update(row[2] for row in responses)
+
+    def get_copied_response_pks(self):
+        """
+        :return: sorted numpy int array of the source pks of the copied responses
+        """
+        if not self.response_pks:
+            return np.zeros(0, dtype=np.int64)
+        return np.sort(np.concatenate(self.response_pks))
+
+    def iter_pks(self, queryset):
+        """
+        :return: iterator of lists of at most batch_size pks of a queryset, in primary key order
+        """
+        last_pk = 0
+        while True:
+            pks = list(queryset.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:self.batch_size])
+            if not pks:
+                return
+            yield pks
+            last_pk = pks[-1]
+
+    def copy(self):
+        """
+        Copy all users and responses created since the last copy
+        :return: int, number of rows copied
+        """
+        copied = 0
+        while True:
+            count = self.copy_users() + self.copy_responses()
+            if not count:
+                return copied
+            copied += count
+
+    def reconcile(self):
+        """
+        Copy the rows of the source shard that haven't been copied yet.
+        Rows aren't committed in primary key order: a row committed after the copy of rows with higher pks
+        is behind the copy cursors, and is only found by comparing the source pks with the copied pks
+        :return: int, number of rows copied
+        """
+        copied = 0
+        users = LtiUser.objects.using(self.source).filter(lti_consumer_id=self.consumer.pk)
+        for pks in self.iter_pks(users):
+            missing = [pk for pk in pks if pk not in self.user_pks]
+            if missing:
+                self.copy_user_rows(list(users.filter(pk__in=missing)))
+                copied += len(missing)
+        copied_pks = self.get_copied_response_pks()
+        responses = self.get_source_responses()
+        for pks in self.iter_pks(responses):
+            missing = np.setdiff1d(pks, copied_pks).tolist()
+            if missing:
+                self.copy_response_rows(list(
+                    responses.filter(pk__in=missing).order_by('pk').values_list('pk', 'lti_user_id', *RESPONSE_FIELDS)
+                ))
+                copied += len(missing)
+        return copied
+
+    def switch(self):
+        """
+        Route new requests of the consumer to the target shard
+        """
+        self.consumer.shard = self.target
+        self.consumer.save(update_fields=['shard'])
+
+    def delete_source(self):
+        """
+        Delete the copied users and responses of the consumer from the source shard, in batches.
+        Rows that weren't copied (e.g. committed after the grace period) are kept, and logged
+        :return: int, number of rows deleted
+        """
+        deleted = 0
+        copied = (
+            (Response, self.get_copied_response_pks().tolist()),
+            (LtiUser, sorted(self.user_pks)),
+        )
+        for model, pks in copied:
+            for batch in range(0, len(pks), self.batch_size):
+                with transaction.atomic(using=self.source):
+                    count, _ = model.objects.using(self.source).filter(
+                        pk__in=pks[batch:batch + self.batch_size]
+                    ).delete()
+                deleted += count
+        remaining = (
+            self.get_source_responses().count() +
+            LtiUser.objects.using(self.source).filter(lti_consumer_id=self.consumer.pk).count()
+        )
+        if remaining:
+            log.warning('%s rows of consumer %s were not copied and remain on shard %s',
+                        remaining, self.consumer.pk, self.source)
+        return deleted
+
+    def rebuild_counters(self):
+        """
+        Recompute the counters of the questions answered by the consumer's learners on both shards
+        """
+        questions = list(Question.objects.filter(pk__in=self.question_pks))
+        for shard in (self.source, self.target):
+            with use_shard(shard):
+                rebuild_tallies(questions)
+                for question in questions:
+                    if question.has_value_answer():
+                        rebuild_value_buckets(question)
+                    elif question.question_type == Question.TEXT:
+                        rebuild_term_counts(question)
+                    rebuild_timeline(question)
+
+    def run(self, grace_period=5):
+        """
+        Move the consumer's data to the target shard
+        :param grace_period: float, seconds to wait after the switch for requests in progress on the source shard
+        """
+        log.info('Moving consumer %s from shard %s to %s', self.consumer.pk, self.source, self.target)
+        rehydrated = self.rehydrate()
+        if rehydrated:
+            log.info('Restored the archived responses of %s questions', rehydrated)
+        copied = self.copy()
+        log.info('Copied %s rows', copied)
+        self.switch()
+        time.sleep(grace_period)
+        copied = self.copy() + self.reconcile()
+        log.info('Switched to shard %s, copied %s more rows', self.target, copied)
+        deleted = self.delete_source()
+        log.info('Deleted %s rows from shard %s', deleted, self.source)
+        self.rebuild_counters()
+        log.info('Recomputed counters of %s questions', len(self.question_pks))
@@ -0,0 +1,25 @@
+from django.db.models import Q
+
+from ltiprovider.routers import get_shard_databases
+
+from .models import ChoicePair, Response, Tally, TermCount, TimelineBucket, ValueBucket, Voter, VoterFilter
+
+
+def delete_question_data(sender, instance, **kwargs):
+    """
+    Delete the responses and counter rows of a deleted question from every shard database
+    """
+    for shard in get_shard_databases():
+        for model in (Response, Tally, ChoicePair, ValueBucket, TermCount, TimelineBucket, Voter, VoterFilter):
+            model.objects.using(shard).filter(question_id=instance.pk).delete()
+
+
+def delete_choice_data(sender, instance, **kwargs):
+    """
+    Delete the responses and counter rows of a deleted answer choice from every shard database
+    """
+    for shard in get_shard_databases():
+        Response.objects.using(shard).filter(choice_id=instance.pk).delete()
+        Tally.objects.using(shard).filter(choice_id=instance.pk).delete()
+        TimelineBucket.objects.using(shard).filter(choice_id=instance.pk).delete()
+        ChoicePair.objects.using(shard).filter(Q(choice_a_id=instance.pk) | Q(choice_b_id=instance.pk)).delete()
@@ -0,0 +1,95 @@
+"""
+Mergeable quantile sketch for numeric answers.
+
+Implements the DDSketch algorithm (Masson, Rim & Lee, 2019): values are counted in logarithmically sized buckets,
+so that every quantile estimate is within a fixed relative error of the true value.
+Bucket counts only ever add up, so a sketch can be maintained incrementally as counter rows (see poll.aggregates),
+merged across scopes, and rebuilt from historical values in vectorized batches.
+"""
+from collections import Counter
+import math
+
+import numpy as np
+
+
+# relative accuracy of quantile estimates; bucket keys stored in the database depend on it
+RELATIVE_ACCURACY = 0.01
+
+# absolute values below this are counted as zero
+MIN_POSITIVE_VALUE = 1e-9
+
+
+class QuantileSketch:
+    """
+    DDSketch quantile sketch
+    Buckets are keyed by ceil(log_gamma(|value|)), with separate stores for positive and negative values
+    """
+
+    def __init__(self, relative_accuracy=RELATIVE_ACCURACY):
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.positive = Counter()
+        self.negative = Counter()
+        self.zero_count = 0
+
+    @property
+    def count(self):
+        return sum(self.positive.values()) + sum(self.negative.values()) + self.zero_count
+
+    def key(self, value):
+        """
+        :param value: float, absolute value greater than MIN_POSITIVE_VALUE
+        :return: int, bucket key
+        """
+        return int(math.ceil(math.log(value) / self.log_gamma))
+
+    def keys(self, values):
+        """
+        Vectorized key()
+        :param values: numpy array of absolute values greater than MIN_POSITIVE_VALUE
+        :return: numpy int64 array of bucket keys
+        """
+        return np.ceil(np.log(values) / self.log_gamma).astype(np.int64)
+
+    def bucket_value(self, key):
+        """
+        :return: float, representative value of a bucket (within relative accuracy of all values in it)
+        """
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def add(self, value, count=1):
+        if value > MIN_POSITIVE_VALUE:
+            self.positive[self.key(value)] += count
+        elif value < -MIN_POSITIVE_VALUE:
+            self.negative[self.key(-value)] += count
+        else:
+            self.zero_count += count
+
+    def merge(self, other):
+        self.positive.update(other.positive)
+        self.negative.update(other.negative)
+        self.zero_count += other.zero_count
+
+    def quantile(self, q):
+        """
+        :param q: float, quantile between 0 and 1
+        :return: float, estimated value at the quantile, or None if the sketch is empty
+        """
+        count = self.count
+        if not count:
+            return None
+        rank = q * (count - 1)
+        seen = 0
+        # negative values from the most negative (largest key) up
+        for key in sorted(self.negative, reverse=True):
+            seen += self.negative[key]
+            if seen > rank:
+                return -self.bucket_value(key)
+        seen += self.zero_count
+        if seen > rank:
+            return 0.0
+        for key in sorted(self.positive):
+            seen += self.positive[key]
+            if seen > rank:
+                return self.bucket_value(key)
+        return self.bucket_value(max(self.positive))
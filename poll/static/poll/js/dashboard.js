@@ -0,0 +1,50 @@
+// course dashboard: refresh the results of the questions whose version changed (see poll.views.DashboardDataView)
+(function () {
+    var dashboard = document.getElementById('dashboard');
+    var refresh = parseFloat(dashboard.getAttribute('data-refresh'));
+    if (!refresh) {
+        return;
+    }
+
+    function getVersions() {
+        var questions = dashboard.querySelectorAll('.dashboard_question');
+        var versions = [];
+        for (var i = 0; i < questions.length; i++) {
+            versions.push(questions[i].getAttribute('data-id') + ':' + questions[i].getAttribute('data-version'));
+        }
+        return versions.join(',');
+    }
+
+    function update(result) {
+        var question = dashboard.querySelector('.dashboard_question[data-id="' + result.id + '"]');
+        if (!question) {
+            return;
+        }
+        question.setAttribute('data-version', result.version);
+        question.querySelector('.dashboard_total').textContent = result.total + ' votes';
+        var rows = question.querySelectorAll('.dashboard_choices tr');
+        for (var i = 0; i < rows.length && i < result.choices.length; i++) {
+            var choice = result.choices[i];
+            rows[i].querySelector('.dashboard_bar span').style.width = choice.percent + '%';
+            rows[i].querySelector('.dashboard_votes').textContent = choice.votes + ' (' + choice.percent + '%)';
+        }
+    }
+
+    function poll() {
+        var url = dashboard.getAttribute('data-url');
+        var request = new XMLHttpRequest();
+        request.open('GET', url + (url.indexOf('?') < 0 ? '?' : '&') + 'since=' + encodeURIComponent(getVersions()));
+        request.onload = function () {
+            if (request.status === 200) {
+                JSON.parse(request.responseText).questions.forEach(update);
+            }
+            window.setTimeout(poll, refresh * 1000);
+        };
+        request.onerror = function () {
+            window.setTimeout(poll, refresh * 1000);
+        };
+        request.send();
+    }
+
+    window.setTimeout(poll, refresh * 1000);
+})();
@@ -0,0 +1,170 @@
+"""
+Synthetic consumers, learners and responses, for checking query plans and query counts at production scale
+(see poll.queryplans).
+
+Rows are generated with numpy in batches and inserted with COPY on postgresql (bulk_create on other databases),
+so that millions of responses can be generated in minutes.
+"""
+import io
+
+import numpy as np
+from django.db import connections, router, transaction
+
+from ltiprovider.models import LtiConsumer, LtiUser
+from ltiprovider.routers import get_shard_databases, use_shard
+
+from .models import Choice, Question, Response
+from .tallies import rebuild_tallies
+
+
+# prefix of the names and ids of generated rows
+PREFIX = 'synthetic'
+
+
+def copy_value(value):
+    """
+    :return: str, value in postgresql COPY text format
+    """
+    if value is None:
+        return '\\N'
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def insert_rows(model, rows):
+    """
+    Insert rows into the table of a model, on the database the model is routed to
+    :param model: model class
+    :param rows: list of dicts, {field name: value}; fields not given get their default value
+    """
+    database = router.db_for_write(model)
+    connection = connections[database]
+    fields = [field for field in model._meta.concrete_fields if not field.primary_key]
+    if connection.vendor != 'postgresql':
+        model.objects.using(database).bulk_create([model(**row) for row in rows])
+        return
+
+    defaults = {field.attname: field.get_default() for field in fields}
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write('\t'.join(
+            copy_value(row.get(field.attname, row.get(field.name, defaults[field.attname]))) for field in fields
+        ))
+        buffer.write('\n')
+    buffer.seek(0)
+    columns = ', '.join(connection.ops.quote_name(field.column) for field in fields)
+    with connection.cursor() as cursor:
+        cursor.copy_expert(
+            'COPY {} ({}) FROM STDIN'.format(connection.ops.quote_name(model._meta.db_table), columns), buffer
+        )
+
+
+def analyze(models):
+    """
+    Update the planner statistics of the tables of models, on postgresql
+    """
+    for model in models:
+        connection = connections[router.db_for_write(model)]
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE {}'.format(connection.ops.quote_name(model._meta.db_table)))
+
+
+def create_questions(count, choice_count):
+    """
+    :return: list of Question model instances, each with choice_count answer choices
+    """
+    questions = [
+        Question.objects.create(question_text='{} question {}'.format(PREFIX, number))
+        for number in range(count)
+    ]
+    Choice.objects.bulk_create([
+        Choice(question=question, choice_text='{} choice {}'.format(PREFIX, number))
+        for question in questions for number in range(choice_count)
+    ])
+    return questions
+
+
+def create_users(consumer, count, batch_size):
+    """
+    :return: numpy array of the pks of the created users, in creation order
+    """
+    for start in range(0, count, batch_size):
+        insert_rows(LtiUser, [
+            {'user_id': '{}-{}-{}'.format(PREFIX, consumer.pk, number), 'lti_consumer_id': consumer.pk}
+            for number in range(start, min(start + batch_size, count))
+        ])
+    users = LtiUser.objects.filter(lti_consumer=consumer, user_id__startswith=PREFIX).order_by('pk')
+    return np.fromiter(users.values_list('pk', flat=True).iterator(), dtype=np.int64)
+
+
+def create_responses(consumer, user_pks, questions, answer_rate, context_count, batch_size, random):
+    """
+    Answer each question with a random answer choice, for a random answer_rate fraction of the users.
+    Users are spread over context_count courses, each question having one resource link per course.
+    :return: int, number of responses created
+    """
+    choice_pks = {
+        question.pk: np.array(sorted(choice.pk for choice in question.choice_set.all()), dtype=np.int64)
+        for question in questions
+    }
+    created = 0
+    for start in range(0, len(user_pks), batch_size):
+        batch = user_pks[start:start + batch_size]
+        contexts = np.arange(start, start + len(batch)) % context_count
+        rows = []
+        for question in questions:
+            answered = random.random_sample(len(batch)) < answer_rate
+            choices = choice_pks[question.pk][random.randint(0, len(choice_pks[question.pk]), size=len(batch))]
+            for user_pk, choice_pk, context in zip(batch[answered], choices[answered], contexts[answered]):
+                rows.append({
+                    'lti_user_id': int(user_pk),
+                    'question_id': question.pk,
+                    'choice_id': int(choice_pk),
+                    'context_id': '{}-{}-{}'.format(PREFIX, consumer.pk, context),
+                    'resource_link_id': '{}-{}-{}-{}'.format(PREFIX, consumer.pk, context, question.pk),
+                })
+        insert_rows(Response, rows)
+        created += len(rows)
+    return created
+
+
+def generate(consumer_count=2, user_count=100000, question_count=20, choice_count=4, answer_rate=0.5,
+             context_count=100, batch_size=10000, seed=0, log=None):
+    """
+    Generate synthetic questions, and consumers spread over the shard databases with their users and responses.
+    Tallies of the generated questions are computed from the generated responses.
+    :param user_count: int, number of users per consumer
+    :param answer_rate: float, fraction of users answering each question
+    :param log: function called with progress messages
+    :return: list of created LtiConsumer model instances
+    """
+    log = log or (lambda message: None)
+    random = np.random.RandomState(seed)
+    shards = get_shard_databases()
+    questions = create_questions(question_count, choice_count)
+    log('Created {} questions'.format(len(questions)))
+
+    consumers = []
+    first = LtiConsumer.objects.count()
+    for number in range(first, first + consumer_count):
+        consumer = LtiConsumer.objects.create(
+            consumer_name='{} consumer {}'.format(PREFIX, number),
+            shard=shards[number % len(shards)],
+        )
+        consumers.append(consumer)
+        with use_shard(consumer.get_shard()), transaction.atomic(using=consumer.get_shard()):
+            user_pks = create_users(consumer, user_count, batch_size)
+            count = create_responses(
+                consumer, user_pks, questions, answer_rate, context_count, batch_size, random
+            )
+        log('Created consumer {} on shard {}: {} users, {} responses'.format(
+            consumer.consumer_key, consumer.get_shard(), len(user_pks), count
+        ))
+
+    for shard in shards:
+        with use_shard(shard):
+            rebuild_tallies(questions)
+            analyze([LtiUser, Response])
+    analyze([LtiConsumer, Question, Choice])
+    log('Computed tallies')
+    return consumers
@@ -0,0 +1,148 @@
+from collections import Counter
+
+from django.db import router, transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from ltiprovider.routers import use_shard
+
+from .aggregates import record_value
+from .ballots import count_ballots, encode_ballot, record_ballot
+from .counters import get_counter_shard, get_scope_databases, get_scopes, increment, lock_counters
+from .models import ChoicePair, Response, Tally
+from .text import record_text
+from .timeline import get_counted_choices, record_response_time
+from .voters import get_voted_questions, mark_voted
+
+
+def increment_tally(question_id, choice_id, scope, scope_id, amount=1):
+    """
+    Add votes to the tally of an answer choice, creating the tally if it doesn't exist yet
+    Must be called in a transaction
+    """
+    increment(Tally, 'votes', amount, question_id=question_id, choice_id=choice_id, scope=scope, scope_id=scope_id)
+
+
+def create_response(lti_user, question, choice=None, value=None, text='', selection=None, ranking=None,
+                    context_id='', resource_link_id=''):
+    """
+    Create a response and count its answer in the question tallies (answer choice, selected or ranked choices),
+    value buckets (numeric value) or term counts (free text), and in the question timeline, in a single transaction.
+    Answers to anonymous questions are only counted, once per learner, on the voter shard (see poll.voters)
+    :param selection: iterable of Choice model instances selected in a multiple choice answer
+    :param ranking: list of Choice model instances in order of preference, of a ranked choice answer
+    :return: Response model instance, or None for anonymous questions
+    """
+    choice_pks = None
+    if selection is not None:
+        choice_pks = sorted(choice.pk for choice in selection)
+    elif ranking is not None:
+        choice_pks = [choice.pk for choice in ranking]
+
+    shard = get_counter_shard(question)
+    with use_shard(shard), transaction.atomic(using=shard):
+        if question.anonymous:
+            if not mark_voted(question, lti_user):
+                return None
+            response = None
+            created_at = timezone.now()
+        else:
+            response = Response.objects.create(
+                lti_user=lti_user,
+                question=question,
+                choice=choice,
+                value=value,
+                text=text,
+                ballot=encode_ballot(choice_pks) if choice_pks is not None else None,
+                context_id=context_id,
+                resource_link_id=resource_link_id,
+            )
+            created_at = response.created_at
+        if choice is not None:
+            for scope, scope_id in get_scopes(context_id, resource_link_id):
+                increment_tally(question.pk, choice.pk, scope, scope_id)
+        if choice_pks:
+            record_ballot(question, choice_pks, context_id, resource_link_id)
+        if value is not None:
+            record_value(question, value, context_id, resource_link_id)
+        if text:
+            record_text(question, text, context_id, resource_link_id)
+        counted_pks = get_counted_choices(question, choice.pk if choice is not None else None, choice_pks)
+        record_response_time(question, counted_pks, created_at, context_id, resource_link_id)
+    return response
+
+
+def get_vote_counts(questions, scope=Tally.GLOBAL, scope_id=''):
+    """
+    Vote counts for each answer choice of a group of questions, read from the tallies of a scope
+    :param questions: iterable of Question model instances
+    :param scope: str, one of Tally.SCOPE_CHOICES
+    :param scope_id: str, context id or resource link id for non-global scopes
+    :return: dict, {choice pk: number of votes}
+    """
+    questions = list(questions)
+    votes = Counter()
+    for database in get_scope_databases(scope, questions):
+        tallies = Tally.objects.using(database).filter(question__in=questions, scope=scope, scope_id=scope_id)
+        votes.update(dict(tallies.values_list('choice', 'votes')))
+    return dict(votes)
+
+
+def get_learner_responses(lti_user, questions):
+    """
+    Responses of a learner to a group of questions, in a single query (and one for their answer choices),
+    and the anonymous questions they answered (see poll.voters.get_voted_questions)
+    :param lti_user: LtiUser model instance
+    :param questions: iterable of Question model instances
+    :return: dict, {question pk: Response model instance, or None for answered anonymous questions}
+    """
+    questions = list(questions)
+    responses = Response.objects.filter(lti_user=lti_user, question__in=questions).prefetch_related('choice')
+    answered = {response.question_id: response for response in responses}
+    answered.update(dict.fromkeys(get_voted_questions(lti_user, questions)))
+    return answered
+
+
+def rebuild_tallies(questions):
+    """
+    Recompute the tallies of a group of questions from their responses, with one grouped query per scope.
+    Tallies and co-occurrence counts of multiple choice and ranked choice ballots are recounted from the ballots.
+    The tallies are locked while the responses are counted, so that concurrent answers aren't lost
+    :param questions: queryset of Question model instances
+    :return: int, number of tallies created
+    """
+    # questions are on the catalog database, so they are passed to queries on the shard as a list
+    questions = [question for question in questions if question.can_rebuild_counters()]
+    groupings = (
+        (Tally.GLOBAL, None),
+        (Tally.CONTEXT, 'context_id'),
+        (Tally.RESOURCE_LINK, 'resource_link_id'),
+    )
+    with transaction.atomic(using=router.db_for_write(Tally)):
+        lock_counters(Tally, question__in=questions)
+        lock_counters(ChoicePair, question__in=questions)
+        tallies = []
+        for scope, field in groupings:
+            fields = ['question', 'choice'] + ([field] if field else [])
+            counts = (
+                Response.objects
+                .filter(question__in=questions, choice__isnull=False)
+                .values_list(*fields)
+                .annotate(votes=Count('id'))
+                .order_by()
+            )
+            for row in counts:
+                scope_id = row[2] if field else ''
+                if field and not scope_id:
+                    continue
+                tallies.append(
+                    Tally(question_id=row[0], choice_id=row[1], scope=scope, scope_id=scope_id, votes=row[-1])
+                )
+        ballot_tallies, pairs = count_ballots(questions)
+        tallies.extend(ballot_tallies)
+
+        Tally.objects.filter(question__in=questions).delete()
+        Tally.objects.bulk_create(tallies, batch_size=500)
+        ChoicePair.objects.filter(question__in=questions).delete()
+        ChoicePair.objects.bulk_create(pairs, batch_size=500)
+    return len(tallies)
@@ -1,3 +1,867 @@
+from contextlib import ExitStack
+from datetime import datetime, timezone
+import shutil
+import tempfile
+from unittest import mock
+
+import numpy as np
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, connections, transaction
 from django.test import TestCase
+from django.urls import reverse
+
+from ltiprovider.models import LtiConsumer, LtiUser
+from ltiprovider.routers import use_shard
+
+from .admin import ResponseAdmin
+from .aggregates import get_value_summary, rebuild_value_buckets
+from .archive import archive_questions, get_archived_consumers
+from .ballots import decode_ballots, encode_ballot, instant_runoff, load_ballot_matrix
+from .dashboard import get_course_versions
+from .forms import QuestionForm
+from .models import (
+    Choice, PollSet, PollSetQuestion, Question, Response, Tally, TermCount, TimelineBucket, ValueBucket, Voter
+)
+from .queryplans import (
+    QueryRecorder, check_query_plans, create_session, explain, get_hot_paths, get_scanned_tables
+)
+from .shards import ConsumerMove
+from .sketches import RELATIVE_ACCURACY, QuantileSketch
+from .tallies import create_response, get_vote_counts, rebuild_tallies
+from .text import get_top_terms, rebuild_term_counts, tokenize
+from .timeline import NO_CHOICE, get_counted_choices, get_timeline, record_response_time
+
+
+def start_lti_session(client, consumer, **params):
+    """
+    Store the lti session of a launch in the session cookie of a test client
+    :param params: launch params, in addition to those of a learner of the consumer
+    """
+    session = SessionStore()
+    session.update(dict({
+        'lti_message_type': 'basic-lti-launch-request',
+        'user_id': 'learner',
+        'oauth_consumer_key': consumer.consumer_key,
+    }, **params))
+    session.create()
+    client.cookies[settings.SESSION_COOKIE_NAME] = session.session_key
+
+
+class ConsumerMoveTest(TestCase):
+    """
+    Moves of a consumer's data between the shard1 and shard2 databases of the test settings,
+    while learners keep answering
+    """
+    multi_db = True
+
+    def setUp(self):
+        self.consumer = LtiConsumer.objects.create(consumer_name='consumer', shard='shard1')
+        self.question = Question.objects.create(question_text='Question?')
+        self.choice_a = Choice.objects.create(question=self.question, choice_text='A')
+        self.choice_b = Choice.objects.create(question=self.question, choice_text='B')
+
+    def answer(self, user_id, choice):
+        """
+        Answer the question as a learner, on the current shard of the consumer
+        """
+        self.consumer.refresh_from_db()
+        with use_shard(self.consumer.get_shard()):
+            lti_user, _ = LtiUser.objects.get_or_create(user_id=user_id, lti_consumer=self.consumer)
+            return create_response(lti_user, self.question, choice=choice, context_id='course')
+
+    def create_late_response(self, pk, lti_user, choice):
+        """
+        Response of a request that committed after responses with higher pks, e.g. a slow request
+        """
+        return Response.objects.using('shard1').create(
+            pk=pk, lti_user=lti_user, question=self.question, choice=choice, context_id='course'
+        )
+
+    def get_course_votes(self, shard):
+        with use_shard(shard):
+            return get_vote_counts([self.question], Tally.CONTEXT, 'course')
+
+    def test_move(self):
+        for user_id, choice in (('a', self.choice_a), ('b', self.choice_a), ('c', self.choice_b)):
+            self.answer(user_id, choice)
+        last_launch = datetime(2026, 1, 1, tzinfo=timezone.utc)
+        LtiUser.objects.using('shard1').filter(user_id='a').update(last_launch=last_launch)
+
+        ConsumerMove(self.consumer, 'shard2', batch_size=2).run(grace_period=0)
+
+        self.consumer.refresh_from_db()
+        self.assertEqual(self.consumer.shard, 'shard2')
+        self.assertEqual(LtiUser.objects.using('shard1').count(), 0)
+        self.assertEqual(Response.objects.using('shard1').count(), 0)
+        self.assertEqual(
+            sorted(LtiUser.objects.using('shard2').values_list('user_id', flat=True)), ['a', 'b', 'c']
+        )
+        self.assertEqual(Response.objects.using('shard2').count(), 3)
+        # inactive learners are still pruned after the move
+        self.assertEqual(LtiUser.objects.using('shard2').get(user_id='a').last_launch, last_launch)
+        self.assertEqual(get_vote_counts([self.question]), {self.choice_a.pk: 2, self.choice_b.pk: 1})
+        self.assertEqual(self.get_course_votes('shard2'), {self.choice_a.pk: 2, self.choice_b.pk: 1})
+        self.assertEqual(self.get_course_votes('shard1'), {})
+
+    def test_move_with_concurrent_inserts(self):
+        with use_shard('shard1'):
+            users = [LtiUser.objects.create(pk=pk, user_id=str(pk), lti_consumer=self.consumer) for pk in (10, 11, 12)]
+            for pk, user in zip((10, 11, 12), users):
+                self.create_late_response(pk, user, self.choice_a)
+        move = ConsumerMove(self.consumer, 'shard2', batch_size=2)
+        move.copy()
+
+        # committed after the copy cursors passed their pks: a user, with a response after the response cursor
+        with use_shard('shard1'):
+            late_user = LtiUser.objects.create(pk=5, user_id='late', lti_consumer=self.consumer)
+        self.create_late_response(20, late_user, self.choice_b)
+
+        def requests_in_progress(seconds):
+            # a request on the source shard commits during the grace period, behind the response cursor,
+            # while new requests answer on the target shard
+            self.create_late_response(6, users[0], self.choice_b)
+            self.answer('new', self.choice_b)
+
+        with mock.patch('poll.shards.time.sleep', side_effect=requests_in_progress):
+            move.run(grace_period=5)
+
+        self.assertEqual(LtiUser.objects.using('shard1').count(), 0)
+        self.assertEqual(Response.objects.using('shard1').count(), 0)
+        self.assertEqual(
+            sorted(LtiUser.objects.using('shard2').values_list('user_id', flat=True)),
+            ['10', '11', '12', 'late', 'new']
+        )
+        self.assertEqual(Response.objects.using('shard2').count(), 6)
+        self.assertEqual(Response.objects.using('shard2').filter(lti_user__user_id='10').count(), 2)
+        self.assertEqual(get_vote_counts([self.question]), {self.choice_a.pk: 3, self.choice_b.pk: 3})
+        self.assertEqual(self.get_course_votes('shard2'), {self.choice_a.pk: 3, self.choice_b.pk: 3})
+
+    def test_uncopied_rows_are_kept(self):
+        self.answer('a', self.choice_a)
+        move = ConsumerMove(self.consumer, 'shard2')
+        move.copy()
+        move.switch()
+        with use_shard('shard1'):
+            user = LtiUser.objects.create(user_id='late', lti_consumer=self.consumer)
+        self.create_late_response(None, user, self.choice_a)
+
+        self.assertEqual(move.delete_source(), 2)
+        self.assertEqual(list(LtiUser.objects.using('shard1').values_list('user_id', flat=True)), ['late'])
+        self.assertEqual(Response.objects.using('shard1').count(), 1)
+
+    def test_archived_responses_are_moved(self):
+        for user_id, choice in (('a', self.choice_a), ('b', self.choice_b)):
+            self.answer(user_id, choice)
+        archive_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, archive_dir)
+        with self.settings(POLL_ARCHIVE_DIR=archive_dir):
+            archive_questions([self.question], ['shard1', 'shard2'], pause=0)
+            self.assertEqual(get_archived_consumers(self.question, 'shard1'), {self.consumer.pk})
+
+            ConsumerMove(self.consumer, 'shard2').run(grace_period=0)
+
+            self.question.refresh_from_db()
+            self.assertIsNone(self.question.archived_at)
+            self.assertEqual(get_archived_consumers(self.question, 'shard1'), set())
+        self.assertEqual(Response.objects.using('shard1').count(), 0)
+        self.assertEqual(Response.objects.using('shard2').count(), 2)
+        self.assertEqual(self.get_course_votes('shard2'), {self.choice_a.pk: 1, self.choice_b.pk: 1})
+        self.assertEqual(self.get_course_votes('shard1'), {})
+
+    def test_anonymous_answers_are_kept(self):
+        self.question.anonymous = True
+        self.question.save()
+        self.answer('a', self.choice_a)
+
+        ConsumerMove(self.consumer, 'shard2').run(grace_period=0)
+        # the learner has already voted
+        self.answer('a', self.choice_b)
+        self.answer('b', self.choice_b)
+
+        self.assertEqual(Voter.objects.using('shard1').count(), 2)
+        self.assertEqual(Voter.objects.using('shard2').count(), 0)
+        self.assertEqual(get_vote_counts([self.question]), {self.choice_a.pk: 1, self.choice_b.pk: 1})
+        self.assertEqual(self.get_course_votes('shard2'), {self.choice_a.pk: 1, self.choice_b.pk: 1})
+        with use_shard('shard2'):
+            self.assertEqual(list(get_course_versions('course')), [self.question.pk])
+
+
+class QuestionTest(TestCase):
+    """
+    Changes to how answers to a question are recorded, once it has answers
+    """
+    multi_db = True
+
+    def setUp(self):
+        self.consumer = LtiConsumer.objects.create(consumer_name='consumer', shard='shard2')
+        self.question = Question.objects.create(question_text='Question?', anonymous=True)
+        self.choice = Choice.objects.create(question=self.question, choice_text='A')
+
+    def answer(self):
+        with use_shard('shard2'):
+            lti_user = LtiUser.objects.create(user_id='a', lti_consumer=self.consumer)
+            create_response(lti_user, self.question, choice=self.choice)
+
+    def test_changes_without_answers(self):
+        self.question.expected_voters = 1000
+        self.question.full_clean()
+        self.question.anonymous, self.question.expected_voters = False, None
+        self.question.full_clean()
+
+    def test_changes_with_answers(self):
+        self.answer()
+        self.question.question_text = 'Other question?'
+        self.question.full_clean()
+        for anonymous, expected_voters in ((True, 1000), (False, None)):
+            self.question.anonymous, self.question.expected_voters = anonymous, expected_voters
+            with self.subTest(anonymous=anonymous, expected_voters=expected_voters):
+                with self.assertRaises(ValidationError):
+                    self.question.full_clean()
+
+
+class RankedChoiceTest(TestCase):
+    """
+    Instant-runoff results of ranked choice ballots (see poll.ballots)
+    """
+    multi_db = True
+
+    def runoff(self, *ballots, choice_count=3):
+        matrix = np.array([ballot + (-1,) * (choice_count - len(ballot)) for ballot in ballots], dtype=np.int64)
+        rounds, winner = instant_runoff(matrix.reshape(len(ballots), choice_count), choice_count)
+        return [votes.tolist() for votes in rounds], winner
+
+    def test_majority_in_first_round(self):
+        self.assertEqual(self.runoff((0, 1), (0,), (1, 0)), ([[2, 1, 0]], 0))
+
+    def test_elimination_tie(self):
+        # choices 1 and 2 tie for fewest votes: the lowest column is eliminated
+        self.assertEqual(self.runoff((0,), (0,), (1, 0), (2, 0)), ([[2, 1, 1], [3, 0, 1]], 0))
+
+    def test_exhausted_ballots(self):
+        # the ballot ranking only choice 1 stops counting once it is eliminated
+        self.assertEqual(
+            self.runoff((0,), (0,), (1,), (2,), (2,)),
+            ([[2, 1, 2], [2, 0, 2], [0, 0, 2]], 2)
+        )
+
+    def test_no_ballots(self):
+        self.assertEqual(self.runoff(), ([[0, 0, 0]], None))
+
+    def test_decode_ballots(self):
+        pks, filled = decode_ballots([encode_ballot([3, 1]), b'', encode_ballot([2]) + b'\x01\x00'])
+        self.assertEqual(pks.tolist(), [[3, 1], [0, 0], [2, 0]])
+        self.assertEqual(filled.tolist(), [[True, True], [False, False], [True, False]])
+
+    def test_load_ballot_matrix(self):
+        question = Question.objects.create(question_text='Rank?', question_type=Question.RANKED)
+        choices = [Choice.objects.create(question=question, choice_text=text) for text in 'ABC']
+        consumer = LtiConsumer.objects.create(consumer_name='consumer', shard='shard1')
+        with use_shard('shard1'):
+            lti_user = LtiUser.objects.create(user_id='a', lti_consumer=consumer)
+            for ranking in ([choices[2], choices[0]], [choices[1]], [choices[0], choices[1], choices[2]]):
+                create_response(lti_user, question, ranking=ranking)
+            # a choice deleted after it was ranked
+            Response.objects.create(
+                lti_user=lti_user, question=question, ballot=encode_ballot([999, choices[1].pk])
+            )
+            matrix = load_ballot_matrix(question, [choice.pk for choice in choices], chunk_size=2)
+        self.assertEqual(matrix.tolist(), [[2, 0, -1], [1, -1, -1], [0, 1, 2], [1, -1, -1]])
+
+    def test_form_without_choices(self):
+        question = Question.objects.create(question_text='Rank?', question_type=Question.RANKED)
+        form = QuestionForm(question, {})
+        self.assertFalse(form.is_valid())
+        self.assertEqual(list(form.fields), ['rank_1'])
+
+
+class QuantileSketchTest(TestCase):
+    """
+    Quantile estimates of the DDSketch quantile sketch (see poll.sketches)
+    """
+
+    def get_sketch(self, values):
+        sketch = QuantileSketch()
+        for value in values:
+            sketch.add(value)
+        return sketch
+
+    def test_relative_error(self):
+        values = np.random.RandomState(0).lognormal(0, 2, 10000) * np.repeat([-1, 1], [2000, 8000])
+        values[:100] = 0
+        sketch = self.get_sketch(values)
+        self.assertEqual(sketch.count, len(values))
+        values.sort()
+        for q in (0, 0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 0.99, 1):
+            with self.subTest(q=q):
+                expected = values[int(q * (len(values) - 1))]
+                self.assertLessEqual(abs(sketch.quantile(q) - expected), RELATIVE_ACCURACY * abs(expected) + 1e-12)
+
+    def test_keys(self):
+        values = np.array([1e-6, 0.5, 1, 1.5, 1e6])
+        self.assertEqual(QuantileSketch().keys(values).tolist(), [QuantileSketch().key(value) for value in values])
+
+    def test_merge(self):
+        values = np.random.RandomState(1).normal(10, 5, 1000)
+        sketch = self.get_sketch(values[:300])
+        sketch.merge(self.get_sketch(values[300:]))
+        expected = self.get_sketch(values)
+        self.assertEqual(sketch.count, 1000)
+        self.assertEqual((sketch.positive, sketch.negative, sketch.zero_count),
+                         (expected.positive, expected.negative, expected.zero_count))
+        for q in (0, 0.25, 0.5, 0.75, 1):
+            self.assertEqual(sketch.quantile(q), expected.quantile(q))
+
+    def test_empty(self):
+        sketch = QuantileSketch()
+        self.assertEqual(sketch.count, 0)
+        self.assertIsNone(sketch.quantile(0.5))
+        sketch.merge(QuantileSketch())
+        self.assertIsNone(sketch.quantile(0.5))
+
+    def test_single_value(self):
+        for value in (-3.5, 0, 1e-12, 42):
+            sketch = self.get_sketch([value])
+            for q in (0, 0.5, 1):
+                with self.subTest(value=value, q=q):
+                    self.assertAlmostEqual(sketch.quantile(q), value, delta=RELATIVE_ACCURACY * abs(value) + 1e-9)
+
+
+class ValueSummaryTest(TestCase):
+    """
+    Histograms and quantiles of numeric answers, counted into value buckets (see poll.aggregates)
+    """
+    multi_db = True
+
+    def setUp(self):
+        consumer = LtiConsumer.objects.create(consumer_name='consumer', shard='shard1')
+        with use_shard('shard1'):
+            self.lti_user = LtiUser.objects.create(user_id='learner', lti_consumer=consumer)
+        self.question = Question.objects.create(
+            question_text='Value?', question_type=Question.NUMERIC, min_value=0, max_value=10, bin_count=5
+        )
+
+    def answer(self, *values, context_id='course'):
+        with use_shard('shard1'):
+            for value in values:
+                create_response(self.lti_user, self.question, value=value, context_id=context_id)
+
+    def test_summary(self):
+        # out of range values are counted in the end bins
+        self.answer(-1, 0, 1, 2.5, 4, 9.5, 10, context_id='course')
+        self.answer(5, 12, context_id='other-course')
+        summary = get_value_summary(self.question)
+        self.assertEqual(summary['count'], 9)
+        self.assertEqual(summary['histogram'], [3, 1, 2, 0, 3])
+        self.assertEqual(summary['bin_edges'], [0, 2, 4, 6, 8, 10])
+        for key, expected in (('median', 4), ('q1', 1), ('q3', 9.5)):
+            self.assertAlmostEqual(summary[key], expected, delta=RELATIVE_ACCURACY * expected)
+        with use_shard('shard1'):
+            summary = get_value_summary(self.question, Tally.CONTEXT, 'other-course')
+        self.assertEqual((summary['count'], summary['histogram']), (2, [0, 0, 1, 0, 1]))
+
+    def test_empty(self):
+        summary = get_value_summary(self.question)
+        self.assertEqual(summary['count'], 0)
+        self.assertEqual(summary['histogram'], [0] * 5)
+        self.assertEqual((summary['median'], summary['q1'], summary['q3']), (None, None, None))
+
+    def test_single_value(self):
+        self.answer(3)
+        summary = get_value_summary(self.question)
+        self.assertEqual((summary['count'], summary['histogram']), (1, [0, 1, 0, 0, 0]))
+        for key in ('median', 'q1', 'q3'):
+            self.assertAlmostEqual(summary[key], 3, delta=RELATIVE_ACCURACY * 3)
+
+    def test_rebuild(self):
+        self.answer(-2, 0, 0.5, 3, 7, context_id='course')
+        self.answer(3, 11, context_id='')
+        with use_shard('shard1'):
+            buckets = ValueBucket.objects.filter(question=self.question).values_list(
+                'scope', 'scope_id', 'kind', 'index', 'count'
+            )
+            counted = sorted(buckets)
+            self.assertEqual(rebuild_value_buckets(self.question, chunk_size=3), len(counted))
+            self.assertEqual(sorted(buckets), counted)
+
+
+class TermCountTest(TestCase):
+    """
+    Terms of free text answers, counted into term counts (see poll.text)
+    """
+    multi_db = True
+
+    def setUp(self):
+        self.lti_users = {}
+        for shard in ('shard1', 'shard2'):
+            consumer = LtiConsumer.objects.create(consumer_name=shard, shard=shard)
+            with use_shard(shard):
+                self.lti_users[shard] = LtiUser.objects.create(user_id='learner', lti_consumer=consumer)
+        self.question = Question.objects.create(question_text='Why?', question_type=Question.TEXT)
+
+    def answer(self, *texts, shard='shard1', context_id='course'):
+        with use_shard(shard):
+            for text in texts:
+                create_response(self.lti_users[shard], self.question, text=text, context_id=context_id)
+
+    def get_term_counts(self, shard='shard1'):
+        term_counts = TermCount.objects.using(shard).filter(question=self.question)
+        return sorted(term_counts.values_list('scope', 'scope_id', 'term', 'count'))
+
+    def test_tokenize(self):
+        self.assertEqual(tokenize('The CAT, the Cat; and the cat!'), ['cat', 'cat', 'cat'])
+        self.assertEqual(tokenize("I don't like well-known ideas..."), ['like', 'well-known', 'ideas'])
+        self.assertEqual(tokenize('Straße STRASSE ＡＢＣ'), ['strasse', 'strasse', 'abc'])
+        # numbers, single letters and stopwords are not terms
+        self.assertEqual(tokenize('42 x it is so -- _ 3d'), [])
+        self.assertEqual(tokenize(''), [])
+
+    def test_term_counts(self):
+        # terms are counted once per answer
+        self.answer('Fast fast FAST', 'fast and cheap')
+        self.answer('cheap', context_id='')
+        self.assertEqual(self.get_term_counts(), [
+            (Tally.CONTEXT, 'course', 'cheap', 1), (Tally.CONTEXT, 'course', 'fast', 2),
+            (Tally.GLOBAL, '', 'cheap', 2), (Tally.GLOBAL, '', 'fast', 2),
+        ])
+
+    def test_top_terms(self):
+        self.answer('red green blue', 'red green', 'red yellow', 'blue')
+        self.assertEqual(get_top_terms(self.question), [('red', 3), ('blue', 2), ('green', 2), ('yellow', 1)])
+        self.assertEqual(get_top_terms(self.question, k=2), [('red', 3), ('blue', 2)])
+        self.assertEqual(get_top_terms(Question.objects.create(question_text='Empty?')), [])
+
+    def test_top_terms_across_shards(self):
+        self.answer('red green', 'green')
+        self.answer('red', 'red blue', shard='shard2')
+        self.assertEqual(get_top_terms(self.question), [('red', 3), ('green', 2), ('blue', 1)])
+        with use_shard('shard2'):
+            self.assertEqual(get_top_terms(self.question, Tally.CONTEXT, 'course'), [('red', 2), ('blue', 1)])
+
+    def test_rebuild(self):
+        self.answer('red green blue', 'Red, red!', 'the end')
+        self.answer('green', context_id='')
+        counted = self.get_term_counts()
+        with use_shard('shard1'):
+            self.assertEqual(rebuild_term_counts(self.question, chunk_size=2), len(counted))
+        self.assertEqual(self.get_term_counts(), counted)
+
+
+class ScopeTest(TestCase):
+    """
+    Tallies of the global, course and resource link scopes, with learners of consumers on both shards
+    """
+    multi_db = True
+
+    def setUp(self):
+        self.consumers = {
+            shard: LtiConsumer.objects.create(consumer_name=shard, shard=shard) for shard in ('shard1', 'shard2')
+        }
+        self.question = Question.objects.create(question_text='Question?')
+        self.choice_a = Choice.objects.create(question=self.question, choice_text='A')
+        self.choice_b = Choice.objects.create(question=self.question, choice_text='B')
+
+    def answer(self, shard, user_id, choice, context_id='course', resource_link_id='link'):
+        with use_shard(shard):
+            lti_user = LtiUser.objects.create(user_id=user_id, lti_consumer=self.consumers[shard])
+            create_response(lti_user, self.question, choice=choice, context_id=context_id,
+                            resource_link_id=resource_link_id)
+
+    def get_tallies(self, shard):
+        return sorted(
+            Tally.objects.using(shard).filter(question=self.question).values_list('scope', 'scope_id', 'votes')
+        )
+
+    def test_vote(self):
+        with use_shard('shard1'):
+            LtiUser.objects.create(user_id='learner', lti_consumer=self.consumers['shard1'])
+        start_lti_session(self.client, self.consumers['shard1'], context_id='course', resource_link_id='link')
+        response = self.client.post(reverse('poll:vote', args=[self.question.pk]), {'choice': self.choice_a.pk})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(
+            self.get_tallies('shard1'),
+            [(Tally.CONTEXT, 'course', 1), (Tally.GLOBAL, '', 1), (Tally.RESOURCE_LINK, 'link', 1)]
+        )
+        self.assertEqual(self.get_tallies('shard2'), [])
+
+    def test_vote_counts(self):
+        self.answer('shard1', 'a', self.choice_a)
+        self.answer('shard1', 'b', self.choice_b, resource_link_id='other-link')
+        self.answer('shard2', 'c', self.choice_a)
+        self.answer('shard2', 'd', self.choice_a, context_id='other-course')
+
+        # global results are summed across the shards, the others are read from the current shard
+        self.assertEqual(get_vote_counts([self.question]), {self.choice_a.pk: 3, self.choice_b.pk: 1})
+        with use_shard('shard1'):
+            self.assertEqual(
+                get_vote_counts([self.question], Tally.CONTEXT, 'course'), {self.choice_a.pk: 1, self.choice_b.pk: 1}
+            )
+            self.assertEqual(get_vote_counts([self.question], Tally.RESOURCE_LINK, 'link'), {self.choice_a.pk: 1})
+        with use_shard('shard2'):
+            self.assertEqual(get_vote_counts([self.question], Tally.CONTEXT, 'course'), {self.choice_a.pk: 1})
+            self.assertEqual(get_vote_counts([self.question], Tally.RESOURCE_LINK, 'link'), {self.choice_a.pk: 2})
+
+    def test_results_scope(self):
+        with use_shard('shard1'):
+            LtiUser.objects.create(user_id='learner', lti_consumer=self.consumers['shard1'])
+        start_lti_session(self.client, self.consumers['shard1'], context_id='course')
+        url = reverse('poll:results', args=[self.question.pk])
+        # no resource link in the session: global results
+        for scope, expected in ((Tally.CONTEXT, (Tally.CONTEXT, 'course')), (Tally.RESOURCE_LINK, (Tally.GLOBAL, '')),
+                                ('other', (Tally.GLOBAL, '')), (None, (Tally.GLOBAL, ''))):
+            with self.subTest(scope=scope), mock.patch('poll.views.results_plot', return_value='') as results_plot, \
+                    mock.patch('poll.views.results_timeline', return_value='') as results_timeline:
+                response = self.client.get(url, {'scope': scope} if scope else {})
+                self.assertEqual(response.status_code, 200)
+                results_plot.assert_called_once_with(self.question, *expected)
+                results_timeline.assert_called_once_with(self.question, *expected, cumulative=True)
+                self.assertEqual(response.context['scope'], expected[0])
+                self.assertEqual(
+                    [scope for scope, label, scope_url in response.context['scope_urls']], [Tally.GLOBAL, Tally.CONTEXT]
+                )
+
+
+class PollSetTest(TestCase):
+    """
+    Questions of a poll set served and answered from a single launch
+    """
+    multi_db = True
+
+    def setUp(self):
+        self.consumer = LtiConsumer.objects.create(consumer_name='consumer', shard='shard1')
+        with use_shard('shard1'):
+            self.lti_user = LtiUser.objects.create(user_id='learner', lti_consumer=self.consumer)
+        self.question = Question.objects.create(question_text='Choice?')
+        self.choice = Choice.objects.create(question=self.question, choice_text='A')
+        self.numeric = Question.objects.create(
+            question_text='Value?', question_type=Question.NUMERIC, min_value=0, max_value=10
+        )
+        self.poll_set = PollSet.objects.create(title='Set')
+        PollSetQuestion.objects.create(poll_set=self.poll_set, question=self.numeric, order=2)
+        PollSetQuestion.objects.create(poll_set=self.poll_set, question=self.question, order=1)
+        start_lti_session(self.client, self.consumer, context_id='course', lis_result_sourcedid='result')
+
+    def get(self, position):
+        return self.client.get(reverse('poll:poll-set', args=[self.poll_set.pk]), {'q': position})
+
+    def vote(self, position, data):
+        url = reverse('poll:poll-set-vote', args=[self.poll_set.pk])
+        return self.client.post('{}?q={}'.format(url, position), data)
+
+    def get_responses(self):
+        with use_shard('shard1'):
+            return list(Response.objects.filter(lti_user=self.lti_user).order_by('question').values_list(
+                'question', 'choice', 'value'
+            ))
+
+    def test_view(self):
+        response = self.get(1)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['question'], self.question)
+        self.assertEqual((response.context['count'], response.context['answered']), (2, 0))
+        self.assertIsNone(response.context['previous_url'])
+        self.assertIn('q=2', response.context['next_url'])
+        self.assertIn('choice', response.context['form'].fields)
+        self.assertContains(response, 'Question 1 of 2')
+
+        response = self.get(2)
+        self.assertEqual(response.context['question'], self.numeric)
+        self.assertIn('value', response.context['form'].fields)
+        self.assertIn('q=1', response.context['previous_url'])
+        self.assertIsNone(response.context['next_url'])
+        # positions are clamped to the set
+        self.assertEqual(self.get(5).context['position'], 2)
+        self.assertEqual(self.get('x').context['position'], 1)
+
+    def test_empty_set(self):
+        poll_set = PollSet.objects.create(title='Empty')
+        response = self.client.get(reverse('poll:poll-set', args=[poll_set.pk]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_vote(self):
+        with mock.patch('poll.views.PollSetVoteView.update_grade') as update_grade:
+            response = self.vote(1, {'choice': self.choice.pk})
+            self.assertEqual(response.status_code, 302)
+            self.assertIn('q=1', response['Location'])
+            self.assertEqual(self.get_responses(), [(self.question.pk, self.choice.pk, None)])
+            # grade is only passed back once the whole set is answered
+            update_grade.assert_not_called()
+            response = self.get(1)
+            self.assertTrue(response.context['voted'])
+            self.assertEqual(response.context['answered'], 1)
+            self.assertNotIn('form', response.context)
+
+            self.vote(2, {'value': 4})
+            update_grade.assert_called_once_with(1.0)
+            # answering again doesn't record another response, nor pass back the grade again
+            self.vote(2, {'value': 5})
+            self.vote(1, {'choice': self.choice.pk})
+            update_grade.assert_called_once_with(1.0)
+        self.assertEqual(self.get_responses(), [(self.question.pk, self.choice.pk, None), (self.numeric.pk, None, 4)])
+        with use_shard('shard1'):
+            self.assertEqual(
+                Tally.objects.get(question=self.question, choice=self.choice, scope=Tally.CONTEXT).votes, 1
+            )
+
+    def test_invalid_vote(self):
+        with mock.patch('poll.views.PollSetVoteView.update_grade') as update_grade:
+            for position, data in ((1, {}), (1, {'choice': 0}), (2, {'value': 11}), (2, {'value': 'x'})):
+                with self.subTest(position=position, data=data):
+                    response = self.vote(position, data)
+                    self.assertEqual(response.status_code, 302)
+                    self.assertIn('q={}'.format(position), response['Location'])
+            update_grade.assert_not_called()
+        self.assertEqual(self.get_responses(), [])
+        self.assertEqual(self.get(1).context['answered'], 0)
+
+
+class ResponseAdminTest(TestCase):
+    """
+    Keyset pagination of the response change list (see ltiprovider.admin.KeysetChangeList)
+    """
+    multi_db = True
+
+    def setUp(self):
+        consumer = LtiConsumer.objects.create(consumer_name='consumer', shard='shard1')
+        self.questions = [Question.objects.create(question_text=text) for text in ('One?', 'Two?')]
+        with use_shard('shard1'):
+            lti_user = LtiUser.objects.create(user_id='learner', lti_consumer=consumer)
+            self.pks = [
+                Response.objects.create(lti_user=lti_user, question=self.questions[number % 2]).pk
+                for number in range(7)
+            ][::-1]
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        patcher = mock.patch.object(ResponseAdmin, 'list_per_page', 3)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get_page(self, query=''):
+        response = self.client.get(reverse('admin:poll_response_changelist') + query)
+        self.assertEqual(response.status_code, 200)
+        return response.context['cl']
+
+    def assert_page(self, changelist, pks, first=True, previous=True, next=True):
+        self.assertEqual([result.pk for result in changelist.result_list], pks)
+        for link, expected in ((changelist.keyset_first, first), (changelist.keyset_previous, previous),
+                               (changelist.keyset_next, next)):
+            self.assertEqual(bool(link), bool(expected))
+            if isinstance(expected, str):
+                self.assertEqual(link, expected)
+
+    def test_next_and_previous_pages(self):
+        pks = self.pks
+        changelist = self.get_page()
+        self.assert_page(changelist, pks[:3], first=False, previous=False, next='?after={}'.format(pks[2]))
+        self.assertEqual(changelist.result_count, 7)
+        changelist = self.get_page(changelist.keyset_next)
+        self.assert_page(changelist, pks[3:6], first='?', previous='?before={}'.format(pks[3]))
+        changelist = self.get_page(changelist.keyset_next)
+        self.assert_page(changelist, pks[6:], next=False)
+        self.assertEqual(changelist.result_count, 7)
+        # back from the last page
+        changelist = self.get_page(changelist.keyset_previous)
+        self.assert_page(changelist, pks[3:6], next='?after={}'.format(pks[5]))
+        changelist = self.get_page(changelist.keyset_previous)
+        self.assert_page(changelist, pks[:3], first=False, previous=False)
+        # a previous page short of list_per_page rows is the first page
+        self.assert_page(self.get_page('?before={}'.format(pks[1])), pks[:1], first=False, previous=False)
+
+    def test_invalid_cursor(self):
+        self.assert_page(self.get_page('?after=x'), self.pks[:3], first=False, previous=False)
+
+    def test_filter(self):
+        pks = Response.objects.using('shard1').filter(question=self.questions[0]).order_by('-pk').values_list(
+            'pk', flat=True
+        )
+        query = '?question__id__exact={}'.format(self.questions[0].pk)
+        # linked from the question change list, instead of a list filter of every question
+        self.assertContains(
+            self.client.get(reverse('admin:poll_question_changelist')),
+            'href="{}{}"'.format(reverse('admin:poll_response_changelist'), query)
+        )
+        changelist = self.get_page(query)
+        self.assert_page(changelist, list(pks[:3]), first=False, previous=False)
+        self.assertEqual(changelist.result_count, 4)
+        # the cursor keeps the filter, and changing the filter starts again from the first page
+        changelist = self.get_page(changelist.keyset_next)
+        self.assert_page(changelist, list(pks[3:]), next=False)
+        self.assertEqual(changelist.keyset_first, query)
+        self.assertNotIn('after', changelist.get_query_string({'question__id__exact': self.questions[1].pk}))
+
+    def test_ordering(self):
+        # ordering by another column is paginated by offset
+        changelist = self.get_page('?o=1&p=1')
+        self.assertEqual([result.pk for result in changelist.result_list], sorted(self.pks)[3:6])
+        self.assertEqual(changelist.paginator.num_pages, 3)
+        self.assertIsNone(changelist.keyset_next)
+        # ties on the ordered column are ordered by pk
+        responses = Response.objects.using('shard1').order_by('question', '-pk')
+        changelist = self.get_page('?o=2')
+        self.assertEqual([result.pk for result in changelist.result_list], [response.pk for response in responses[:3]])
+
+
+class DashboardTest(TestCase):
+    """
+    Course results of DashboardView, refreshed with the versions of DashboardDataView
+    """
+    multi_db = True
+
+    def setUp(self):
+        self.consumer = LtiConsumer.objects.create(consumer_name='consumer', shard='shard1')
+        self.question = Question.objects.create(question_text='Question?')
+        self.choice_a = Choice.objects.create(question=self.question, choice_text='A')
+        self.choice_b = Choice.objects.create(question=self.question, choice_text='B')
+        for user_id, choice in (('a', self.choice_a), ('b', self.choice_b)):
+            self.answer(user_id, choice)
+        start_lti_session(self.client, self.consumer, roles='Instructor', context_id='course')
+
+    def answer(self, user_id, choice):
+        with use_shard('shard1'):
+            lti_user, _ = LtiUser.objects.get_or_create(user_id=user_id, lti_consumer=self.consumer)
+            return create_response(lti_user, self.question, choice=choice, context_id='course')
+
+    def get_data(self, since=None):
+        """
+        :param since: dict, {question pk: version} known by the client
+        """
+        since = ','.join('{}:{}'.format(pk, version) for pk, version in (since or {}).items())
+        response = self.client.get(reverse('poll:dashboard-data'), {'since': since})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def get_votes(self, data):
+        return [[choice['votes'] for choice in question['choices']] for question in data['questions']]
+
+    def test_dashboard(self):
+        response = self.client.get(reverse('poll:dashboard'))
+        self.assertEqual(response.status_code, 200)
+        [result] = response.context['results']
+        self.assertEqual(result['total'], 2)
+        self.assertEqual([choice['votes'] for choice in result['choices']], [1, 1])
+
+    def test_learners_are_forbidden(self):
+        start_lti_session(self.client, self.consumer, roles='Learner', context_id='course')
+        self.assertEqual(self.client.get(reverse('poll:dashboard')).status_code, 403)
+        self.assertEqual(self.client.get(reverse('poll:dashboard-data')).status_code, 403)
+
+    def test_unchanged_version(self):
+        data = self.get_data()
+        self.assertEqual(self.get_votes(data), [[1, 1]])
+        data = self.get_data({int(pk): version for pk, version in data['versions'].items()})
+        self.assertEqual(data['questions'], [])
+
+    def test_version_changed_by_vote(self):
+        versions = {int(pk): version for pk, version in self.get_data()['versions'].items()}
+        self.answer('c', self.choice_a)
+        data = self.get_data(versions)
+        self.assertNotEqual(data['versions'], {str(pk): version for pk, version in versions.items()})
+        self.assertEqual(self.get_votes(data), [[2, 1]])
+
+    def test_version_changed_by_recount(self):
+        versions = {int(pk): version for pk, version in self.get_data()['versions'].items()}
+        # the same total, counted for other choices (e.g. tallies recounted after a consumer move)
+        Response.objects.using('shard1').update(choice=self.choice_a)
+        with use_shard('shard1'):
+            rebuild_tallies([self.question])
+        data = self.get_data(versions)
+        self.assertEqual(self.get_votes(data), [[2, 0]])
+
+
+class TimelineTest(TestCase):
+    """
+    Timeline buckets of a question without answer choices
+    """
+    multi_db = True
+
+    def setUp(self):
+        self.question = Question.objects.create(question_text='Value?', question_type=Question.NUMERIC)
+        self.created_at = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+    def test_bucket_created_twice(self):
+        bucket = dict(question=self.question, choice_id=NO_CHOICE, resolution=10, start=0)
+        with use_shard('shard1'):
+            TimelineBucket.objects.create(**bucket)
+            # e.g. two concurrent first responses in the bucket (see poll.counters.increment)
+            with self.assertRaises(IntegrityError), transaction.atomic(using='shard1'):
+                TimelineBucket.objects.create(**bucket)
+
+    def test_responses_without_choice(self):
+        with use_shard('shard1'), transaction.atomic(using='shard1'):
+            for _ in range(2):
+                record_response_time(self.question, get_counted_choices(self.question), self.created_at)
+        self.assertEqual(list(TimelineBucket.objects.using('shard1').values_list('choice', 'count')), [(0, 2)])
+        timeline = get_timeline(self.question)
+        self.assertEqual(timeline['choices'], [None])
+        self.assertEqual(timeline['counts'].tolist(), [[2]])
+
+
+class QueryPlanTest(TestCase):
+    """
+    Query counts and query plans of the hot request paths (see poll.queryplans)
+    """
+    multi_db = True
+
+    # {path name: {database: number of queries}}
+    query_counts = {
+        'validate_client_key': {'default': 1, 'shard1': 0, 'shard2': 0},
+        'get_or_create_lti_user': {'default': 1, 'shard1': 1, 'shard2': 0},
+        'QuestionView.get': {'default': 5, 'shard1': 2, 'shard2': 0},
+        # savepoint, response, tally and timeline bucket updates, savepoint release
+        'VoteView.post': {'default': 4, 'shard1': 6, 'shard2': 0},
+        # global tallies and timeline buckets are read from every shard
+        'ResultsView.get': {'default': 7, 'shard1': 4, 'shard2': 2},
+        'results_pie': {'default': 1, 'shard1': 1, 'shard2': 1},
+    }
+
+    def setUp(self):
+        self.consumer = LtiConsumer.objects.create(consumer_name='consumer', shard='shard1')
+        self.question = Question.objects.create(question_text='Question?')
+        choices = [Choice.objects.create(question=self.question, choice_text=text) for text in 'AB']
+        with use_shard('shard1'):
+            for number in range(3):
+                lti_user = LtiUser.objects.create(user_id=str(number), lti_consumer=self.consumer)
+                create_response(lti_user, self.question, choice=choices[number % 2], context_id='course')
+
+    def test_query_counts(self):
+        with use_shard('shard1'):
+            session_key = create_session(self.consumer)
+            for name, path in get_hot_paths(self.consumer, self.question):
+                with self.subTest(path=name), ExitStack() as stack:
+                    for alias, count in self.query_counts[name].items():
+                        stack.enter_context(self.assertNumQueries(count, using=alias))
+                    path(session_key)
+
+    def test_query_plans(self):
+        # every table counts as large: the hot paths only look up rows through indexes
+        report = check_query_plans(self.consumer, self.question, min_rows=0)
+        self.assertEqual(sorted(report), sorted(self.query_counts))
+        for name, path in report.items():
+            with self.subTest(path=name):
+                self.assertEqual(path['problems'], [])
+                self.assertEqual(path['queries'], sum(self.query_counts[name].values()))
+
+    def test_course_versions_plan(self):
+        statements = []
+        with use_shard('shard1'), connections['shard1'].execute_wrapper(QueryRecorder('shard1', statements)):
+            self.assertEqual(list(get_course_versions('course')), [self.question.pk])
+        scans = [scan for alias, sql, params in statements for scan in explain(alias, sql, params)]
+        self.assertEqual(get_scanned_tables(scans), [])
 
-# Create your tests here.
+    def test_scanned_tables(self):
+        scans = [
+            'SEARCH poll_tally USING INDEX poll_tally_question_id (question_id=?)',
+            'SCAN poll_response',
+            'SCAN TABLE poll_choice',
+            'SCAN poll_tally USING COVERING INDEX poll_tally_question_id',
+            'SCAN SUBQUERY 1',
+            'SCAN CONSTANT ROW',
+            'Index Scan on poll_tally using poll_tally_question_id',
+            'Seq Scan on ltiprovider_ltiuser',
+            'Index Only Scan on poll_timelinebucket using poll_timelinebucket_pkey (full)',
+        ]
+        self.assertEqual(
+            get_scanned_tables(scans),
+            ['poll_response', 'poll_choice', 'poll_tally', 'ltiprovider_ltiuser', 'poll_timelinebucket']
+        )
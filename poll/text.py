@@ -0,0 +1,115 @@
+"""
+Term index of the answers of free text questions.
+
+Each answer is normalized and tokenized once, as it is made, into TermCount counter rows in each tally scope.
+Results read the top terms in index order, in O(k) regardless of the number of answers or the vocabulary size.
+"""
+from collections import Counter
+from itertools import islice
+import re
+import unicodedata
+
+from django.db import router, transaction
+
+from .counters import get_scope_databases, get_scopes, increment, lock_counters
+from .models import Response, Tally, TermCount
+
+
+# words, including inner apostrophes and hyphens (e.g. "don't", "well-known")
+TOKEN_RE = re.compile(r"[^\W\d_]+(?:['-][^\W\d_]+)*")
+
+MIN_TERM_LENGTH = 2
+MAX_TERM_LENGTH = 100
+
+STOPWORDS = frozenset("""
+a about above after again against all am an and any are as at be because been before being below between both but by
+can could did do does doing don't down during each few for from further had has have having he her here hers herself
+him himself his how i i'm if in into is it it's its itself just me more most my myself no nor not now of off on once
+only or other our ours ourselves out over own same she should so some such than that the their theirs them themselves
+then there these they this those through to too under until up very was we were what when where which while who whom
+why will with would you your yours yourself yourselves
+""".split())
+
+
+def tokenize(text):
+    """
+    Normalize a free text answer into terms: unicode normalization, case folding, stopword removal
+    :param text: str
+    :return: list of str terms, in order of appearance
+    """
+    text = unicodedata.normalize('NFKC', text).casefold()
+    terms = []
+    for match in TOKEN_RE.finditer(text):
+        term = match.group()
+        if MIN_TERM_LENGTH <= len(term) <= MAX_TERM_LENGTH and term not in STOPWORDS:
+            terms.append(term)
+    return terms
+
+
+def get_answer_terms(text):
+    """
+    :return: set of terms counted for an answer; each term is counted once per answer
+    """
+    return set(tokenize(text))
+
+
+def record_text(question, text, context_id='', resource_link_id=''):
+    """
+    Count the terms of a free text answer in the term counts of each scope
+    Must be called in a transaction
+    """
+    terms = get_answer_terms(text)
+    for scope, scope_id in get_scopes(context_id, resource_link_id):
+        for term in terms:
+            increment(TermCount, 'count', question_id=question.pk, scope=scope, scope_id=scope_id, term=term)
+
+
+def get_top_terms(question, scope=Tally.GLOBAL, scope_id='', k=50):
+    """
+    Most frequent terms of the answers of a question within a scope
+    The global scope merges the top k terms of each shard database, so counts of terms
+    outside the top k of some shards may be underestimated
+    :return: list of (term, count) tuples, most frequent first
+    """
+    counts = Counter()
+    for database in get_scope_databases(scope, [question]):
+        terms = TermCount.objects.using(database).filter(question=question, scope=scope, scope_id=scope_id)
+        counts.update(dict(terms.order_by('-count', 'term').values_list('term', 'count')[:k]))
+    return sorted(counts.items(), key=lambda item: (-item[1], item[0]))[:k]
+
+
+def rebuild_term_counts(question, chunk_size=10000):
+    """
+    Recompute the term counts of a question from its responses, reading answers in batches of chunk_size.
+    The term counts are locked while the responses are counted, so that concurrent answers aren't lost
+    :param question: Question model instance
+    :return: int, number of term counts created
+    """
+    if not question.can_rebuild_counters():
+        return 0
+    with transaction.atomic(using=router.db_for_write(TermCount)):
+        lock_counters(TermCount, question=question)
+        rows = (
+            Response.objects
+            .filter(question=question)
+            .exclude(text='')
+            .values_list('text', 'context_id', 'resource_link_id')
+            .iterator(chunk_size=chunk_size)
+        )
+        counts = Counter()
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+            for text, context_id, resource_link_id in chunk:
+                terms = get_answer_terms(text)
+                for scope, scope_id in get_scopes(context_id, resource_link_id):
+                    counts.update((scope, scope_id, term) for term in terms)
+
+        term_counts = [
+            TermCount(question=question, scope=scope, scope_id=scope_id, term=term, count=count)
+            for (scope, scope_id, term), count in counts.items()
+        ]
+        TermCount.objects.filter(question=question).delete()
+        TermCount.objects.bulk_create(term_counts, batch_size=500)
+    return len(term_counts)
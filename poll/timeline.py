@@ -0,0 +1,218 @@
+"""
+Timeline of the responses to a question: number of responses per answer choice over time.
+
+Responses are counted in time buckets (TimelineBucket) as they are made, at the finest resolution (FINE_RESOLUTION).
+As buckets age they are rolled up into coarser buckets (see ROLLUPS and compact_timeline, run periodically),
+so that the number of buckets of a question stays small. Timelines are read from the buckets, in O(buckets).
+
+Responses are counted for the answer choices they are counted for in the tallies: the answer choice,
+each selected choice of a multiple choice answer, or the first preference of a ranked choice answer;
+responses to questions without answer choices are counted for NO_CHOICE.
+"""
+from collections import Counter
+from datetime import datetime, timezone
+from itertools import islice
+
+import numpy as np
+from django.db import router, transaction
+from django.utils import timezone as django_timezone
+
+from .ballots import decode_ballot
+from .counters import get_scope_databases, get_scopes, increment, lock_counters
+from .models import Question, Response, Tally, TimelineBucket
+
+
+# choice pk of the buckets of responses without an answer choice: a key instead of null, which unique indexes
+# don't match, so that concurrent responses can't create the same bucket twice (see poll.counters.increment)
+NO_CHOICE = 0
+
+# seconds, resolution of the buckets counted as responses are made
+FINE_RESOLUTION = 10
+
+# (resolution, coarser resolution, age in seconds from which buckets are rolled up into the coarser resolution)
+ROLLUPS = (
+    (10, 60, 24 * 3600),
+    (60, 3600, 7 * 24 * 3600),
+)
+
+# seconds, intervals of the timeline points
+INTERVALS = (10, 30, 60, 300, 600, 1800, 3600, 6 * 3600, 24 * 3600, 7 * 24 * 3600)
+
+
+def get_counted_choices(question, choice_pk=None, choice_pks=None):
+    """
+    :param choice_pk: int, answer choice pk of the response
+    :param choice_pks: list of int, selected or ranked choice pks of the response (see poll.ballots)
+    :return: list of choice pks (or [NO_CHOICE]) the response is counted for
+    """
+    if choice_pk is not None:
+        return [choice_pk]
+    if choice_pks:
+        if question.question_type == Question.RANKED:
+            return [choice_pks[0]]
+        return sorted(set(choice_pks))
+    return [NO_CHOICE]
+
+
+def get_resolution(start, now):
+    """
+    :param start: int, unix time of a response
+    :param now: int, current unix time
+    :return: int, resolution of the bucket of the response once it is rolled up (see ROLLUPS)
+    """
+    resolution = FINE_RESOLUTION
+    for fine, coarse, age in ROLLUPS:
+        if resolution == fine and start < (now - age) // coarse * coarse:
+            resolution = coarse
+    return resolution
+
+
+def record_response_time(question, choice_pks, created_at, context_id='', resource_link_id=''):
+    """
+    Count a response in the fine timeline bucket of each scope
+    Must be called in a transaction
+    :param choice_pks: list of choice pks (or [NO_CHOICE]), see get_counted_choices
+    :param created_at: datetime, time of the response
+    """
+    start = int(created_at.timestamp()) // FINE_RESOLUTION * FINE_RESOLUTION
+    for scope, scope_id in get_scopes(context_id, resource_link_id):
+        for choice_pk in choice_pks:
+            increment(
+                TimelineBucket, 'count',
+                question_id=question.pk, choice_id=choice_pk, scope=scope, scope_id=scope_id,
+                resolution=FINE_RESOLUTION, start=start
+            )
+
+
+def get_timeline(question, scope=Tally.GLOBAL, scope_id='', max_points=100):
+    """
+    Number of responses per answer choice in each interval, from the timeline buckets of a question within a scope.
+    The interval is the shortest of INTERVALS that gives at most max_points points,
+    and is at least the coarsest resolution of the buckets.
+    :return: dict, or None if there are no responses with a response time:
+        interval: int, seconds
+        starts: list of datetimes, start of each interval
+        choices: list of choice pks (None for responses without a choice)
+        counts: numpy array of responses, one row per choice and one column per interval
+    """
+    rows = []
+    for database in get_scope_databases(scope, [question]):
+        buckets = TimelineBucket.objects.using(database).filter(question=question, scope=scope, scope_id=scope_id)
+        rows.extend(buckets.values_list('choice', 'resolution', 'start', 'count'))
+    if not rows:
+        return None
+
+    choices, resolutions, starts, counts = zip(*rows)
+    resolutions = np.array(resolutions, dtype=np.int64)
+    starts = np.array(starts, dtype=np.int64)
+    first = int(starts.min())
+    span = int((starts + resolutions).max()) - first
+    interval = next(
+        (interval for interval in INTERVALS if interval * max_points >= span and interval >= resolutions.max()),
+        INTERVALS[-1]
+    )
+    origin = first // interval * interval
+    columns = (starts - origin) // interval
+
+    choice_pks = sorted(set(choices), key=lambda pk: (pk == NO_CHOICE, pk))
+    choice_rows = {pk: row for row, pk in enumerate(choice_pks)}
+    matrix = np.zeros((len(choice_pks), int(columns.max()) + 1), dtype=np.int64)
+    np.add.at(matrix, ([choice_rows[pk] for pk in choices], columns), counts)
+    return {
+        'interval': interval,
+        'starts': [
+            datetime.fromtimestamp(origin + column * interval, timezone.utc) for column in range(matrix.shape[1])
+        ],
+        'choices': [None if pk == NO_CHOICE else pk for pk in choice_pks],
+        'counts': matrix,
+    }
+
+
+def compact_timeline(question, now=None):
+    """
+    Roll up the timeline buckets of a question that are old enough into coarser buckets (see ROLLUPS)
+    :param now: int, current unix time
+    :return: int, number of buckets rolled up
+    """
+    now = int(now if now is not None else django_timezone.now().timestamp())
+    compacted = 0
+    for fine, coarse, age in ROLLUPS:
+        # only whole coarse buckets are rolled up, so that they aren't added to later
+        cutoff = (now - age) // coarse * coarse
+        buckets = TimelineBucket.objects.filter(question=question, resolution=fine, start__lt=cutoff)
+        rows = list(buckets.values_list('pk', 'choice', 'scope', 'scope_id', 'start', 'count'))
+        if not rows:
+            continue
+        counts = Counter()
+        for pk, choice_pk, scope, scope_id, start, count in rows:
+            counts[(choice_pk, scope, scope_id, start // coarse * coarse)] += count
+        with transaction.atomic(using=router.db_for_write(TimelineBucket)):
+            for (choice_pk, scope, scope_id, start), count in counts.items():
+                increment(
+                    TimelineBucket, 'count', count,
+                    question_id=question.pk, choice_id=choice_pk, scope=scope, scope_id=scope_id,
+                    resolution=coarse, start=start
+                )
+            pks = [row[0] for row in rows]
+            for batch in range(0, len(pks), 500):
+                TimelineBucket.objects.filter(pk__in=pks[batch:batch + 500]).delete()
+        compacted += len(rows)
+    return compacted
+
+
+def rebuild_timeline(question, chunk_size=10000, now=None):
+    """
+    Recompute the timeline buckets of a question from the times of its responses, e.g. to backfill historical
+    responses. Buckets are created at the resolution they would have been rolled up to (see get_resolution).
+    Responses without a response time are not counted.
+    The buckets are locked while the responses are counted, so that concurrent answers aren't lost.
+    :param now: int, current unix time
+    :return: int, number of timeline buckets created
+    """
+    if not question.can_rebuild_counters():
+        return 0
+    now = int(now if now is not None else django_timezone.now().timestamp())
+    with transaction.atomic(using=router.db_for_write(TimelineBucket)):
+        lock_counters(TimelineBucket, question=question)
+        rows = (
+            Response.objects
+            .filter(question=question, created_at__isnull=False)
+            .values_list('created_at', 'choice', 'ballot', 'context_id', 'resource_link_id')
+            .iterator(chunk_size=chunk_size)
+        )
+        counts = Counter()
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+            for created_at, choice_pk, ballot, context_id, resource_link_id in chunk:
+                time = int(created_at.timestamp())
+                resolution = get_resolution(time, now)
+                start = time // resolution * resolution
+                choice_pks = get_counted_choices(
+                    question, choice_pk, decode_ballot(ballot) if ballot is not None else None
+                )
+                for scope, scope_id in get_scopes(context_id, resource_link_id):
+                    for pk in choice_pks:
+                        counts[(pk, scope, scope_id, resolution, start)] += 1
+
+        buckets = [
+            TimelineBucket(
+                question=question, choice_id=choice_pk, scope=scope, scope_id=scope_id,
+                resolution=resolution, start=start, count=count
+            )
+            for (choice_pk, scope, scope_id, resolution, start), count in counts.items()
+        ]
+        TimelineBucket.objects.filter(question=question).delete()
+        TimelineBucket.objects.bulk_create(buckets, batch_size=500)
+    return len(buckets)
+
+
+def set_missing_response_times(question, created_at):
+    """
+    Set the response time of the responses of a question made before response times were recorded,
+    so that they are counted in the timeline (e.g. the time the question was published)
+    :param created_at: datetime
+    :return: int, number of responses updated
+    """
+    return Response.objects.filter(question=question, created_at__isnull=True).update(created_at=created_at)
@@ -9,6 +9,11 @@ urlpatterns = [
     path('<int:pk>/', views.QuestionView.as_view(), name='question'),
     path('<int:pk>/vote/', views.VoteView.as_view(), name='vote'),
     path('<int:pk>/results/', views.ResultsView.as_view(), name='results'),
+    path('<int:pk>/terms/', views.TermsView.as_view(), name='terms'),
+    path('set/<int:pk>/', views.PollSetView.as_view(), name='poll-set'),
+    path('set/<int:pk>/vote/', views.PollSetVoteView.as_view(), name='poll-set-vote'),
+    path('dashboard/', views.DashboardView.as_view(), name='dashboard'),
+    path('dashboard/data/', views.DashboardDataView.as_view(), name='dashboard-data'),
 
     path('<int:pk>/test/', views.QuestionTestView.as_view(), name='question-test'),
 ]
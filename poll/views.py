@@ -1,13 +1,27 @@
+import json
 import logging
-from django.views.generic.base import TemplateView
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.core.paginator import Paginator
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.shortcuts import redirect as url_redirect
+from django.urls import reverse
+from django.views.generic.base import TemplateView, View
 from django.views.generic import DetailView
 
 from ltiprovider.mixins import LtiMixin
-from ltiprovider.shortcuts import session_redirect as redirect
+from ltiprovider.routers import get_shard, use_shard
+from ltiprovider.shortcuts import session_redirect as redirect, session_url
 
+from .dashboard import get_course_results, get_course_versions, iter_course_results, parse_versions
 from .forms import QuestionForm
-from .models import Question, Response
-from .plots import results_pie
+from .models import PollSet, Question, Response, Tally
+from .plots import pie, results_plot, results_timeline
+from .tallies import create_response, get_learner_responses, get_vote_counts
+from .text import get_top_terms
+from .voters import has_voted
 
 
 log = logging.getLogger(__name__)
@@ -25,9 +39,12 @@ class QuestionView(LtiMixin, DetailView):
     def get(self, request, *args, **kwargs):
         question = self.get_object()
         lti_user = self.get_lti_user()
-        response = Response.objects.filter(lti_user=lti_user, question=question)
-        # Redirect to result page if learner has already answered the poll
-        if response.exists():
+        if question.anonymous:
+            answered = has_voted(question, lti_user)
+        else:
+            answered = Response.objects.filter(lti_user=lti_user, question=question).exists()
+        # Redirect to result page if learner has already answered the poll, or if it is closed
+        if answered or question.is_closed():
             return redirect('poll:results', request, pk=question.pk)
 
         return super().get(request, *args, **kwargs)
@@ -58,9 +75,12 @@ class QuestionTestView(DetailView):
 class VoteView(LtiMixin, DetailView):
     model = Question
     form_class = QuestionForm
+    template_name = 'poll/question.html'
 
     def post(self, request, *args, **kwargs):
         question = self.get_object()
+        if question.is_closed():
+            return redirect('poll:results', request, pk=question.pk)
         form = self.form_class(question, request.POST)
         if form.is_valid():
             # pass back grade to lti consumer if gradable
@@ -68,24 +88,312 @@ class VoteView(LtiMixin, DetailView):
                 score = 1.0  # score to pass back
                 self.update_grade(score)
 
-            # process form cleaned data
-            Response.objects.create(
-                lti_user=self.get_lti_user(),
-                question=question,
-                choice=form.cleaned_data['choice']
+            # process form cleaned data (answers to anonymous questions are only counted once per learner)
+            create_response(
+                self.get_lti_user(),
+                question,
+                context_id=request.session.get('context_id', ''),
+                resource_link_id=request.session.get('resource_link_id', ''),
+                **form.get_answer()
             )
             return redirect('poll:results', request, pk=question.pk)
+        # redisplay the question with the form errors
+        self.object = question
+        return self.render_to_response(self.get_context_data(form=form))
+
+
+class ScopeMixin:
+    """
+    Selection of the results scope with the "scope" url query/GET parameter:
+    all responses (default), or only those in the launch's course or lti component
+    """
+
+    def get_scope_ids(self):
+        """
+        :return: dict, {scope: scope id} for the course and lti component of the launch
+        """
+        return {
+            Tally.GLOBAL: '',
+            Tally.CONTEXT: self.request.session.get('context_id', ''),
+            Tally.RESOURCE_LINK: self.request.session.get('resource_link_id', ''),
+        }
+
+    def get_scope(self):
+        """
+        :return: (scope, scope_id) tuple
+        """
+        scope = self.request.GET.get('scope')
+        scope_id = self.get_scope_ids().get(scope)
+        if scope_id:
+            return scope, scope_id
+        return Tally.GLOBAL, ''
+
+    def get_scope_urls(self):
+        """
+        :return: list of (scope, label, url) tuples for the scopes available in this session
+        """
+        scope_ids = self.get_scope_ids()
+        urls = []
+        for scope, label in Tally.SCOPE_CHOICES:
+            if scope == Tally.GLOBAL or scope_ids[scope]:
+                url = "{}?{}".format(self.request.path, urlencode({'scope': scope}))
+                urls.append((scope, label, session_url(url, self.request)))
+        return urls
 
 
-class ResultsView(LtiMixin, DetailView):
+class ResultsView(ScopeMixin, LtiMixin, DetailView):
+    """
+    Results of a question, for all responses (default) or only those in the launch's course or lti component,
+    selected with the "scope" url query/GET parameter.
+    Also shows the responses over time, as totals (default) or per interval with the "timeline=interval" parameter
+    """
     model = Question
     template_name = 'poll/results.html'
+    TIMELINE_CHOICES = (('cumulative', 'Total'), ('interval', 'Per interval'))
 
     def get_context_data(self, **kwargs):
         question = self.get_object()
         context = super().get_context_data(**kwargs)
         lti_user = self.get_lti_user()
         response = Response.objects.filter(lti_user=lti_user, question=question).first()
+        scope, scope_id = self.get_scope()
         context['response'] = response
-        context['plot'] = results_pie(question)
+        context['scope'] = scope
+        context['scope_urls'] = self.get_scope_urls()
+        context['plot'] = results_plot(question, scope, scope_id)
+        timeline = 'interval' if self.request.GET.get('timeline') == 'interval' else 'cumulative'
+        context['timeline'] = timeline
+        context['timeline_urls'] = self.get_timeline_urls(scope)
+        context['timeline_plot'] = results_timeline(question, scope, scope_id, cumulative=timeline == 'cumulative')
         return context
+
+    def get_timeline_urls(self, scope):
+        """
+        :return: list of (timeline, label, url) tuples, keeping the results scope
+        """
+        return [
+            (
+                value, label,
+                session_url(
+                    "{}?{}".format(self.request.path, urlencode({'scope': scope, 'timeline': value})), self.request
+                )
+            )
+            for value, label in self.TIMELINE_CHOICES
+        ]
+
+
+class TermsView(ScopeMixin, LtiMixin, DetailView):
+    """
+    Most frequent terms of the answers to a free text question, as json {"terms": [[term, count], ...]}
+    Number of terms is set with the "k" url query/GET parameter (default 50, at most 500)
+    """
+    model = Question
+
+    def get(self, request, *args, **kwargs):
+        question = self.get_object()
+        scope, scope_id = self.get_scope()
+        try:
+            k = min(max(int(request.GET.get('k', 50)), 1), 500)
+        except ValueError:
+            k = 50
+        return JsonResponse({'terms': get_top_terms(question, scope, scope_id, k)})
+
+
+class PollSetMixin:
+    """
+    Helpers for views of a poll set, where the current question is selected
+    by its 1-based position in the set with the "q" url query/GET parameter
+    """
+    model = PollSet
+    form_class = QuestionForm
+
+    def get_position(self, questions):
+        """
+        :param questions: list of questions in the set
+        :return: int, position of the current question (clamped to the set)
+        """
+        if not questions:
+            raise Http404('Poll set has no questions')
+        try:
+            position = int(self.request.GET.get('q', 1))
+        except ValueError:
+            position = 1
+        return min(max(position, 1), len(questions))
+
+    def get_position_url(self, position, view_name='poll:poll-set'):
+        """
+        :param position: int, position of a question in the set
+        :return: str, url of the view for that question, including the session key if in url
+        """
+        url = "{}?{}".format(reverse(view_name, kwargs={'pk': self.object.pk}), urlencode({'q': position}))
+        return session_url(url, self.request)
+
+
+class PollSetView(PollSetMixin, LtiMixin, DetailView):
+    """
+    Serves all questions of a poll set from a single launch, with next/previous navigation.
+    Questions, choices, the learner's responses and vote counts are fetched in a constant number of queries.
+    """
+    template_name = 'poll/poll_set.html'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        questions = self.object.get_questions()
+        position = self.get_position(questions)
+        question = questions[position - 1]
+        responses = get_learner_responses(self.get_lti_user(), questions)
+        # answered anonymous questions have no response
+        voted = question.pk in responses
+        response = responses.get(question.pk)
+
+        context.update({
+            'question': question,
+            'position': position,
+            'count': len(questions),
+            'answered': len(responses),
+            'voted': voted,
+            'response': response,
+            'vote_url': self.get_position_url(position, 'poll:poll-set-vote'),
+            'previous_url': self.get_position_url(position - 1) if position > 1 else None,
+            'next_url': self.get_position_url(position + 1) if position < len(questions) else None,
+        })
+        # closed questions show their results instead of the form
+        voted = voted or question.is_closed()
+        if voted and question.question_type != Question.CHOICE:
+            context['plot'] = results_plot(question)
+        elif voted:
+            votes = get_vote_counts(questions)
+            choices = question.choice_set.all()  # prefetched
+            context['plot'] = pie(
+                [choice.choice_text for choice in choices],
+                [votes.get(choice.pk, 0) for choice in choices]
+            )
+        else:
+            context['form'] = self.form_class(question)
+        return context
+
+
+class PollSetVoteView(PollSetMixin, LtiMixin, DetailView):
+    """
+    Records the answer to a question of a poll set.
+    Grade is passed back to the lti consumer once, when the last unanswered question of the set is answered.
+    """
+
+    def post(self, request, *args, **kwargs):
+        self.object = self.get_object()
+        questions = self.object.get_questions()
+        position = self.get_position(questions)
+        question = questions[position - 1]
+        form = self.form_class(question, request.POST)
+        if form.is_valid():
+            lti_user = self.get_lti_user()
+            responses = get_learner_responses(lti_user, questions)
+            if question.pk not in responses and not question.is_closed():
+                responses[question.pk] = create_response(
+                    lti_user,
+                    question,
+                    context_id=request.session.get('context_id', ''),
+                    resource_link_id=request.session.get('resource_link_id', ''),
+                    **form.get_answer()
+                )
+                # pass back grade to lti consumer if gradable, once the whole set is answered
+                if len(responses) == len(questions) and self.is_graded():
+                    score = 1.0  # score to pass back
+                    self.update_grade(score)
+        return url_redirect(self.get_position_url(position))
+
+
+class DashboardMixin:
+    """
+    Helpers for the course dashboard views, available to instructors (see LtiMixin.is_instructor)
+    Questions are paginated with the "page" url query/GET parameter (POLL_DASHBOARD_PAGE_SIZE questions per page)
+    """
+
+    def get_context_id(self):
+        """
+        :return: str, lti context id of the launch's course
+        """
+        if not self.is_instructor():
+            raise PermissionDenied('The course dashboard is only available to instructors.')
+        context_id = self.request.session.get('context_id')
+        if not context_id:
+            raise Http404('Launch is not in a course')
+        return context_id
+
+    def get_page(self, versions):
+        """
+        :param versions: dict, {question pk: version} of the questions of the course
+        :return: Page of question pks
+        """
+        page_size = getattr(settings, 'POLL_DASHBOARD_PAGE_SIZE', 25)
+        return Paginator(list(versions), page_size).get_page(self.request.GET.get('page'))
+
+    def get_page_url(self, view_name, page=None):
+        url = reverse(view_name)
+        if page is not None:
+            url = "{}?{}".format(url, urlencode({'page': page}))
+        return session_url(url, self.request)
+
+
+class DashboardView(DashboardMixin, LtiMixin, TemplateView):
+    """
+    Results of all questions answered in the launch's course, for instructors.
+    Tallies of a page of questions are read in one query, and shown as bars (without plotly).
+    The page is refreshed incrementally with DashboardDataView, every POLL_DASHBOARD_REFRESH seconds.
+    """
+    template_name = 'poll/dashboard.html'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context_id = self.get_context_id()
+        versions = get_course_versions(context_id)
+        page = self.get_page(versions)
+        context.update({
+            'page': page,
+            'results': get_course_results(context_id, {pk: versions[pk] for pk in page}),
+            'data_url': self.get_page_url('poll:dashboard-data', page.number),
+            'previous_url': self.get_page_url('poll:dashboard', page.number - 1) if page.has_previous() else None,
+            'next_url': self.get_page_url('poll:dashboard', page.number + 1) if page.has_next() else None,
+            'refresh': getattr(settings, 'POLL_DASHBOARD_REFRESH', 10),
+        })
+        return context
+
+
+class DashboardDataView(DashboardMixin, LtiMixin, View):
+    """
+    Results of the questions answered in the launch's course as json, for instructors:
+    {"page": int, "pages": int, "versions": {question pk: version}, "questions": [results, see get_course_results]}
+    Only the results of questions whose version differs from the "since" url query/GET parameter
+    ("<question pk>:<version>,...") are included, so that polling clients only fetch what changed.
+    With the "stream" parameter, the results of all questions of the course are streamed instead,
+    as one json object per line.
+    """
+
+    def get(self, request, *args, **kwargs):
+        context_id = self.get_context_id()
+        versions = get_course_versions(context_id)
+        if 'stream' in request.GET:
+            return StreamingHttpResponse(
+                self.stream(context_id, versions, get_shard()), content_type='application/x-ndjson'
+            )
+
+        page = self.get_page(versions)
+        page_versions = {pk: versions[pk] for pk in page}
+        since = parse_versions(request.GET.get('since', ''))
+        changed = {pk: version for pk, version in page_versions.items() if since.get(pk) != version}
+        return JsonResponse({
+            'page': page.number,
+            'pages': page.paginator.num_pages,
+            'versions': page_versions,
+            'questions': get_course_results(context_id, changed) if changed else [],
+        })
+
+    def stream(self, context_id, versions, shard):
+        """
+        :param shard: str, shard database of the request; the response is streamed after the request's shard is reset
+        :return: generator of lines of json
+        """
+        chunk_size = getattr(settings, 'POLL_DASHBOARD_PAGE_SIZE', 25)
+        with use_shard(shard):
+            for result in iter_course_results(context_id, versions, chunk_size):
+                yield json.dumps(result) + '\n'
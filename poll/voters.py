@@ -0,0 +1,173 @@
+"""
+Learners who answered anonymous questions.
+
+Anonymous questions only count answers (tallies, value buckets, term counts, timeline), without a Response row
+linking the learner to their answer. Whether a learner has answered is recorded per question, as either:
+- a keyed hash of the learner (Voter): a 64-bit HMAC of the learner's identity, unique per question
+- a Bloom filter (VoterFilter), for questions with expected_voters set: a fixed number of bits per expected voter,
+  whatever the audience size, at the cost of a false positive rate (POLL_VOTER_FILTER_ERROR_RATE) of learners
+  wrongly seen as having voted. The filter is split in blocks of BLOCK_BITS bits, each learner setting bits in a
+  single block (a blocked Bloom filter), so that a vote locks and rewrites one small row.
+Both are checked and updated with a single indexed row lookup.
+
+Voter records, and the counters of anonymous questions (see poll.counters.get_counter_shard), are stored on a fixed
+shard database (POLL_VOTER_SHARD), whatever the shard of the learner's consumer: they aren't linked to consumers,
+so they couldn't be moved along with a consumer's data (see poll.shards).
+
+Hashes are keyed with SECRET_KEY, so that voters can't be matched to learners without it.
+Anonymous and expected_voters can't be changed once a question has answers (see Question.clean);
+changing the error rate setting resizes the filters of questions with votes, and forgets their voters.
+"""
+import math
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils.crypto import salted_hmac
+
+from ltiprovider.routers import get_shard_databases
+
+from .models import Voter, VoterFilter
+
+
+BLOCK_BITS = 512
+BLOCK_BYTES = BLOCK_BITS // 8
+
+
+def get_voter_shard():
+    """
+    :return: str, shard database alias of the voter records of anonymous questions
+        (POLL_VOTER_SHARD setting, default: the first shard); must not change once anonymous questions have answers
+    """
+    return getattr(settings, 'POLL_VOTER_SHARD', None) or get_shard_databases()[0]
+
+
+def get_voter_digest(question, lti_user):
+    """
+    :param question: Question model instance
+    :param lti_user: LtiUser model instance
+    :return: bytes, HMAC of the learner's identity for the question
+    """
+    value = '{}:{}:{}:{}'.format(
+        question.pk, lti_user.lti_consumer_id, lti_user.tool_consumer_instance_guid, lti_user.user_id
+    )
+    return salted_hmac('poll.voters', value).digest()
+
+
+def get_filter_size(expected_voters, error_rate=None):
+    """
+    Size of a Bloom filter for a number of voters and a false positive rate
+    :param error_rate: float, default POLL_VOTER_FILTER_ERROR_RATE setting
+    :return: (number of blocks, number of bits set per voter) tuple
+    """
+    if error_rate is None:
+        error_rate = getattr(settings, 'POLL_VOTER_FILTER_ERROR_RATE', 0.001)
+    bits = -expected_voters * math.log(error_rate) / math.log(2) ** 2
+    block_count = max(1, math.ceil(bits / BLOCK_BITS))
+    hash_count = max(1, min(16, round(bits / expected_voters * math.log(2))))
+    return block_count, hash_count
+
+
+def get_filter_position(question, digest):
+    """
+    :param digest: bytes, see get_voter_digest
+    :return: (block, bit mask) tuple of the learner in the Bloom filter of the question
+    """
+    block_count, hash_count = get_filter_size(question.expected_voters)
+    block = int.from_bytes(digest[:8], 'little') % block_count
+    # double hashing: bit i is h1 + i * h2
+    h1 = int.from_bytes(digest[8:12], 'little')
+    h2 = int.from_bytes(digest[12:16], 'little') | 1
+    mask = 0
+    for i in range(hash_count):
+        mask |= 1 << ((h1 + i * h2) % BLOCK_BITS)
+    return block, mask
+
+
+def to_int(digest):
+    """
+    :return: int, signed 64-bit integer of the first 8 bytes of a digest (see Voter.digest)
+    """
+    return int.from_bytes(digest[:8], 'little', signed=True)
+
+
+def has_voted(question, lti_user):
+    """
+    :return: bool, True if the learner has answered the anonymous question
+    """
+    return question.pk in get_voted_questions(lti_user, [question])
+
+
+def get_voted_questions(lti_user, questions):
+    """
+    Anonymous questions of a group of questions answered by a learner, in one query per kind of voter record
+    :param questions: iterable of Question model instances
+    :return: set of question pks
+    """
+    digests = {question.pk: get_voter_digest(question, lti_user) for question in questions if question.anonymous}
+    database = get_voter_shard()
+    voted = set()
+    hashed = {
+        question.pk: to_int(digests[question.pk])
+        for question in questions if question.anonymous and not question.expected_voters
+    }
+    if hashed:
+        rows = Voter.objects.using(database).filter(question__in=list(hashed), digest__in=list(hashed.values()))
+        voted.update(pk for pk, digest in rows.values_list('question', 'digest') if hashed[pk] == digest)
+    positions = {
+        question.pk: get_filter_position(question, digests[question.pk])
+        for question in questions if question.anonymous and question.expected_voters
+    }
+    if positions:
+        rows = VoterFilter.objects.using(database).filter(
+            question__in=list(positions), block__in={block for block, mask in positions.values()}
+        )
+        for pk, block, bits in rows.values_list('question', 'block', 'bits'):
+            if positions[pk][0] == block and is_set(bits, positions[pk][1]):
+                voted.add(pk)
+    return voted
+
+
+def is_set(bits, mask):
+    """
+    :param bits: bytes or memoryview, Bloom filter block
+    :return: bool, True if all bits of the mask are set in the block
+    """
+    return int.from_bytes(bytes(bits), 'little') & mask == mask
+
+
+def mark_voted(question, lti_user):
+    """
+    Record that a learner answered an anonymous question, unless they already did
+    Must be called in a transaction on the voter shard (see get_voter_shard), in which the answer is counted
+    :return: bool, False if the learner had already answered (the answer must not be counted)
+    """
+    database = get_voter_shard()
+    digest = get_voter_digest(question, lti_user)
+    if not question.expected_voters:
+        try:
+            # savepoint, so that a duplicate vote doesn't break the outer transaction
+            with transaction.atomic(using=database):
+                Voter.objects.using(database).create(question=question, digest=to_int(digest))
+        except IntegrityError:
+            return False
+        return True
+
+    block, mask = get_filter_position(question, digest)
+    # the block row is locked until the answer is counted, so that concurrent votes of a learner are counted once
+    rows = VoterFilter.objects.using(database).select_for_update().filter(question=question, block=block)
+    row = rows.first()
+    if row is None:
+        try:
+            with transaction.atomic(using=database):
+                VoterFilter.objects.using(database).create(
+                    question=question, block=block, bits=mask.to_bytes(BLOCK_BYTES, 'little')
+                )
+            return True
+        except IntegrityError:
+            row = rows.get()
+    if is_set(row.bits, mask):
+        return False
+    bits = int.from_bytes(bytes(row.bits), 'little') | mask
+    row.bits = bits.to_bytes(BLOCK_BYTES, 'little')
+    row.save(update_fields=['bits'])
+    return True